@@ -0,0 +1,141 @@
+import hashlib
+import hmac
+import os
+import random
+import sqlite3
+import uuid
+from datetime import datetime
+import passwords
+import storage
+
+# auth.py's old standalone user table, imported into the shared store once
+LEGACY_DB = "data/users.db"
+# Marks unsalted SHA-256 hashes carried over from LEGACY_DB until their owner next logs in
+LEGACY_PREFIX = "sha256$"
+
+
+def random_profile_pic():
+    return f"https://randomuser.me/api/portraits/{random.choice(['men','women'])}/{random.randint(1,100)}.jpg"
+
+
+def get(username):
+    return storage.get("users", username)
+
+
+def _find(index, term):
+    # Each of these indexes files a term under at most one user
+    for username in storage.lookup(index, term):
+        user = storage.get("users", username)
+        if user is not None:
+            return username, user
+    return None, None
+
+
+def find_by_username(username):
+    """Return (username as stored, user) ignoring case and surrounding spaces, or (None, None)"""
+    return _find("username_user", storage.normalize_username(username))
+
+
+def find_by_id(user_id):
+    """Return (username, user) for a user_id, or (None, None)"""
+    return _find("id_user", user_id)
+
+
+def find_by_email(email):
+    """Return (username, user) for an email address, or (None, None)"""
+    return _find("email_user", storage.normalize_email(email))
+
+
+def create(username, user):
+    """Insert a new user; returns False if the username or email is already taken.
+
+    Uniqueness is enforced by the store inside the insert itself, so two
+    concurrent signups for the same name cannot both succeed.
+    """
+    user = dict(user, username=username)
+    try:
+        storage.put_if_version("users", username, user, None)
+    except storage.ConflictError:
+        return False
+    return True
+
+
+def new_user(full_name, email, password_hash, account_type="general", **fields):
+    """Build a user record with the defaults every signup path shares"""
+    return {
+        "user_id": f"usr_{uuid.uuid4().hex[:8]}",
+        "full_name": full_name,
+        "email": email,
+        "password": password_hash,
+        "account_type": account_type,
+        "verified": False,
+        "joined_date": datetime.now().isoformat(),
+        "profile_pic": random_profile_pic(),
+        **fields
+    }
+
+
+def register(username, email, password, full_name=None, account_type="general", **fields):
+    """Hash the password and create the account; returns the user, or None if it already exists"""
+    username = username.strip()
+    if not storage.normalize_username(username):
+        return None
+    user = new_user(full_name or username, email, passwords.hash_password(password), account_type, **fields)
+    return dict(user, username=username) if create(username, user) else None
+
+
+def check_password(password, hashed):
+    """Verify against a bcrypt or legacy SHA-256 hash; returns (ok, new_hash) like passwords.verify_and_upgrade"""
+    if hashed.startswith(LEGACY_PREFIX):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        if not hmac.compare_digest(legacy, hashed[len(LEGACY_PREFIX):]):
+            return False, None
+        return True, passwords.hash_password(password)
+    return passwords.verify_and_upgrade(password, hashed)
+
+
+def authenticate(identifier, password):
+    """Log in by username or email; returns (username, user) or (None, None).
+
+    Legacy SHA-256 hashes and bcrypt hashes made with an old cost factor are
+    replaced with a fresh bcrypt hash on success.
+    """
+    username, user = find_by_username(identifier)
+    if user is None and "@" in (identifier or ""):
+        username, user = find_by_email(identifier)
+    if user is None:
+        return None, None
+    ok, new_hash = check_password(password, user["password"])
+    if not ok:
+        return None, None
+    if new_hash:
+        user = storage.update("users", username, lambda u: u.update({"password": new_hash})) or user
+    return username, user
+
+
+def import_legacy(path=LEGACY_DB):
+    """Copy auth.py's SQLite users into the shared store once; returns the number imported"""
+    if storage.get_meta("legacy_users_imported") or not os.path.exists(path):
+        return 0
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("SELECT username, email, password FROM users").fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        conn.close()
+
+    imported = 0
+    for username, email, hashed in rows:
+        if not username:
+            continue
+        user = new_user(username, email, LEGACY_PREFIX + hashed)
+        imported += create(username, user)
+    storage.set_meta("legacy_users_imported", datetime.now().isoformat())
+    return imported
+
+
+def init():
+    """Make sure the shared store exists and legacy users are in it"""
+    storage.init_storage()
+    return import_legacy()
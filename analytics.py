@@ -0,0 +1,155 @@
+from collections import Counter
+from datetime import datetime, timedelta
+import pandas as pd
+import storage
+
+# Counters kept for every business, with their dashboard labels
+METRICS = {
+    "reach": "Promotion reach",
+    "tagged_media": "Tagged media",
+    "claims": "Claims",
+    "circle_posts": "Circle posts",
+    "rsvps": "RSVPs",
+}
+DEFAULT_DAYS = 30
+
+# Records in the metrics collection, all holding {"counts": {name: n}} where name is a
+# metric or "<metric>:<subject id>" for the per-promotion, per-circle and per-event split:
+#   "<business_id>|total"  all-time counters
+#   "<business_id>|<day>"  that day's counters, plus "hours": {"HH": {metric: n}}
+TOTAL = "total"
+
+
+def _add(counts, added):
+    for name, n in added.items():
+        counts[name] = counts.get(name, 0) + n
+
+
+def record(business_id, counts, when=None):
+    """Add counts to a business's all-time, daily and hourly counters.
+
+    counts maps a metric, or "<metric>:<subject id>", to the amount to add.
+    Each bucket is one atomic update, so concurrent events are never lost.
+    """
+    counts = {name: n for name, n in counts.items() if n}
+    if not business_id or not counts:
+        return
+    when = when or datetime.now()
+    day, hour = when.strftime("%Y-%m-%d"), when.strftime("%H")
+    totals = {name: n for name, n in counts.items() if ":" not in name}
+
+    def add_total(bucket):
+        bucket["business_id"] = business_id
+        _add(bucket.setdefault("counts", {}), counts)
+
+    def add_day(bucket):
+        add_total(bucket)
+        bucket["day"] = day
+        _add(bucket.setdefault("hours", {}).setdefault(hour, {}), totals)
+
+    storage.update("metrics", f"{business_id}|{TOTAL}", add_total, default={})
+    storage.update("metrics", f"{business_id}|{day}", add_day, default={})
+
+
+def _count(metric, subject, n=1):
+    return {metric: n, f"{metric}:{subject}": n}
+
+
+def business_of_user(user_id):
+    """Key of the business a user owns, or None"""
+    keys = storage.lookup("owner_business", user_id) if user_id else []
+    return keys[0] if keys else None
+
+
+def business_of_circle(circle):
+    return business_of_user(circle.get("creator")) if circle and circle.get("business_owned") else None
+
+
+def business_of_event(event):
+    """The business that organized an event, or that owns its circle"""
+    business_id = business_of_user(event.get("organizer"))
+    if business_id is None and event.get("circle_id"):
+        business_id = business_of_circle(storage.get("circles", event["circle_id"]))
+    return business_id
+
+
+def record_upload(item, matched, when=None):
+    """Count an upload against the promotions it qualified for and the business circle it was shared to.
+
+    Reach is everyone who can see the photo: the uploader and the other
+    members of the circle it was shared to.
+    """
+    circle = storage.get("circles", item["circle_id"]) if item.get("circle_id") else None
+    audience = 1 + len(set((circle or {}).get("members") or []) - {item.get("user_id")})
+    by_business = {}
+    for promo in matched:
+        counts = by_business.setdefault(promo.get("business_id"), Counter())
+        counts.update(_count("tagged_media", promo["promo_id"]))
+        counts.update(_count("reach", promo["promo_id"], audience))
+    circle_business = business_of_circle(circle)
+    if circle_business is not None:
+        by_business.setdefault(circle_business, Counter()).update(_count("circle_posts", circle["circle_id"]))
+    for business_id, counts in by_business.items():
+        record(business_id, counts, when)
+
+
+def record_claim(promo, when=None):
+    record(promo.get("business_id"), _count("claims", promo["promo_id"]), when)
+
+
+def record_rsvp(event, when=None):
+    record(business_of_event(event), _count("rsvps", event["event_id"]), when)
+
+
+def totals(business_id):
+    """All-time counters of a business, including the per-subject split"""
+    return (storage.get("metrics", f"{business_id}|{TOTAL}") or {}).get("counts", {})
+
+
+def breakdown(business_id, metric):
+    """{subject id: count} of one metric"""
+    prefix = f"{metric}:"
+    return {name[len(prefix):]: n for name, n in totals(business_id).items() if name.startswith(prefix)}
+
+
+def _days(business_id, days, end):
+    end = end or datetime.now()
+    dates = [(end - timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(days - 1, -1, -1)]
+    found = {r["day"]: r for r in storage.get_many("metrics", [f"{business_id}|{d}" for d in dates])}
+    return [(d, found.get(d, {})) for d in dates]
+
+
+def daily(business_id, days=DEFAULT_DAYS, end=None):
+    """[(day, {metric: n})] for the days up to end (today), oldest first, zeros included"""
+    return [
+        (day, {metric: bucket.get("counts", {}).get(metric, 0) for metric in METRICS})
+        for day, bucket in _days(business_id, days, end)
+    ]
+
+
+def hourly(business_id, days=1, end=None):
+    """[(hour start, {metric: n})] for every hour of the days up to end (today), oldest first"""
+    series = []
+    for day, bucket in _days(business_id, days, end):
+        start = datetime.strptime(day, "%Y-%m-%d")
+        hours = bucket.get("hours", {})
+        for hour in range(24):
+            counts = hours.get(f"{hour:02d}", {})
+            series.append((start + timedelta(hours=hour), {metric: counts.get(metric, 0) for metric in METRICS}))
+    return series
+
+
+def to_frame(series):
+    """DataFrame of a daily() or hourly() series: one row per period, one int column per metric"""
+    frame = pd.DataFrame(
+        [counts for _, counts in series],
+        index=pd.DatetimeIndex([pd.Timestamp(period) for period, _ in series], name="period"),
+        columns=list(METRICS),
+    )
+    return frame.fillna(0).astype("int64")
+
+
+def export(business_id, resolution="daily", days=DEFAULT_DAYS, end=None):
+    """Pre-aggregated series of a business as a DataFrame ("daily" or "hourly")"""
+    series = hourly(business_id, days, end) if resolution == "hourly" else daily(business_id, days, end)
+    return to_frame(series)
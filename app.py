@@ -1,512 +1,161 @@
 import streamlit as st
-import bcrypt
-import json
 import os
-import time
-from datetime import datetime, timedelta
-from PIL import Image
-import random
+from datetime import datetime
 import uuid
-
-def load_css():
-    """Define all CSS styling for the application"""
-    st.markdown(f"""
-    <style>
-    /* Color Variables */
-    :root {{
-        --primary: #4361ee;
-        --secondary: #3f37c9;
-        --accent: #4895ef;
-        --light: #f8f9fa;
-        --dark: #212529;
-        --success: #4cc9f0;
-        --warning: #f72585;
-        --danger: #7209b7;
-    }}
-
-    body {{
-        font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-        line-height: 1.6;
-        color: var(--dark);
-    }}
-
-    /* Fix for recent activity font color */
-    .activity-item {{
-        color: #212529 !important;
-    }}
-
-    .activity-item div {{
-        color: #212529 !important;
-    }}
-
-    .main-container {{
-        max-width: 1200px;
-        margin: 0 auto;
-        padding: 20px;
-    }}
-
-    .card {{
-        border-radius: 12px;
-        box-shadow: 0 4px 8px 0 rgba(0,0,0,0.1);
-        padding: 20px;
-        margin-bottom: 25px;
-        background-color: white;
-        transition: transform 0.3s, box-shadow 0.3s;
-        border: 1px solid #e9ecef;
-    }}
-
-    .card:hover {{
-        transform: translateY(-5px);
-        box-shadow: 0 8px 16px 0 rgba(0,0,0,0.15);
-    }}
-
-    .card-title {{
-        color: var(--primary);
-        margin-bottom: 15px;
-        font-size: 1.2rem;
-    }}
-
-    .stats-card {{
-        border-radius: 12px;
-        padding: 20px;
-        margin-bottom: 15px;
-        background-color: white;
-        box-shadow: 0 4px 8px 0 rgba(0,0,0,0.1);
-        border: 1px solid #e9ecef;
-        text-align: center;
-    }}
-
-    .stats-card h3 {{
-        color: #6c757d;
-        font-size: 1rem;
-        margin-bottom: 5px;
-    }}
-
-    .stats-card .value {{
-        font-size: 2rem;
-        font-weight: bold;
-        color: #4361ee;
-        margin: 10px 0;
-    }}
-
-    .stButton>button {{
-        border-radius: 8px;
-        padding: 8px 16px;
-        background-color: var(--primary);
-        color: white;
-        border: none;
-        transition: background-color 0.3s;
-    }}
-
-    .stButton>button:hover {{
-        background-color: var(--secondary);
-    }}
-
-    .stTextInput>div>div>input, 
-    .stTextArea>div>textarea {{
-        border-radius: 8px;
-        border: 1px solid #ced4da;
-    }}
-
-    .stSelectbox>div>div>div {{
-        border-radius: 8px;
-    }}
-
-    .sidebar .sidebar-content {{
-        background-color: var(--light);
-        padding: 15px;
-    }}
-
-    .sidebar .sidebar-content .block-container {{
-        padding-top: 0;
-    }}
-
-    .hero-container {{
-        position: relative;
-        text-align: center;
-        margin-bottom: 30px;
-    }}
-
-    .hero-text {{
-        position: absolute;
-        top: 50%;
-        left: 50%;
-        transform: translate(-50%, -50%);
-        color: white;
-        text-shadow: 2px 2px 4px rgba(0,0,0,0.5);
-    }}
-
-    .hero-title {{
-        font-size: 2.5rem;
-        margin-bottom: 10px;
-    }}
-
-    .activity-item {{
-        background-color: #f8f9fa;
-        padding: 15px;
-        border-radius: 10px;
-        margin-bottom: 10px;
-        border-left: 4px solid var(--accent);
-    }}
-
-    .activity-time {{
-        color: #6c757d;
-        font-size: 0.8rem;
-    }}
-
-    .activity-tab {{
-        border-bottom: 1px solid #dee2e6;
-        padding-bottom: 10px;
-        margin-bottom: 15px;
-    }}
-
-    @media (max-width: 768px) {{
-        .hero-title {{
-            font-size: 1.8rem;
-        }}
-        .card {{
-            margin-bottom: 15px;
-        }}
-    }}
-
-    /* Make "Sign up now" look like a link */
-    button[kind="secondary"][data-testid="baseButton-signup_now"] {{
-        background: none;
-        border: none;
-        color: #4361ee;
-        font-weight: bold;
-        text-align: left;
-        padding: 0;
-        margin-top: -10px;
-        cursor: pointer;
-    }}
-    </style>
-    """, unsafe_allow_html=True)
-
-def card(title, content, image=None, action_button=None, key=None):
-    """Reusable card component with optional image and action button"""
-    try:
-        img_html = f'<img src="{image}" style="width:100%; border-radius:8px; margin-bottom:15px;">' if image else ''
-    except:
-        img_html = ''
-    
-    if key is None:
-        key = f"card_{title}_{random.randint(0, 10000)}"
-    
-    st.markdown(f"""
-    <div class="card">
-        <div class="card-title">{title}</div>
-        {img_html}
-        <div class="card-content">{content}</div>
-    </div>
-    """, unsafe_allow_html=True)
-    
-    if action_button:
-        return st.button(action_button, key=key)
-    return None
-
-def hero_section(title, subtitle, image_url):
-    """Hero banner component with title and subtitle"""
-    try:
-        # Check if image_url is accessible before using it
-        st.markdown(f"""
-        <div class="hero-container">
-            <img src="{image_url}" style="width:100%; border-radius:8px;">
-            <div class="hero-text">
-                <h1 class="hero-title">{title}</h1>
-                <p>{subtitle}</p>
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
-    except Exception as e:
-        st.error(f"Could not load hero image: {str(e)}")
-        st.markdown(f"""
-        <div class="hero-container" style="background-color: #4361ee; padding: 50px; border-radius: 8px;">
-            <div class="hero-text" style="position: static; transform: none;">
-                <h1 class="hero-title" style="color: white;">{title}</h1>
-                <p style="color: white;">{subtitle}</p>
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
-
-def activity_item(user, action, time_ago):
-    """Activity feed item component"""
-    st.markdown(f"""
-    <div class="activity-item">
-        <strong>{user}</strong> {action}
-        <div class="activity-time">{time_ago}</div>
-    </div>
-    """, unsafe_allow_html=True)
-
-def stats_card(title, value):
-    st.markdown(f"""
-    <div class="stats-card">
-        <h3>{title}</h3>
-        <div class="value">{value}</div>
-    </div>
-    """, unsafe_allow_html=True)
+import accounts
+import analytics
+import assets
+import geo
+import media
+import notifications
+import promotions
+import queries
+import recommend
+import search
+import seed
+import sessions
+import storage
+from components import card, hero_section, load_css, stats_card
+from media import MEDIA_DIR
 
 # ===== DATABASE CONFIGURATION =====
-DB_FILES = {
-    "users": "data/users.json",
-    "businesses": "data/businesses.json",
-    "media": "data/media.json",
-    "circles": "data/circles.json",
-    "events": "data/events.json",
-    "promotions": "data/promotions.json",
-    "notifications": "data/notifications.json",
-    "reports": "data/reports.json"
+# Events shown on the Explore page
+EXPLORE_EVENTS = 3
+# Circles and events listed in the Discover tab
+DISCOVER_LIMIT = 5
+# Matches shown for an Explore page search
+SEARCH_LIMIT = 8
+# Icon and title field of each searchable collection
+SEARCH_RESULTS = {
+    "circles": ("👥", "name"),
+    "events": ("📅", "name"),
+    "businesses": ("🏢", "business_name"),
+    "promotions": ("🎁", "offer"),
 }
 
-MEDIA_DIR = "media_gallery"
 os.makedirs("data", exist_ok=True)
 os.makedirs(MEDIA_DIR, exist_ok=True)
 
-def init_db():
-    """Initialize database files with empty structures"""
-    for file_key, file_path in DB_FILES.items():
-        if not os.path.exists(file_path):
-            try:
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                with open(file_path, "w") as f:
-                    if file_key in ["users", "businesses", "circles", "events", "promotions", "notifications"]:
-                        json.dump({}, f)
-                    else:
-                        json.dump([], f)
-            except Exception as e:
-                st.error(f"Failed to initialize database file {file_path}: {str(e)}")
+def get_record(file_key, key, default=None):
+    """Load a single record from a collection"""
+    try:
+        return storage.get(file_key, key, default)
+    except Exception as e:
+        st.error(f"Database error: Unable to load {file_key}/{key}. Error: {str(e)}")
+        return default
 
-def load_db(file_key, retry_count=0, max_retries=1):
-    """Load database file"""
+def put_record(file_key, key, record):
+    """Insert or replace a single record"""
     try:
-        if not os.path.exists(DB_FILES[file_key]):
-            if retry_count >= max_retries:
-                return {} if file_key in ["users", "businesses", "circles", "events", "promotions", "notifications"] else []
-            init_db()
-            
-        with open(DB_FILES[file_key], "r") as f:
-            data = json.load(f)
-            if file_key in ["users", "businesses", "circles", "events", "promotions", "notifications"] and not isinstance(data, dict):
-                return {}
-            elif file_key in ["media", "reports"] and not isinstance(data, list):
-                return []
-            return data
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        if retry_count >= max_retries:
-            st.error(f"Database error: Unable to load {file_key}. Error: {str(e)}")
-            return {} if file_key in ["users", "businesses", "circles", "events", "promotions", "notifications"] else []
-        time.sleep(0.1)
-        init_db()
-        return load_db(file_key, retry_count + 1)
+        storage.put(file_key, key, record)
+    except Exception as e:
+        st.error(f"Failed to save {file_key}/{key}: {str(e)}")
 
-def save_db(file_key, data):
-    """Save database file"""
+def update_record(file_key, key, fn, default=None):
+    """Atomically read-modify-write a single record"""
     try:
-        with open(DB_FILES[file_key], "w") as f:
-            json.dump(data, f, indent=2)
+        return storage.update(file_key, key, fn, default)
     except Exception as e:
-        st.error(f"Failed to save database file {DB_FILES[file_key]}: {str(e)}")
+        st.error(f"Failed to update {file_key}/{key}: {str(e)}")
+
+@st.cache_resource
+def bootstrap_db():
+    """Create the schema and seed sample data once per server process.
+
+    Errors propagate so a failed bootstrap is not cached and the next rerun tries again.
+    """
+    seed.bootstrap()
+    media.resume_pending()
+    assets.preload()
+
+def current_user():
+    """Profile of the logged-in user from the shared profile cache; None when logged out"""
+    return sessions.profile(st.session_state.get("session_id"))
 
 def generate_id(prefix):
     """Generate unique ID"""
     return f"{prefix}_{uuid.uuid4().hex[:8]}"
 
-def hash_password(password):
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
-
-def verify_password(password, hashed):
-    return bcrypt.checkpw(password.encode(), hashed.encode())
-
 def add_notification(user_id, notification_type, content, related_id=None):
     """Add notification to user's feed"""
-    notifications = load_db("notifications")
-    if user_id not in notifications:
-        notifications[user_id] = []
-    
-    notifications[user_id].append({
-        "notification_id": generate_id("notif"),
-        "type": notification_type,
-        "content": content,
-        "timestamp": datetime.now().isoformat(),
-        "read": False,
-        "related_id": related_id
-    })
-    save_db("notifications", notifications)
+    try:
+        notifications.add(user_id, notification_type, content, related_id)
+    except Exception as e:
+        st.error(f"Failed to add notification: {str(e)}")
+
+def find_records(index, term):
+    """Load the records filed under term in a secondary index"""
+    try:
+        return storage.find(index, term)
+    except Exception as e:
+        st.error(f"Database error: Unable to query {index}. Error: {str(e)}")
+        return []
+
+def get_user_business(user_id):
+    """Get the business owned by a user, or None"""
+    businesses = find_records("owner_business", user_id)
+    return businesses[0] if businesses else None
+
+def get_dashboard(user_id):
+    """Get circles, upcoming events, media count and latest notifications for the home page"""
+    try:
+        return queries.dashboard(user_id)
+    except Exception as e:
+        st.error(f"Database error: Unable to load dashboard. Error: {str(e)}")
+        return {
+            "circles": [], "event_count": 0, "upcoming_events": [],
+            "media_count": 0, "notifications": [], "unread_count": 0
+        }
 
 def get_user_media(user_id):
     """Get all media for a specific user"""
-    media = load_db("media")
-    return [m for m in media if m["user_id"] == user_id]
+    return find_records("user_media", user_id)
 
 def get_user_circles(user_id):
     """Get all circles a user belongs to"""
-    circles = load_db("circles")
-    return [c for c in circles.values() if user_id in c["members"]]
+    return find_records("user_circles", user_id)
+
+def organizer_name(event):
+    """Display name of an event's organizer"""
+    _, organizer = accounts.find_by_id(event.get("organizer"))
+    return organizer["full_name"] if organizer else "Unknown"
+
+def rsvp_button(event, user_id, key_prefix):
+    """RSVP or cancel button for one event; seats are claimed atomically"""
+    if user_id in event.get("attendees", []):
+        if st.button("Cancel RSVP", key=f"{key_prefix}_cancel_{event['event_id']}"):
+            queries.cancel_rsvp(event["event_id"], user_id)
+            st.rerun()
+    elif st.button("RSVP", key=f"{key_prefix}_rsvp_{event['event_id']}"):
+        try:
+            queries.rsvp(event["event_id"], user_id)
+            st.success(f"RSVP confirmed for {event['name']}!")
+            st.rerun()
+        except queries.EventFull:
+            st.error(f"Sorry, {event['name']} is full")
+        except KeyError:
+            st.error("This event is no longer available")
+
+def claim_button(promo_id, user_id, key):
+    """Claim button for a promotion the user qualified for"""
+    promo = get_record("promotions", promo_id)
+    if promo is None:
+        return
+    if user_id in promo.get("claimed_by", []):
+        st.caption("✅ Offer claimed")
+    elif not promotions.is_active(promo, datetime.now().strftime("%Y-%m-%d")):
+        st.caption("This offer has ended")
+    elif st.button(f"Claim {promo['offer']}", key=f"claim_{key}"):
+        try:
+            promotions.claim(promo_id, user_id)
+            st.success(f"Claimed {promo['offer']}!")
+            st.rerun()
+        except KeyError:
+            st.error("This promotion is no longer available")
 
 def get_circle_events(circle_id):
     """Get all events for a specific circle"""
-    events = load_db("events")
-    return [e for e in events.values() if e["circle_id"] == circle_id]
-
-def generate_sample_data():
-    """Generate sample data if databases are empty"""
-    users = load_db("users")
-    if not users:
-        users["sample_user"] = {
-            "user_id": "usr_123",
-            "full_name": "John Doe",
-            "email": "john@example.com",
-            "password": hash_password("password123"),
-            "account_type": "general",
-            "verified": True,
-            "joined_date": datetime.now().strftime("%Y-%m-%d"),
-            "interests": ["music", "tech"],
-            "location": {"city": "New York", "lat": 40.7128, "lng": -74.0060},
-            "profile_pic": "https://randomuser.me/api/portraits/men/1.jpg"
-        }
-        
-        # Add UAE sample user
-        users["uae_user"] = {
-            "user_id": "usr_124",
-            "full_name": "Ahmed Al Maktoum",
-            "email": "ahmed@example.com",
-            "password": hash_password("password123"),
-            "account_type": "general",
-            "verified": True,
-            "joined_date": datetime.now().strftime("%Y-%m-%d"),
-            "interests": ["photography", "food"],
-            "location": {"city": "Dubai", "lat": 25.2048, "lng": 55.2708},
-            "profile_pic": "https://randomuser.me/api/portraits/men/30.jpg"
-        }
-        save_db("users", users)
-    
-    circles = load_db("circles")
-    if not circles:
-        # Original circle
-        circles["cir_123"] = {
-            "circle_id": "cir_123",
-            "name": "NYC Photographers",
-            "description": "For photography enthusiasts in NYC",
-            "type": "public",
-            "location": {"city": "New York", "lat": 40.7128, "lng": -74.0060},
-            "members": ["usr_123"],
-            "events": ["evt_123"],
-            "business_owned": False,
-            "created_at": datetime.now().isoformat()
-        }
-        
-        # UAE circles
-        circles["cir_124"] = {
-            "circle_id": "cir_124",
-            "name": "Dubai Photography Enthusiasts",
-            "description": "For photography lovers in Dubai to share and learn",
-            "type": "public",
-            "location": {"city": "Dubai", "lat": 25.2048, "lng": 55.2708},
-            "members": ["usr_124"],
-            "events": ["evt_124"],
-            "business_owned": False,
-            "created_at": datetime.now().isoformat(),
-            "tags": ["photography", "dubai"]
-        }
-        
-        circles["cir_125"] = {
-            "circle_id": "cir_125",
-            "name": "Sharjah Foodies",
-            "description": "Discover and share the best food spots in Sharjah",
-            "type": "public",
-            "location": {"city": "Sharjah", "lat": 25.3463, "lng": 55.4209},
-            "members": [],
-            "events": ["evt_125"],
-            "business_owned": False,
-            "created_at": datetime.now().isoformat(),
-            "tags": ["food", "sharjah"]
-        }
-        
-        circles["cir_126"] = {
-            "circle_id": "cir_126",
-            "name": "Sheikh Zayed Road Business Network",
-            "description": "Professional networking for businesses along SZ Road",
-            "type": "private",
-            "location": {"city": "Dubai", "lat": 25.2048, "lng": 55.2708},
-            "members": [],
-            "events": [],
-            "business_owned": True,
-            "created_at": datetime.now().isoformat(),
-            "tags": ["business", "networking"]
-        }
-        save_db("circles", circles)
-    
-    events = load_db("events")
-    if not events:
-        # Original event
-        events["evt_123"] = {
-            "event_id": "evt_123",
-            "circle_id": "cir_123",
-            "name": "Sunset Photography Meetup",
-            "description": "Let's capture the sunset together!",
-            "location": {"name": "Brooklyn Bridge", "lat": 40.7061, "lng": -73.9969},
-            "date": datetime.now().strftime("%Y-%m-%d"),
-            "time": "18:00",
-            "organizer": "usr_123",
-            "attendees": ["usr_123"],
-            "capacity": 20,
-            "tags": ["photography", "outdoors"],
-            "created_at": datetime.now().isoformat()
-        }
-        
-        # UAE events
-        events["evt_124"] = {
-            "event_id": "evt_124",
-            "circle_id": "cir_124",
-            "name": "Burj Khalifa Night Photography",
-            "description": "Night photography session at Burj Khalifa",
-            "location": {"name": "Burj Khalifa, Dubai", "lat": 25.1972, "lng": 55.2744},
-            "date": (datetime.now() + timedelta(days=7)).strftime("%Y-%m-%d"),
-            "time": "19:00",
-            "organizer": "usr_124",
-            "attendees": ["usr_124"],
-            "capacity": 15,
-            "tags": ["photography", "dubai", "landmarks"],
-            "created_at": datetime.now().isoformat()
-        }
-        
-        events["evt_125"] = {
-            "event_id": "evt_125",
-            "circle_id": "cir_125",
-            "name": "Sharjah Street Food Tour",
-            "description": "Explore hidden street food gems in Sharjah",
-            "location": {"name": "Al Qasba, Sharjah", "lat": 25.3471, "lng": 55.3913},
-            "date": (datetime.now() + timedelta(days=14)).strftime("%Y-%m-%d"),
-            "time": "18:00",
-            "organizer": "usr_124",
-            "attendees": [],
-            "capacity": 10,
-            "tags": ["food", "sharjah", "tour"],
-            "created_at": datetime.now().isoformat()
-        }
-        save_db("events", events)
-    
-    # Ensure sample users have notifications
-    notifications = load_db("notifications")
-    if "usr_123" not in notifications:
-        notifications["usr_123"] = [{
-            "notification_id": "notif_123",
-            "type": "welcome",
-            "content": "Welcome to Atmosphere! Get started by joining a circle.",
-            "timestamp": datetime.now().isoformat(),
-            "read": False
-        }]
-    
-    if "usr_124" not in notifications:
-        notifications["usr_124"] = [{
-            "notification_id": "notif_124",
-            "type": "welcome",
-            "content": "Welcome to Atmosphere! Discover events in Dubai.",
-            "timestamp": datetime.now().isoformat(),
-            "read": False
-        }]
-    
-    save_db("notifications", notifications)
+    return find_records("circle_events", circle_id)
 
 def login_page():
     st.markdown("""
@@ -518,7 +167,7 @@ def login_page():
     """, unsafe_allow_html=True)
 
     try:
-        st.image("https://images.unsplash.com/photo-1469474968028-56623f02e42e", use_container_width=True, caption="Capture the vibe with Atmosphere")
+        st.image(assets.image("https://images.unsplash.com/photo-1469474968028-56623f02e42e"), use_container_width=True, caption="Capture the vibe with Atmosphere")
     except Exception as e:
         st.warning(f"Could not load image: {str(e)}")
         st.markdown("### Capture the vibe with Atmosphere")
@@ -534,15 +183,12 @@ def login_page():
             login_btn = st.form_submit_button("Login")
             try:
                 if login_btn:
-                    users = load_db("users")
-                    if not users:
-                        st.error("User database not available. Please try again later.")
-                    elif username in users and verify_password(password, users[username]["password"]):
-                        st.session_state["user"] = users[username]
+                    account, user = accounts.authenticate(username, password)
+                    if user:
+                        st.session_state["session_id"] = sessions.start(account, user)
                         st.session_state["logged_in"] = True
-                        add_notification(users[username]["user_id"], "login", "Welcome back to Atmosphere!")
+                        add_notification(user["user_id"], "login", "Welcome back to Atmosphere!")
                         st.success("Login successful!")
-                        time.sleep(1)
                         st.rerun()
                     else:
                         st.error("Invalid username or password")
@@ -592,28 +238,16 @@ def signup_page():
                 if password != confirm_password:
                     st.error("Passwords don't match!")
                 else:
-                    users = load_db("users")
-                    if username in users:
-                        st.error("Username already exists!")
+                    user = accounts.register(
+                        username, email, password, full_name=full_name,
+                        interests=interests, location={"city": location}
+                    )
+                    if user is None:
+                        st.error("Username or email already registered!")
                     else:
-                        user_id = generate_id("usr")
-                        users[username] = {
-                            "user_id": user_id,
-                            "full_name": full_name,
-                            "email": email,
-                            "password": hash_password(password),
-                            "account_type": "general",
-                            "verified": False,
-                            "joined_date": datetime.now().isoformat(),
-                            "interests": interests,
-                            "location": {"city": location},
-                            "profile_pic": f"https://randomuser.me/api/portraits/{random.choice(['men','women'])}/{random.randint(1,100)}.jpg"
-                        }
-                        save_db("users", users)
-                        st.session_state["user"] = users[username]
+                        st.session_state["session_id"] = sessions.start(user["username"], user)
                         st.session_state["logged_in"] = True
                         st.success("Account created successfully!")
-                        time.sleep(1)
                         st.rerun()
 
     with tab2:
@@ -634,30 +268,15 @@ def signup_page():
                 if password != confirm_password:
                     st.error("Passwords don't match!")
                 else:
-                    users = load_db("users")
-                    businesses = load_db("businesses")
-                    
-                    if username in users:
-                        st.error("Username already exists!")
+                    user = accounts.register(username, email, password, full_name=owner_name, account_type="business")
+                    if user is None:
+                        st.error("Username or email already registered!")
                     else:
-                        # Create user account
-                        user_id = generate_id("usr")
-                        users[username] = {
-                            "user_id": user_id,
-                            "full_name": owner_name,
-                            "email": email,
-                            "password": hash_password(password),
-                            "account_type": "business",
-                            "verified": False,
-                            "joined_date": datetime.now().isoformat(),
-                            "profile_pic": f"https://randomuser.me/api/portraits/{random.choice(['men','women'])}/{random.randint(1,100)}.jpg"
-                        }
-                        
                         # Create business profile
                         business_id = generate_id("biz")
-                        businesses[business_id] = {
+                        business = {
                             "business_id": business_id,
-                            "owner_id": user_id,
+                            "owner_id": user["user_id"],
                             "business_name": business_name,
                             "category": category,
                             "verified": False,
@@ -665,29 +284,26 @@ def signup_page():
                             "created_at": datetime.now().isoformat()
                         }
                         
-                        save_db("users", users)
-                        save_db("businesses", businesses)
-                        st.session_state["user"] = users[username]
-                        st.session_state["business"] = businesses[business_id]
+                        put_record("businesses", business_id, business)
+                        st.session_state["session_id"] = sessions.start(user["username"], user)
+                        st.session_state["business"] = business
                         st.session_state["logged_in"] = True
                         st.success("Business account created! Verification pending.")
-                        time.sleep(1)
                         st.rerun()
 
 def home_page():
     """Home page with user dashboard"""
-    generate_sample_data()
-    
     hero_section(
-        f"Welcome, {st.session_state['user']['full_name']}", 
+        f"Welcome, {current_user()['full_name']}", 
         "What would you like to do today?",
         "https://images.unsplash.com/photo-1469474968028-56623f02e42e"
     )
     
     # User stats
-    user_circles = get_user_circles(st.session_state["user"]["user_id"])
-    user_events = sum(len(get_circle_events(c["circle_id"])) for c in user_circles)
-    user_media = len(get_user_media(st.session_state["user"]["user_id"]))
+    data = get_dashboard(current_user()["user_id"])
+    user_circles = data["circles"]
+    user_events = data["event_count"]
+    user_media = data["media_count"]
     
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -703,12 +319,20 @@ def home_page():
     
     with tab1:
         st.markdown('<div class="activity-tab">Recent Activity</div>', unsafe_allow_html=True)
-        notifications = load_db("notifications").get(st.session_state["user"]["user_id"], [])
+        recent = data["notifications"]
         
-        if not notifications:
+        if not recent:
             st.info("No recent activity")
         else:
-            for notif in notifications[:3]:
+            if data["unread_count"]:
+                col1, col2 = st.columns([3, 1])
+                with col1:
+                    st.caption(f"{data['unread_count']} unread")
+                with col2:
+                    if st.button("Mark all as read", key="mark_all_read"):
+                        notifications.mark_read(current_user()["user_id"])
+                        st.rerun()
+            for notif in recent:
                 st.markdown(f"""
                 <div class="activity-item">
                     <div>System: {notif['content']}</div>
@@ -717,6 +341,8 @@ def home_page():
                     </div>
                 </div>
                 """, unsafe_allow_html=True)
+                if notif.get("type") == "promotion" and notif.get("related_id"):
+                    claim_button(notif["related_id"], current_user()["user_id"], notif["notification_id"])
     
     with tab2:
         st.markdown('<div class="activity-tab">Your Circles</div>', unsafe_allow_html=True)
@@ -736,11 +362,7 @@ def home_page():
     
     with tab3:
         st.markdown('<div class="activity-tab">Upcoming Events</div>', unsafe_allow_html=True)
-        events = []
-        for circle in user_circles:
-            events.extend(get_circle_events(circle["circle_id"]))
-        
-        events = sorted(events, key=lambda x: x["date"])[:3]
+        events = data["upcoming_events"]
         if not events:
             st.info("No upcoming events")
         else:
@@ -759,33 +381,39 @@ def home_page():
 
 def explore_page():
     """Explore page to discover content"""
-    generate_sample_data()
     st.title("🔍 Explore Our Community")
     
+    query = st.text_input(
+        "Search circles, events, businesses and offers",
+        key="explore_search",
+        placeholder="Try 'photography' or 'street food'"
+    )
+    if query.strip():
+        results = search.search(query, limit=SEARCH_LIMIT)
+        if not results:
+            st.info(f"No matches for '{query.strip()}'.")
+        for collection, record, _ in results:
+            icon, title_field = SEARCH_RESULTS[collection]
+            card(f"{icon} {record.get(title_field, '')}", record.get("description", ""))
+    
     # Sheikh Zayed Road Map Section
     st.subheader("📍 Sheikh Zayed Road - Dubai's Iconic Highway")
     
-    # Use a try/except block to handle image loading issues
-    try:
-        if os.path.exists("Images/sheikhzayed.png"):
-            st.image("Images/sheikhzayed.png", caption="Map of Sheikh Zayed Road with key landmarks")
-        else:
-            st.info("Map image not available. Sheikh Zayed Road is Dubai's main highway with numerous iconic landmarks.")
-    except Exception as e:
-        st.warning(f"Could not load image: {str(e)}")
-        st.info("Sheikh Zayed Road is Dubai's main highway with numerous iconic landmarks.")
+    map_image = assets.local("sheikhzayed.png")
+    if map_image is not None:
+        st.image(map_image, caption="Map of Sheikh Zayed Road with key landmarks")
+    else:
+        st.info("Map image not available. Sheikh Zayed Road is Dubai's main highway with numerous iconic landmarks.")
     
     # Museum of the Future section
     st.subheader("🏛️ Museum of the Future")
     col1, col2 = st.columns([1, 2])
     with col1:
-        try:
-            if os.path.exists("Images/museumoffuture.webp"):
-                st.image("Images/museumoffuture.webp", caption="Museum of the Future - Dubai")
-            else:
-                st.info("Museum image not available.")
-        except Exception as e:
-            st.warning(f"Could not load image: {str(e)}")
+        museum_image = assets.local("museumoffuture.webp", width=250)
+        if museum_image is not None:
+            st.image(museum_image, caption="Museum of the Future - Dubai")
+        else:
+            st.info("Museum image not available.")
     with col2:
         st.markdown("""
         <div style="padding:15px;">
@@ -800,93 +428,57 @@ def explore_page():
 
     # Popular circles section
     st.subheader("👥 Popular Circles")
-    circles = [
-        {
-            "name": "NYC Photographers",
-            "image_path": "Images/nycphotography.jpg",
-            "description": "For photography enthusiasts in NYC",
-            "id": "circle_1"
-        },
-        {
-            "name": "Dubai Photography Enthusiasts", 
-            "image_path": "Images/photographygroup.jpg",
-            "description": "For photography lovers in Dubai",
-            "id": "circle_2"
-        },
-        {
-            "name": "Sharjah Foodies",
-            "image_path": "Images/foodies.jpg",
-            "description": "Discover the best food spots in Sharjah",
-            "id": "circle_3"
-        },
-        {
-            "name": "Business Network",
-            "image_path": "Images/businessnetworks.webp",
-            "description": "Professional networking group",
-            "id": "circle_4"
-        }
-    ]
+    user_id = current_user()["user_id"]
+    circles = queries.popular_circles()
+    if not circles:
+        st.info("No circles yet. Start one from the Circles page!")
     
     # Display circles in columns
     cols = st.columns(2)
     for i, circle in enumerate(circles):
         with cols[i % 2]:
-            try:
-                if os.path.exists(circle["image_path"]):
-                    st.image(circle["image_path"], width=300)
-                else:
-                    st.info(f"Image for {circle['name']} not available.")
-            except Exception as e:
-                st.warning(f"Could not load image: {str(e)}")
+            circle_image = assets.local(circle["image"], width=300) if circle.get("image") else None
+            if circle_image is not None:
+                st.image(circle_image, width=300)
             
             st.markdown(f"""
             <div style="background-color: #f8f9fa; border-radius: 12px; padding: 20px; margin-bottom: 15px; border: 1px solid #dee2e6;">
                 <h3 style="color: #4361ee; margin-bottom: 15px;">{circle['name']}</h3>
                 <p style="color: #333333; margin: 5px 0;">{circle['description']}</p>
+                <p style="color: #333333; margin: 5px 0;">👥 {len(circle.get('members', []))} members</p>
             </div>
             """, unsafe_allow_html=True)
             
-            if st.button("Join Circle", key=f"join_{circle['id']}"):
+            if user_id in circle.get("members", []):
+                st.caption("✅ You're a member")
+            elif st.button("Join Circle", key=f"explore_join_{circle['circle_id']}"):
+                update_record(
+                    "circles", circle["circle_id"],
+                    lambda c: c["members"].append(user_id) if user_id not in c["members"] else None
+                )
                 st.success(f"You joined {circle['name']}!")
+                st.rerun()
                 
     # Events section
     st.subheader("📅 Upcoming Events")
-    events = [
-        {
-            "name": "Burj Khalifa Sunset Photography",
-            "image_path": "Images/buijkhalifasunset.jpg",
-            "date": "2023-11-15 at 18:00",
-            "location": "Burj Khalifa, Dubai",
-            "id": "event_1"
-        },
-        {
-            "name": "Museum of the Future Tour", 
-            "image_path": "Images/buijkhalifa.avif",
-            "date": "2023-11-20 at 14:00",
-            "location": "Museum of the Future",
-            "id": "event_2"
-        }
-    ]
+    events, _ = queries.events(limit=EXPLORE_EVENTS)
+    if not events:
+        st.info("No upcoming events at the moment. Check back later!")
     
     for event in events:
-        try:
-            if os.path.exists(event["image_path"]):
-                st.image(event["image_path"], width=500)
-            else:
-                st.info(f"Image for {event['name']} not available.")
-        except Exception as e:
-            st.warning(f"Could not load image: {str(e)}")
+        event_image = assets.local(event["image"], width=500) if event.get("image") else None
+        if event_image is not None:
+            st.image(event_image, width=500)
             
         st.markdown(f"""
         <div style="background-color: #f8f9fa; border-radius: 12px; padding: 20px; margin-bottom: 15px; border: 1px solid #dee2e6;">
             <h3 style="color: #4361ee; margin-bottom: 15px;">{event['name']}</h3>
-            <p style="color: #333333; margin: 5px 0;">📅 {event['date']}</p>
-            <p style="color: #333333; margin: 5px 0;">📍 {event['location']}</p>
+            <p style="color: #333333; margin: 5px 0;">📅 {event['date']} at {event['time']}</p>
+            <p style="color: #333333; margin: 5px 0;">📍 {event['location']['name']}</p>
         </div>
         """, unsafe_allow_html=True)
         
-        if st.button("RSVP", key=f"rsvp_{event['id']}"):
-            st.success(f"RSVP confirmed for {event['name']}!")
+        rsvp_button(event, user_id, "explore")
 
 def media_page():
     """Media upload and gallery page"""
@@ -904,7 +496,7 @@ def media_page():
         location = st.text_input("Location", "Central Park, NYC")
         
         # Circle selection
-        user_circles = get_user_circles(st.session_state["user"]["user_id"])
+        user_circles = get_user_circles(current_user()["user_id"])
         circle_options = [""] + [c["name"] for c in user_circles]
         selected_circle = st.selectbox("Share to Circle (optional)", circle_options)
         
@@ -913,48 +505,38 @@ def media_page():
         
         if st.button("Upload Media") and captured_photo:
             try:
-                # Ensure media directory exists
-                os.makedirs(MEDIA_DIR, exist_ok=True)
-                
-                # Save media
-                media_id = generate_id("med")
-                filename = f"{st.session_state['user']['user_id']}_{media_id}.jpg"
-                filepath = os.path.join(MEDIA_DIR, filename)
-                
-                image = Image.open(captured_photo)
-                image.save(filepath)
-                
-                # Add to database
-                media = load_db("media")
-                media.append({
-                    "media_id": media_id,
-                    "user_id": st.session_state["user"]["user_id"],
-                    "file_path": filepath,
-                    "location": {"name": location},
-                    "timestamp": datetime.now().isoformat(),
-                    "circle_id": next((c["circle_id"] for c in user_circles if c["name"] == selected_circle), None),
-                    "tags": tags,
-                    "reports": []
-                })
-                save_db("media", media)
+                # Persist the raw bytes; renditions are generated in the background
+                item = media.ingest(
+                    current_user()["user_id"],
+                    captured_photo.getvalue(),
+                    location,
+                    circle_id=next((c["circle_id"] for c in user_circles if c["name"] == selected_circle), None),
+                    tags=tags
+                )
                 
-                st.success("Media uploaded successfully!")
+                st.session_state["gallery_cursors"] = [None]
+                st.success("Media uploaded successfully! It will appear in your gallery in a moment.")
                 
-                # Check if this qualifies for any promotions
-                promotions = load_db("promotions")
-                for promo_id, promo in promotions.items():
-                    if any(tag.lower() in [t.lower() for t in tags] for tag in promo.get("tags", [])):
-                        add_notification(
-                            st.session_state["user"]["user_id"], 
-                            "promotion", 
-                            f"Your photo qualifies for {promo['offer']} from {promo['business_id']}!"
-                        )
+                # Check if this qualifies for any active promotions (one write for all matches)
+                matched = promotions.match(tags)
+                notifications.add_many(
+                    (current_user()["user_id"], notifications.new_notification(
+                        "promotion",
+                        f"Your photo qualifies for {promo['offer']} from {promo['business_id']}!",
+                        promo["promo_id"]
+                    ))
+                    for promo in matched
+                )
+                analytics.record_upload(item, matched)
             except Exception as e:
                 st.error(f"Error uploading media: {str(e)}")
     
     with tab2:
         st.subheader("Your Shared Memories")
-        user_media = get_user_media(st.session_state["user"]["user_id"])
+        user_id = current_user()["user_id"]
+        # Stack of cursors for the pages we've walked through; the last one is the current page
+        cursors = st.session_state.setdefault("gallery_cursors", [None])
+        user_media, next_cursor = media.gallery_page(user_id, cursors[-1])
         
         if not user_media:
             st.info("You haven't uploaded any media yet. Capture your first moment!")
@@ -963,29 +545,52 @@ def media_page():
             for i, item in enumerate(user_media):
                 with cols[i % 3]:
                     try:
-                        # Check if file exists
-                        if os.path.exists(item["file_path"]):
+                        path = media.display_path(item, "thumb")
+                        if item.get("status") == "processing":
+                            st.info("Processing…")
+                        elif item.get("status") == "failed":
+                            st.warning("This upload could not be processed")
+                        elif path and media.file_exists(path):
                             st.image(
-                                item["file_path"], 
+                                path,
                                 use_container_width=True,
                                 caption=f"{item['location']['name']} • {datetime.fromisoformat(item['timestamp']).strftime('%b %d, %Y')}"
                             )
+                            if st.button("View full size", key=f"full_{item['media_id']}"):
+                                st.session_state["gallery_full"] = item["media_id"]
                         else:
                             st.warning("Image file not found")
                         st.write(f"Tags: {', '.join(item['tags'])}")
                     except Exception as e:
                         st.warning(f"Could not load media: {str(e)}")
+            
+            # Full-size image is only opened when asked for
+            selected = next((m for m in user_media if m["media_id"] == st.session_state.get("gallery_full")), None)
+            if selected is not None:
+                st.image(media.display_path(selected, "full"), use_container_width=True)
+                if st.button("Close", key="close_full"):
+                    st.session_state.pop("gallery_full", None)
+                    st.rerun()
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                if len(cursors) > 1 and st.button("← Newer", key="gallery_prev"):
+                    cursors.pop()
+                    st.rerun()
+            with col2:
+                if next_cursor and st.button("Older →", key="gallery_next"):
+                    cursors.append(next_cursor)
+                    st.rerun()
 
 def circles_page():
     """Circles management page"""
-    generate_sample_data()
     st.title("👥 Your Circles")
     
     tab1, tab2, tab3 = st.tabs(["Your Circles", "Discover", "Create"])
     
     with tab1:
         st.subheader("Your Communities")
-        user_circles = get_user_circles(st.session_state["user"]["user_id"])
+        user_circles = get_user_circles(current_user()["user_id"])
         
         if not user_circles:
             st.info("You haven't joined any circles yet. Explore some below!")
@@ -1000,42 +605,65 @@ def circles_page():
                             st.rerun()
                     with col2:
                         if st.button("Leave Circle", key=f"leave_{circle['circle_id']}"):
-                            circles = load_db("circles")
-                            circles[circle["circle_id"]]["members"].remove(st.session_state["user"]["user_id"])
-                            save_db("circles", circles)
+                            user_id = current_user()["user_id"]
+                            update_record(
+                                "circles", circle["circle_id"],
+                                lambda c: c["members"].remove(user_id) if user_id in c["members"] else None
+                            )
                             st.success(f"You left {circle['name']}")
                             st.rerun()
     
     with tab2:
         st.subheader("Discover New Circles")
-        all_circles = load_db("circles")
-        user_circles = get_user_circles(st.session_state["user"]["user_id"])
-        user_circle_ids = [c["circle_id"] for c in user_circles]
+        user = current_user()
+        here = geo.locate(user.get("location"))
+        if here is None:
+            st.caption("Add your city to your profile to see circles near you.")
         
-        discover_circles = [c for c in all_circles.values() if c["circle_id"] not in user_circle_ids]
+        # Ranked by shared interests, what people in your circles joined, size and distance
+        discover_circles = recommend.recommend(user, here, limit=DISCOVER_LIMIT)
         
         if not discover_circles:
             st.info("No new circles to discover at the moment. Check back later!")
         else:
-            for circle in discover_circles[:5]:
+            for circle, distance in discover_circles:
+                distance_text = f" • 📍 {distance:.1f} km away" if distance is not None else ""
                 # Use explicit styling with contrasting colors
                 st.markdown(f"""
                 <div style="background-color: #f8f9fa; border-radius: 12px; padding: 20px; margin-bottom: 15px; border: 1px solid #dee2e6;">
                     <h3 style="color: #4361ee; margin-bottom: 15px;">{circle['name']}</h3>
                     <p style="color: #333333; margin: 5px 0;">{circle['description']}</p>
-                    <p style="color: #333333; margin: 5px 0;">Members: {len(circle['members'])} • Type: {circle['type'].capitalize()}</p>
+                    <p style="color: #333333; margin: 5px 0;">Members: {len(circle['members'])} • Type: {circle['type'].capitalize()}{distance_text}</p>
                 </div>
                 """, unsafe_allow_html=True)
                 
                 if st.button("Join Circle", key=f"join_{circle['circle_id']}"):
                     # Add the user to the circle
-                    circles = load_db("circles")
-                    if st.session_state["user"]["user_id"] not in circles[circle["circle_id"]]["members"]:
-                        circles[circle["circle_id"]]["members"].append(st.session_state["user"]["user_id"])
-                        save_db("circles", circles)
+                    user_id = user["user_id"]
+                    joined = update_record(
+                        "circles", circle["circle_id"],
+                        lambda c: c["members"].append(user_id) if user_id not in c["members"] else None
+                    )
+                    if joined is not None:
                         st.success(f"You've joined {circle['name']}!")
-                        time.sleep(1)
                         st.rerun()
+        
+        if here is not None:
+            st.subheader("Events Near You")
+            radius = st.select_slider(
+                "Within",
+                options=[5, 10, 25, 50, 100, 250, 500, 1000, 5000],
+                value=100,
+                format_func=lambda km: f"{km} km",
+                key="discover_radius"
+            )
+            today = datetime.now().strftime("%Y-%m-%d")
+            nearby_events = geo.nearby("events", *here, radius, limit=DISCOVER_LIMIT, since=today)
+            if not nearby_events:
+                st.info("No upcoming events nearby yet.")
+            for event, distance in nearby_events:
+                st.markdown(f"**{event['name']}** • {event['date']} at {event['time']} • 📍 {event['location']['name']} ({distance:.1f} km)")
+                rsvp_button(event, user["user_id"], "nearby")
     
     with tab3:
         st.subheader("Create a New Circle")
@@ -1049,93 +677,68 @@ def circles_page():
             if st.form_submit_button("Create Circle"):
                 if name:
                     circle_id = generate_id("cir")
-                    circles = load_db("circles")
-                    circles[circle_id] = {
+                    place = {"name": location} if location else None
+                    # Place the circle on the map when it names a city we already know
+                    point = geo.locate({"city": location}) if location else None
+                    if point is not None:
+                        place.update({"city": location.strip(), "lat": point[0], "lng": point[1]})
+                    put_record("circles", circle_id, {
                         "circle_id": circle_id,
                         "name": name,
                         "description": description,
                         "type": circle_type.lower(),
-                        "creator": st.session_state["user"]["user_id"],
-                        "members": [st.session_state["user"]["user_id"]],
-                        "location": {"name": location} if location else None,
+                        "creator": current_user()["user_id"],
+                        "members": [current_user()["user_id"]],
+                        "location": place,
                         "tags": tags,
                         "events": [],
                         "created_at": datetime.now().isoformat(),
-                        "business_owned": st.session_state["user"]["account_type"] == "business"
-                    }
-                    save_db("circles", circles)
+                        "business_owned": current_user()["account_type"] == "business"
+                    })
                     st.success(f"Circle '{name}' created successfully!")
                     add_notification(
-                        st.session_state["user"]["user_id"], 
+                        current_user()["user_id"], 
                         "circle", 
                         f"You created a new circle: {name}"
                     )
-                    time.sleep(1)
                     st.rerun()
 
 def events_page():
     """Events management page"""
-    generate_sample_data()
     st.title("📅 Events")
     
     tab1, tab2, tab3 = st.tabs(["Upcoming", "Your Events", "Create"])
     
+    user_id = current_user()["user_id"]
+    user_circles = get_user_circles(user_id)
+    
     with tab1:
         st.subheader("Upcoming Events")
         
-        # Enhanced upcoming events with UAE focus
-        upcoming_events = [
-            {
-                "name": "Sunset Photography at Burj Khalifa",
-                "date": "2025-04-18",
-                "time": "18:30",
-                "location": "Burj Khalifa, Dubai",
-                "attendees": 8,
-                "capacity": 15,
-                "organizer": "Ahmed Al Maktoum",
-                "description": "Capture stunning sunset views from the world's tallest building. All skill levels welcome!",
-                "image": "https://images.unsplash.com/photo-1512453979798-5ea266f8880c?w=500",
-                "details": """
-                    <h3>Event Details</h3>
-                    <p><strong>Date:</strong> April 18, 2025 at 6:30 PM</p>
-                    <p><strong>Meeting Point:</strong> Burj Khalifa Observation Deck Entrance</p>
-                    <p><strong>What to Bring:</strong> Camera (any type), tripod (optional), comfortable shoes</p>
-                    <p><strong>Price:</strong> AED 150 (includes observation deck ticket)</p>
-                    <img src="https://images.unsplash.com/photo-1512453979798-5ea266f8880c?w=800" style="width:100%; border-radius:8px; margin:10px 0;">
-                    <p>This workshop will guide you through the best techniques for capturing Dubai's famous sunsets from the world's tallest building. Our professional photographer will provide tips on composition, exposure, and post-processing.</p>
-                """
-            },
-            {
-                "name": "Museum of the Future Tech Tour",
-                "date": "2025-04-20",
-                "time": "14:00",
-                "location": "Museum of the Future, Dubai",
-                "attendees": 12,
-                "capacity": 20,
-                "organizer": "Tech Explorers UAE",
-                "description": "Exclusive guided tour of Dubai's iconic Museum of the Future with tech experts",
-                "image": "https://images.unsplash.com/photo-1643795788371-85c8f5e56767?w=500",
-                "details": """
-                    <h3>Event Details</h3>
-                    <p><strong>Date:</strong> April 20, 2025 at 2:00 PM</p>
-                    <p><strong>Meeting Point:</strong> Museum of the Future Main Entrance</p>
-                    <p><strong>Duration:</strong> Approximately 2 hours</p>
-                    <p><strong>Price:</strong> AED 200 (includes museum admission)</p>
-                    <img src="https://images.unsplash.com/photo-1643795788371-85c8f5e56767?w=800" style="width:100%; border-radius:8px; margin:10px 0;">
-                    <p>Join our expert-led tour of the Museum of the Future, where we'll explore the most innovative exhibits and discuss the future of technology. This is a unique opportunity to gain insights not available on regular tours.</p>
-                """
-            }
-        ]
+        filter_cols = st.columns(3)
+        city = filter_cols[0].selectbox("City", ["Any"] + queries.cities(), key="events_city")
+        tag = filter_cols[1].text_input("Tag", key="events_tag")
+        circle_ids = {c["name"]: c["circle_id"] for c in user_circles}
+        circle_filter = filter_cols[2].selectbox("Circle", ["Any"] + list(circle_ids), key="events_circle")
+        query = (None if city == "Any" else city, tag or None, circle_ids.get(circle_filter))
+        
+        # Changing a filter starts again from the first page
+        if st.session_state.get("events_query") != query:
+            st.session_state["events_query"] = query
+            st.session_state["events_cursors"] = [None]
+        cursors = st.session_state["events_cursors"]
+        upcoming_events, next_cursor = queries.events(*query, cursor=cursors[-1])
         
         if not upcoming_events:
             st.info("No upcoming events at the moment. Check back later!")
         else:        
             for event in upcoming_events:
+                capacity = event.get("capacity") or "∞"
                 event_details = f"""
                 <p style="color: #333333; margin: 5px 0;"><strong>📅 Date:</strong> {event['date']} at {event['time']}</p>
-                <p style="color: #333333; margin: 5px 0;"><strong>📍 Location:</strong> {event['location']}</p>
-                <p style="color: #333333; margin: 5px 0;"><strong>👥 Attendees:</strong> {event['attendees']}/{event['capacity']}</p>
-                <p style="color: #333333; margin: 5px 0;"><strong>🎫 Organizer:</strong> {event['organizer']}</p>
+                <p style="color: #333333; margin: 5px 0;"><strong>📍 Location:</strong> {event['location']['name']}</p>
+                <p style="color: #333333; margin: 5px 0;"><strong>👥 Attendees:</strong> {len(event.get('attendees', []))}/{capacity}</p>
+                <p style="color: #333333; margin: 5px 0;"><strong>🎫 Organizer:</strong> {organizer_name(event)}</p>
                 <p style="color: #333333; margin: 10px 0;">{event['description']}</p>
                 """
                 
@@ -1149,73 +752,60 @@ def events_page():
                     """, unsafe_allow_html=True)
                 
                 with col2:
-                    try:
-                        if event.get('image'):
-                            st.image(event['image'], use_container_width=True)
-                    except Exception as e:
-                        st.warning(f"Could not load image: {str(e)}")
-                
-                # View Details button with expanded details
-                if st.button(f"View Details for {event['name']}", key=f"details_{event['name']}"):
-                    st.markdown(event['details'].replace('<p>', '<p style="color: #333333;">'), unsafe_allow_html=True)
-                
-                # RSVP button
-                if st.button("RSVP", key=f"rsvp_{event['name']}"):
-                    st.success(f"You've RSVP'd to {event['name']}!")
-                    time.sleep(1)
-                    st.rerun()
+                    event_image = assets.image(event["image"], width=300) if event.get("image") else None
+                    if event_image is not None:
+                        st.image(event_image, use_container_width=True)
+                    if event.get("tags"):
+                        st.caption(" ".join(f"#{t}" for t in event["tags"]))
                 
+                rsvp_button(event, user_id, "upcoming")
                 st.markdown("---")
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                if len(cursors) > 1 and st.button("← Sooner", key="events_prev"):
+                    cursors.pop()
+                    st.rerun()
+            with col2:
+                if next_cursor and st.button("Later →", key="events_next"):
+                    cursors.append(next_cursor)
+                    st.rerun()
     with tab2:
         st.subheader("Your Events")
         
-        # Sample events you're attending
-        your_events = [
-            {
-                "name": "Sunset Photography at Burj Khalifa",
-                "date": "2025-04-18",
-                "time": "18:30",
-                "status": "Confirmed",
-                "organizer": "Ahmed Al Maktoum"
-            },
-            {
-                "name": "Museum of the Future Tech Tour",
-                "date": "2025-04-20",
-                "time": "14:00",
-                "status": "Confirmed",
-                "organizer": "Tech Explorers UAE"
-            }
-        ]
+        your_cursors = st.session_state.setdefault("your_events_cursors", [None])
+        your_events, your_next = queries.events(attendee=user_id, cursor=your_cursors[-1])
         
         if not your_events:
             st.info("You're not attending any events yet. Explore upcoming events!")
         else:
             for event in your_events:
+                status = "Organizer" if event.get("organizer") == user_id else "Confirmed"
                 st.markdown(f"""
                 <div style="background-color: #f8f9fa; border-radius: 12px; padding: 20px; margin-bottom: 15px; border: 1px solid #dee2e6;">
                     <h3 style="color: #4361ee; margin-bottom: 15px;">{event['name']}</h3>
                     <p style="color: #333333; margin: 5px 0;"><strong>📅 Date:</strong> {event['date']} at {event['time']}</p>
-                    <p style="color: #333333; margin: 5px 0;"><strong>🎫 Organizer:</strong> {event['organizer']}</p>
-                    <p style="color: #333333; margin: 5px 0;"><strong>🟢 Status:</strong> {event['status']}</p>
+                    <p style="color: #333333; margin: 5px 0;"><strong>📍 Location:</strong> {event['location']['name']}</p>
+                    <p style="color: #333333; margin: 5px 0;"><strong>🎫 Organizer:</strong> {organizer_name(event)}</p>
+                    <p style="color: #333333; margin: 5px 0;"><strong>🟢 Status:</strong> {status}</p>
                 </div>
                 """, unsafe_allow_html=True)
                 
-                col1, col2 = st.columns(2)
-                with col1:
-                    if st.button("View Details", key=f"details_{event['name']}_view"):
-                        st.markdown(f"""
-                        <div style="padding:15px; background-color:#f8f9fa; border-radius:8px; margin-top:10px;">
-                            <h4 style="color: #333333;">Event Details</h4>
-                            <p style="color: #333333;"><strong>Name:</strong> {event['name']}</p>
-                            <p style="color: #333333;"><strong>Date:</strong> {event['date']} at {event['time']}</p>
-                            <p style="color: #333333;"><strong>Organizer:</strong> {event['organizer']}</p>
-                            <p style="color: #333333;"><strong>Status:</strong> {event['status']}</p>
-                        </div>
-                        """, unsafe_allow_html=True)
+                if status != "Organizer":
+                    rsvp_button(event, user_id, "yours")
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                if len(your_cursors) > 1 and st.button("← Sooner", key="your_events_prev"):
+                    your_cursors.pop()
+                    st.rerun()
+            with col2:
+                if your_next and st.button("Later →", key="your_events_next"):
+                    your_cursors.append(your_next)
+                    st.rerun()
     
     with tab3:
         st.subheader("Create New Event")
-        user_circles = get_user_circles(st.session_state["user"]["user_id"])
         
         if not user_circles:
             st.warning("You need to join or create a circle before creating events")
@@ -1224,56 +814,63 @@ def events_page():
                 name = st.text_input("Event Name")
                 description = st.text_area("Description")
                 date = st.date_input("Date")
-                time = st.time_input("Time")
+                event_time = st.time_input("Time")
                 location = st.text_input("Location")
                 circle = st.selectbox(
                     "Associated Circle",
                     [c["name"] for c in user_circles]
                 )
                 capacity = st.number_input("Capacity (0 for unlimited)", min_value=0)
+                tags = st.multiselect("Tags", ["Art", "Music", "Sports", "Food", "Tech", "Nature", "Business"])
                 
                 if st.form_submit_button("Create Event"):
                     if name:
                         event_id = generate_id("evt")
-                        events = load_db("events")
+                        event_circle = next(c for c in user_circles if c["name"] == circle)
+                        circle_id = event_circle["circle_id"]
                         
-                        circle_id = next(c["circle_id"] for c in user_circles if c["name"] == circle)
-                        
-                        events[event_id] = {
+                        # Events take their circle's city and coordinates for filtering and distance ranking
+                        circle_location = event_circle.get("location") or {}
+                        event_location = {"name": location, "city": circle_location.get("city")}
+                        if geo.location_of(event_circle) is not None:
+                            event_location.update({"lat": circle_location["lat"], "lng": circle_location["lng"]})
+                        put_record("events", event_id, {
                             "event_id": event_id,
                             "circle_id": circle_id,
                             "name": name,
                             "description": description,
-                            "location": {"name": location},
+                            "location": event_location,
                             "date": date.strftime("%Y-%m-%d"),
-                            "time": time.strftime("%H:%M"),
-                            "organizer": st.session_state["user"]["user_id"],
-                            "attendees": [st.session_state["user"]["user_id"]],
+                            "time": event_time.strftime("%H:%M"),
+                            "organizer": current_user()["user_id"],
+                            "attendees": [current_user()["user_id"]],
                             "capacity": capacity,
+                            "tags": [t.lower() for t in tags],
                             "created_at": datetime.now().isoformat()
-                        }
+                        })
                         
                         # Add event to circle
-                        circles = load_db("circles")
-                        if "events" not in circles[circle_id]:
-                            circles[circle_id]["events"] = []
-                        circles[circle_id]["events"].append(event_id)
-                        
-                        save_db("events", events)
-                        save_db("circles", circles)
+                        update_record("circles", circle_id, lambda c: c.setdefault("events", []).append(event_id))
                         
                         st.success(f"Event '{name}' created successfully!")
                         add_notification(
-                            st.session_state["user"]["user_id"],
+                            current_user()["user_id"],
                             "event_created",
                             f"You created a new event: {name}"
                         )
-                        time.sleep(1)
+                        # Tell the rest of the circle in the background
+                        notifications.notify_circle(
+                            circle_id,
+                            "event",
+                            f"New event in {circle}: {name}",
+                            related_id=event_id,
+                            exclude=[current_user()["user_id"]]
+                        )
                         st.rerun()
 
 def business_page():
     """Business dashboard page"""
-    if st.session_state["user"]["account_type"] != "business":
+    if current_user()["account_type"] != "business":
         st.warning("This page is only available for business accounts")
         return
     
@@ -1285,13 +882,8 @@ def business_page():
         st.subheader("Business Overview")
         
         # Business info
-        businesses = load_db("businesses")
-        try:
-            business = next(
-                b for b in businesses.values() 
-                if b["owner_id"] == st.session_state["user"]["user_id"]
-            )
-            
+        business = get_user_business(current_user()["user_id"])
+        if business is not None:
             col1, col2 = st.columns(2)
             with col1:
                 st.markdown(f"""
@@ -1321,7 +913,7 @@ def business_page():
             
             st.subheader("Recent Activity")
             st.info("Business activity feed would appear here")
-        except StopIteration:
+        else:
             st.error("Business profile not found. Please contact support.")
     
     with tab2:
@@ -1335,17 +927,15 @@ def business_page():
             tags = st.multiselect("Relevant Tags", ["Food", "Drink", "Retail", "Service", "Discount", "Event"])
             
             if st.form_submit_button("Launch Promotion"):
+                business = get_user_business(current_user()["user_id"])
+                if business is None:
+                    st.error("Business profile not found. Please contact support.")
+                    return
                 try:
                     promo_id = generate_id("promo")
-                    promotions = load_db("promotions")
-                    
-                    businesses = load_db("businesses")
-                    business_id = next(
-                        b["business_id"] for b in businesses.values() 
-                        if b["owner_id"] == st.session_state["user"]["user_id"]
-                    )
+                    business_id = business["business_id"]
                     
-                    promotions[promo_id] = {
+                    put_record("promotions", promo_id, {
                         "promo_id": promo_id,
                         "business_id": business_id,
                         "offer": offer,
@@ -1356,23 +946,79 @@ def business_page():
                         "tags": tags,
                         "claimed_by": [],
                         "created_at": datetime.now().isoformat()
-                    }
-                    save_db("promotions", promotions)
+                    })
                     st.success("Promotion launched successfully!")
-                except StopIteration:
-                    st.error("Business profile not found. Please contact support.")
                 except Exception as e:
                     st.error(f"Error creating promotion: {str(e)}")
+    
+    with tab3:
+        st.subheader("Business Analytics")
+        business = get_user_business(current_user()["user_id"])
+        if business is None:
+            st.error("Business profile not found. Please contact support.")
+            return
+        business_id = business["business_id"]
+        
+        # All-time counters
+        totals = analytics.totals(business_id)
+        cols = st.columns(len(analytics.METRICS))
+        for col, (metric, label) in zip(cols, analytics.METRICS.items()):
+            with col:
+                stats_card(label, str(totals.get(metric, 0)))
+        
+        # Time series read from the hourly/daily rollups
+        col1, col2 = st.columns(2)
+        with col1:
+            resolution = st.radio("Resolution", ["Daily", "Hourly"], horizontal=True, key="analytics_resolution")
+        with col2:
+            days = st.select_slider(
+                "Period",
+                options=[1, 7, 14, 30, 90],
+                value=7 if resolution == "Hourly" else analytics.DEFAULT_DAYS,
+                format_func=lambda d: f"{d} days" if d > 1 else "Today",
+                key=f"analytics_days_{resolution}"
+            )
+        frame = analytics.export(business_id, resolution.lower(), days)
+        frame.columns = [analytics.METRICS[m] for m in frame.columns]
+        st.line_chart(frame)
+        st.download_button(
+            "Export CSV",
+            frame.to_csv().encode(),
+            file_name=f"{business_id}_{resolution.lower()}_{days}d.csv",
+            mime="text/csv"
+        )
+        
+        st.subheader("Promotions")
+        promos = find_records("business_promotions", business_id)
+        if not promos:
+            st.info("Launch a promotion to see how it performs.")
+        else:
+            reach = analytics.breakdown(business_id, "reach")
+            tagged = analytics.breakdown(business_id, "tagged_media")
+            claims = analytics.breakdown(business_id, "claims")
+            st.dataframe(
+                [{
+                    "Offer": p["offer"],
+                    "Runs": f"{p.get('start_date', '')} – {p.get('end_date', '')}",
+                    "Reach": reach.get(p["promo_id"], 0),
+                    "Tagged media": tagged.get(p["promo_id"], 0),
+                    "Claims": claims.get(p["promo_id"], 0),
+                } for p in promos],
+                use_container_width=True
+            )
 
 def main():
     """Main application function"""
-    # Initialize database first
-    init_db()
-    generate_sample_data()
+    # Initialize database first (once per process)
+    try:
+        bootstrap_db()
+    except Exception as e:
+        st.error(f"Failed to initialize database: {str(e)}")
     
     # Initialize session state
-    if "logged_in" not in st.session_state:
-        st.session_state["logged_in"] = False
+    # The session may have expired or been logged out elsewhere
+    user = current_user()
+    st.session_state["logged_in"] = user is not None
     if "current_page" not in st.session_state:
         st.session_state["current_page"] = "Home"
     
@@ -1383,11 +1029,11 @@ def main():
     if st.session_state["logged_in"]:
         with st.sidebar:
             try:
-                st.image("https://via.placeholder.com/150x50?text=Atmosphere", use_container_width=True)
-            except Exception as e:
+                st.image(assets.image("https://via.placeholder.com/150x50?text=Atmosphere", width=150), use_container_width=True)
+            except Exception:
                 st.markdown("# Atmosphere")
                 
-            st.markdown(f"**Welcome, {st.session_state['user']['full_name'].split()[0]}!**")
+            st.markdown(f"**Welcome, {user['full_name'].split()[0]}!**")
             
             # Navigation menu
             menu_options = {
@@ -1396,7 +1042,7 @@ def main():
                 "Media": "📸 Media",
                 "Circles": "👥 Circles",
                 "Events": "📅 Events",
-                "Business": "💼 Business" if st.session_state["user"]["account_type"] == "business" else None
+                "Business": "💼 Business" if user["account_type"] == "business" else None
             }
             
             for page, label in menu_options.items():
@@ -1405,19 +1051,19 @@ def main():
             
             st.markdown("---")
             if st.button("🚪 Logout"):
+                sessions.end(st.session_state.pop("session_id", None))
                 st.session_state["logged_in"] = False
-                st.session_state["user"] = None
                 st.session_state["current_page"] = "Home"
                 st.rerun()
             
             # User profile
             st.markdown("---")
             try:
-                st.image(st.session_state["user"].get("profile_pic", "https://via.placeholder.com/150"), width=60)
-            except Exception as e:
+                st.image(assets.image(user.get("profile_pic", "https://via.placeholder.com/150"), width=60), width=60)
+            except Exception:
                 st.info("Profile picture not available")
                 
-            st.caption(st.session_state["user"]["full_name"])
+            st.caption(user["full_name"])
     
     # Page routing
     if not st.session_state["logged_in"]:
@@ -0,0 +1,200 @@
+import hashlib
+import io
+import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+import media
+
+ASSET_DIR = "Images"
+# Longest edge of the renditions made for bundled images; requests get the smallest that fits
+ASSET_SIZES = (320, 640, 1280)
+# Renditions are picked for this many device pixels per CSS pixel
+PIXEL_RATIO = 2
+
+# Remote avatars and hero images are fetched once and kept on disk for REMOTE_TTL
+REMOTE_CACHE_DIR = os.environ.get("ATMOSPHERE_ASSET_CACHE", os.path.join("data", "assets"))
+REMOTE_TTL = int(os.environ.get("ATMOSPHERE_ASSET_TTL", 24 * 3600))
+REMOTE_TIMEOUT = 10
+REMOTE_MAX_BYTES = 10 * 1024 * 1024
+REMOTE_MAX_EDGE = 1280
+# A host that failed is left alone this long before the next attempt
+RETRY_AFTER = 300
+
+CACHE_MAX_BYTES = int(os.environ.get("ATMOSPHERE_ASSET_CACHE_BYTES", 32 * 1024 * 1024))
+
+
+class ByteCache:
+    """LRU of encoded images bounded by the total size of their bytes"""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+
+cache = ByteCache()
+_executor = None
+_executor_lock = threading.Lock()
+_inflight = set()
+_failed = {}  # url -> time of the last failed fetch
+_fetch_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="assets")
+        return _executor
+
+
+def _decode(data):
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        return image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+
+
+def _fit(width):
+    # Smallest rendition that covers the displayed width; None means full width
+    if width:
+        for size in ASSET_SIZES:
+            if size >= width * PIXEL_RATIO:
+                return size
+    return ASSET_SIZES[-1]
+
+
+def _asset_path(name):
+    return name if os.path.dirname(name) else os.path.join(ASSET_DIR, name)
+
+
+def _render_local(path):
+    # Decode once and cache every rendition, so a later width is a cache hit too
+    with open(path, "rb") as f:
+        image = _decode(f.read())
+    renditions = {size: media.render(image, size) for size in ASSET_SIZES}
+    for size, data in renditions.items():
+        cache.put(("local", path, size), data, len(data))
+    return renditions
+
+
+def local(name, width=None):
+    """Bytes of a bundled image sized for width CSS pixels, or None if it is missing or unreadable"""
+    path = _asset_path(name)
+    size = _fit(width)
+    data = cache.get(("local", path, size))
+    if data is not None:
+        return data
+    try:
+        return _render_local(path)[size]
+    except (OSError, ValueError):
+        return None
+
+
+def preload():
+    """Render every bundled image up front; returns how many were loaded"""
+    loaded = 0
+    for name in sorted(os.listdir(ASSET_DIR)) if os.path.isdir(ASSET_DIR) else []:
+        try:
+            _render_local(os.path.join(ASSET_DIR, name))
+            loaded += 1
+        except (OSError, ValueError):
+            continue
+    return loaded
+
+
+def _write_bytes(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _remote_path(url, max_edge):
+    return os.path.join(REMOTE_CACHE_DIR, f"{hashlib.sha256(url.encode()).hexdigest()}-{max_edge}.webp")
+
+
+def _fetch(url, max_edge):
+    path = _remote_path(url, max_edge)
+    try:
+        request = urllib.request.Request(url, headers={"User-Agent": "Atmosphere/1.0"})
+        with urllib.request.urlopen(request, timeout=REMOTE_TIMEOUT) as response:
+            raw = response.read(REMOTE_MAX_BYTES + 1)
+        if len(raw) > REMOTE_MAX_BYTES:
+            raise ValueError("image too large")
+        data = media.render(_decode(raw), max_edge)
+        _write_bytes(path, data)
+        cache.put(("remote", url, max_edge), (time.time(), data), len(data))
+    except Exception:
+        with _fetch_lock:
+            _failed[url] = time.monotonic()
+    finally:
+        with _fetch_lock:
+            _inflight.discard((url, max_edge))
+
+
+def _schedule(url, max_edge):
+    with _fetch_lock:
+        failed_at = _failed.get(url)
+        if (url, max_edge) in _inflight or (failed_at and time.monotonic() - failed_at < RETRY_AFTER):
+            return
+        _inflight.add((url, max_edge))
+    get_executor().submit(_fetch, url, max_edge)
+
+
+def remote(url, max_edge=REMOTE_MAX_EDGE):
+    """Locally cached bytes of a remote image, or None if they are not on disk yet.
+
+    Never waits on the network: a missing or expired copy is (re)fetched in
+    the background and an expired one is still served in the meantime.
+    """
+    key = ("remote", url, max_edge)
+    entry = cache.get(key)
+    if entry is None:
+        path = _remote_path(url, max_edge)
+        try:
+            with open(path, "rb") as f:
+                entry = (os.path.getmtime(path), f.read())
+            cache.put(key, entry, len(entry[1]))
+        except OSError:
+            _schedule(url, max_edge)
+            return None
+    if time.time() - entry[0] > REMOTE_TTL:
+        _schedule(url, max_edge)
+    return entry[1]
+
+
+def image(src, width=None):
+    """Source for st.image: cached bytes when available, otherwise src itself"""
+    if src.startswith(("http://", "https://")):
+        data = remote(src, _fit(width))
+    else:
+        data = local(src, width)
+    return data if data is not None else src
+
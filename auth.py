@@ -1,39 +1,25 @@
 import streamlit as st
-import sqlite3
-import hashlib
+import accounts
+import sessions
 
-# Connect to SQLite database
-conn = sqlite3.connect("data/users.db", check_same_thread=False)
-cursor = conn.cursor()
+# Users live in the same store as app.py; the old data/users.db table is
+# imported on first start and its SHA-256 hashes become bcrypt at next login
+@st.cache_resource
+def init_accounts():
+    accounts.init()
+    return True
 
-# Create users table if not exists
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT UNIQUE,
-    email TEXT UNIQUE,
-    password TEXT
-)
-""")
-conn.commit()
-
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+init_accounts()
 
 def register_user(username, email, password):
-    hashed_pw = hash_password(password)
-    try:
-        cursor.execute("INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
-                       (username, email, hashed_pw))
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False
+    return accounts.register(username, email, password) is not None
 
 def login_user(email, password):
-    hashed_pw = hash_password(password)
-    cursor.execute("SELECT * FROM users WHERE email = ? AND password = ?", (email, hashed_pw))
-    return cursor.fetchone()
+    username, user = accounts.authenticate(email, password)
+    if user is None:
+        return None
+    st.session_state["session_id"] = sessions.start(username, user)
+    return username
 
 # Streamlit UI
 st.title("Welcome to Atmosphere")
@@ -47,11 +33,11 @@ if choice == "Login":
     password = st.text_input("Password", type="password")
     
     if st.button("Login"):
-        user = login_user(email, password)
-        if user:
-            st.success(f"Welcome {user[1]}! You are now logged in.")
+        username = login_user(email, password)
+        if username:
+            st.success(f"Welcome {username}! You are now logged in.")
             st.session_state["logged_in"] = True
-            st.session_state["username"] = user[1]
+            st.session_state["username"] = username
         else:
             st.error("Invalid login credentials.")
 
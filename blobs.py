@@ -0,0 +1,104 @@
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime
+import storage
+
+BLOB_DIR = os.environ.get("ATMOSPHERE_BLOB_DIR", os.path.join("media_gallery", "blobs"))
+# Files younger than this are never collected, so in-flight uploads are safe
+GC_GRACE_SECONDS = 3600
+
+
+def digest(data):
+    """Content hash used as the blob key"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def blob_path(blob_digest, ext):
+    # Two levels of 256-way sharding keep every directory small
+    return os.path.join(BLOB_DIR, blob_digest[:2], blob_digest[2:4], f"{blob_digest}.{ext}")
+
+
+def put(data, ext):
+    """Store bytes under their content hash; a no-op if the blob already exists"""
+    blob_digest = digest(data)
+    path = blob_path(blob_digest, ext)
+    if os.path.exists(path):
+        os.utime(path)  # restart the GC grace period before the new reference lands
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Per-thread temporary name, so concurrent uploads of the same bytes don't clobber each other
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except OSError:
+            # Content-addressed: if another writer already put the blob in place, this one is done too
+            if not os.path.exists(path):
+                raise
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+    storage.update(
+        "blobs", blob_digest,
+        lambda b: b.update({"ext": ext, "size": len(data)}),
+        default={"digest": blob_digest, "refs": 0, "created_at": datetime.now().isoformat()}
+    )
+    return blob_digest
+
+
+def path_of(blob_digest):
+    blob = storage.get("blobs", blob_digest)
+    return blob_path(blob_digest, blob["ext"]) if blob else None
+
+
+def incref(blob_digests):
+    for blob_digest in blob_digests:
+        storage.update("blobs", blob_digest, lambda b: b.update({"refs": b["refs"] + 1}))
+
+
+def decref(blob_digests):
+    for blob_digest in blob_digests:
+        storage.update("blobs", blob_digest, lambda b: b.update({"refs": max(b["refs"] - 1, 0)}))
+
+
+def collect_garbage(now=None):
+    """Delete unreferenced blobs and stray files; returns (blobs removed, bytes freed)"""
+    now = now or time.time()
+    removed, freed = 0, 0
+    known = set()
+    for blob_digest, blob in storage.load("blobs").items():
+        path = blob_path(blob_digest, blob.get("ext", ""))
+        if blob["refs"] > 0:
+            known.add(path)
+            continue
+        try:
+            if now - os.path.getmtime(path) < GC_GRACE_SECONDS:
+                known.add(path)
+                continue
+            os.remove(path)
+            freed += blob.get("size", 0)
+        except FileNotFoundError:
+            pass
+        storage.delete("blobs", blob_digest)
+        removed += 1
+
+    # Files that are not exactly a recorded blob's <digest>.<ext>: blobs with no record
+    # (a crash between write and record) and temp files left by a crash inside put()
+    for root, _, files in os.walk(BLOB_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            if path in known or now - os.path.getmtime(path) < GC_GRACE_SECONDS:
+                continue
+            blob_digest = name.split(".")[0]
+            blob = storage.get("blobs", blob_digest)
+            if blob is None or blob_path(blob_digest, blob.get("ext", "")) != path:
+                freed += os.path.getsize(path)
+                os.remove(path)
+                removed += 1
+    return removed, freed
@@ -0,0 +1,291 @@
+import hashlib
+from functools import lru_cache
+from string import Template
+import streamlit as st
+import assets
+
+# Rendered fragments kept per component; each is keyed by its inputs, so reruns reuse the HTML
+FRAGMENT_CACHE_SIZE = 1024
+
+STYLE = """
+    <style>
+    /* Color Variables */
+    :root {
+        --primary: #4361ee;
+        --secondary: #3f37c9;
+        --accent: #4895ef;
+        --light: #f8f9fa;
+        --dark: #212529;
+        --success: #4cc9f0;
+        --warning: #f72585;
+        --danger: #7209b7;
+    }
+
+    body {
+        font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+        line-height: 1.6;
+        color: var(--dark);
+    }
+
+    /* Fix for recent activity font color */
+    .activity-item {
+        color: #212529 !important;
+    }
+
+    .activity-item div {
+        color: #212529 !important;
+    }
+
+    .main-container {
+        max-width: 1200px;
+        margin: 0 auto;
+        padding: 20px;
+    }
+
+    .card {
+        border-radius: 12px;
+        box-shadow: 0 4px 8px 0 rgba(0,0,0,0.1);
+        padding: 20px;
+        margin-bottom: 25px;
+        background-color: white;
+        transition: transform 0.3s, box-shadow 0.3s;
+        border: 1px solid #e9ecef;
+    }
+
+    .card:hover {
+        transform: translateY(-5px);
+        box-shadow: 0 8px 16px 0 rgba(0,0,0,0.15);
+    }
+
+    .card-title {
+        color: var(--primary);
+        margin-bottom: 15px;
+        font-size: 1.2rem;
+    }
+
+    .stats-card {
+        border-radius: 12px;
+        padding: 20px;
+        margin-bottom: 15px;
+        background-color: white;
+        box-shadow: 0 4px 8px 0 rgba(0,0,0,0.1);
+        border: 1px solid #e9ecef;
+        text-align: center;
+    }
+
+    .stats-card h3 {
+        color: #6c757d;
+        font-size: 1rem;
+        margin-bottom: 5px;
+    }
+
+    .stats-card .value {
+        font-size: 2rem;
+        font-weight: bold;
+        color: #4361ee;
+        margin: 10px 0;
+    }
+
+    .stButton>button {
+        border-radius: 8px;
+        padding: 8px 16px;
+        background-color: var(--primary);
+        color: white;
+        border: none;
+        transition: background-color 0.3s;
+    }
+
+    .stButton>button:hover {
+        background-color: var(--secondary);
+    }
+
+    .stTextInput>div>div>input, 
+    .stTextArea>div>textarea {
+        border-radius: 8px;
+        border: 1px solid #ced4da;
+    }
+
+    .stSelectbox>div>div>div {
+        border-radius: 8px;
+    }
+
+    .sidebar .sidebar-content {
+        background-color: var(--light);
+        padding: 15px;
+    }
+
+    .sidebar .sidebar-content .block-container {
+        padding-top: 0;
+    }
+
+    .hero-container, .st-key-hero {
+        position: relative;
+        text-align: center;
+        margin-bottom: 30px;
+    }
+
+    .st-key-hero img {
+        border-radius: 8px;
+    }
+
+    .hero-text {
+        position: absolute;
+        top: 50%;
+        left: 50%;
+        transform: translate(-50%, -50%);
+        color: white;
+        text-shadow: 2px 2px 4px rgba(0,0,0,0.5);
+    }
+
+    .hero-title {
+        font-size: 2.5rem;
+        margin-bottom: 10px;
+    }
+
+    .activity-item {
+        background-color: #f8f9fa;
+        padding: 15px;
+        border-radius: 10px;
+        margin-bottom: 10px;
+        border-left: 4px solid var(--accent);
+    }
+
+    .activity-time {
+        color: #6c757d;
+        font-size: 0.8rem;
+    }
+
+    .activity-tab {
+        border-bottom: 1px solid #dee2e6;
+        padding-bottom: 10px;
+        margin-bottom: 15px;
+    }
+
+    @media (max-width: 768px) {
+        .hero-title {
+            font-size: 1.8rem;
+        }
+        .card {
+            margin-bottom: 15px;
+        }
+    }
+
+    /* Make "Sign up now" look like a link */
+    button[kind="secondary"][data-testid="baseButton-signup_now"] {
+        background: none;
+        border: none;
+        color: #4361ee;
+        font-weight: bold;
+        text-align: left;
+        padding: 0;
+        margin-top: -10px;
+        cursor: pointer;
+    }
+    </style>
+"""
+
+CARD = Template("""
+    <div class="card">
+        <div class="card-title">$title</div>
+        $image
+        <div class="card-content">$content</div>
+    </div>
+    """)
+CARD_IMAGE = Template('<img src="$src" style="width:100%; border-radius:8px; margin-bottom:15px;">')
+
+HERO = Template("""
+        <div class="hero-text">
+            <h1 class="hero-title">$title</h1>
+            <p>$subtitle</p>
+        </div>
+        """)
+HERO_FALLBACK = Template("""
+        <div class="hero-container" style="background-color: #4361ee; padding: 50px; border-radius: 8px;">
+            <div class="hero-text" style="position: static; transform: none;">
+                <h1 class="hero-title" style="color: white;">$title</h1>
+                <p style="color: white;">$subtitle</p>
+            </div>
+        </div>
+        """)
+
+ACTIVITY = Template("""
+    <div class="activity-item">
+        <strong>$user</strong> $action
+        <div class="activity-time">$time_ago</div>
+    </div>
+    """)
+
+STATS = Template("""
+    <div class="stats-card">
+        <h3>$title</h3>
+        <div class="value">$value</div>
+    </div>
+    """)
+
+
+def load_css():
+    """Define all CSS styling for the application"""
+    st.markdown(STYLE, unsafe_allow_html=True)
+
+
+def widget_key(prefix, *parts):
+    """Stable widget key derived from what the widget shows, so reruns keep its identity"""
+    return f"{prefix}_{hashlib.sha1(repr(parts).encode()).hexdigest()[:12]}"
+
+
+@lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def card_html(title, content, image=None):
+    img_html = CARD_IMAGE.substitute(src=image) if image else ''
+    return CARD.substitute(title=title, image=img_html, content=content)
+
+
+@lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def hero_html(title, subtitle):
+    return HERO.substitute(title=title, subtitle=subtitle)
+
+
+@lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def hero_fallback_html(title, subtitle):
+    return HERO_FALLBACK.substitute(title=title, subtitle=subtitle)
+
+
+@lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def activity_html(user, action, time_ago):
+    return ACTIVITY.substitute(user=user, action=action, time_ago=time_ago)
+
+
+@lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def stats_html(title, value):
+    return STATS.substitute(title=title, value=value)
+
+
+def card(title, content, image=None, action_button=None, key=None):
+    """Reusable card component with optional image and action button"""
+    st.markdown(card_html(title, content, image), unsafe_allow_html=True)
+
+    if action_button:
+        return st.button(action_button, key=key or widget_key("card", title, action_button))
+    return None
+
+
+def hero_section(title, subtitle, image_url):
+    """Hero banner component with title and subtitle"""
+    try:
+        # st.image serves the bytes from Streamlit's media endpoint, which the browser
+        # caches, instead of resending them inline with every rerun; the keyed
+        # container lets the CSS lay the text over the image
+        with st.container(key="hero"):
+            st.image(assets.image(image_url), use_container_width=True)
+            st.markdown(hero_html(title, subtitle), unsafe_allow_html=True)
+    except Exception as e:
+        st.error(f"Could not load hero image: {str(e)}")
+        st.markdown(hero_fallback_html(title, subtitle), unsafe_allow_html=True)
+
+
+def activity_item(user, action, time_ago):
+    """Activity feed item component"""
+    st.markdown(activity_html(user, action, time_ago), unsafe_allow_html=True)
+
+
+def stats_card(title, value):
+    st.markdown(stats_html(title, value), unsafe_allow_html=True)
@@ -0,0 +1,383 @@
+import json
+import os
+import re
+import shutil
+from collections import OrderedDict
+from datetime import date, datetime, timezone
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import notifications
+import storage
+
+EXPORT_DIR = os.environ.get("ATMOSPHERE_EXPORT_DIR", os.path.join("data", "exports"))
+# Bump when COLUMNS changes; collections exported with another layout are re-exported in full
+EXPORT_FORMAT = 1
+# Records read from the store per query while streaming a collection out
+EXPORT_BATCH = 5000
+# Rows per Parquet row group, and the most rows held in memory across all partitions
+ROW_GROUP_ROWS = 50000
+MAX_BUFFERED_ROWS = 100000
+# Partition files open at once; the least recently used is closed and resumes in a new part file
+MAX_OPEN_FILES = 64
+
+STRING, INT, FLOAT, BOOL = pa.string(), pa.int64(), pa.float64(), pa.bool_()
+TIMESTAMP, DATE = pa.timestamp("us"), pa.date32()
+STRINGS = pa.list_(pa.string())
+
+
+def _key(key, record):
+    return key
+
+
+def _length(path):
+    return lambda key, record: len(_get(record, path) or [])
+
+
+# Typed columns per collection: (name, type, dotted path into the record or fn(key, record)).
+# Fields not listed here are kept as JSON in an "_extra" column.
+COLUMNS = {
+    "users": [
+        ("username", STRING, _key),
+        ("user_id", STRING, "user_id"),
+        ("full_name", STRING, "full_name"),
+        ("account_type", STRING, "account_type"),
+        ("verified", BOOL, "verified"),
+        ("joined_date", TIMESTAMP, "joined_date"),
+        ("interests", STRINGS, "interests"),
+        ("city", STRING, "location.city"),
+        ("lat", FLOAT, "location.lat"),
+        ("lng", FLOAT, "location.lng"),
+    ],
+    "circles": [
+        ("circle_id", STRING, _key),
+        ("name", STRING, "name"),
+        ("description", STRING, "description"),
+        ("type", STRING, "type"),
+        ("creator", STRING, "creator"),
+        ("business_owned", BOOL, "business_owned"),
+        ("members", STRINGS, "members"),
+        ("member_count", INT, _length("members")),
+        ("tags", STRINGS, "tags"),
+        ("city", STRING, "location.city"),
+        ("lat", FLOAT, "location.lat"),
+        ("lng", FLOAT, "location.lng"),
+        ("created_at", TIMESTAMP, "created_at"),
+    ],
+    "events": [
+        ("event_id", STRING, _key),
+        ("name", STRING, "name"),
+        ("description", STRING, "description"),
+        ("circle_id", STRING, "circle_id"),
+        ("organizer", STRING, "organizer"),
+        ("date", DATE, "date"),
+        ("starts_at", TIMESTAMP, lambda key, r: f"{r.get('date')}T{r.get('time') or '00:00'}" if r.get("date") else None),
+        ("capacity", INT, "capacity"),
+        ("attendees", STRINGS, "attendees"),
+        ("attendee_count", INT, _length("attendees")),
+        ("tags", STRINGS, "tags"),
+        ("location_name", STRING, "location.name"),
+        ("city", STRING, "location.city"),
+        ("lat", FLOAT, "location.lat"),
+        ("lng", FLOAT, "location.lng"),
+        ("created_at", TIMESTAMP, "created_at"),
+    ],
+    "media": [
+        ("media_id", STRING, _key),
+        ("user_id", STRING, "user_id"),
+        ("circle_id", STRING, "circle_id"),
+        ("status", STRING, "status"),
+        ("timestamp", TIMESTAMP, "timestamp"),
+        ("tags", STRINGS, "tags"),
+        ("location_name", STRING, "location.name"),
+        ("width", INT, "width"),
+        ("height", INT, "height"),
+        ("source_digest", STRING, "source_digest"),
+        ("report_count", INT, _length("reports")),
+    ],
+    "promotions": [
+        ("promo_id", STRING, _key),
+        ("business_id", STRING, "business_id"),
+        ("offer", STRING, "offer"),
+        ("description", STRING, "description"),
+        ("requirements", STRING, "requirements"),
+        ("start_date", DATE, "start_date"),
+        ("end_date", DATE, "end_date"),
+        ("tags", STRINGS, "tags"),
+        ("claimed_by", STRINGS, "claimed_by"),
+        ("claim_count", INT, _length("claimed_by")),
+        ("created_at", TIMESTAMP, "created_at"),
+    ],
+    "notifications": [
+        ("notification_id", STRING, _key),
+        ("user_id", STRING, "user_id"),
+        ("type", STRING, "type"),
+        ("content", STRING, "content"),
+        ("related_id", STRING, "related_id"),
+        ("read", BOOL, "read"),
+        ("timestamp", TIMESTAMP, "timestamp"),
+    ],
+    "reports": [
+        ("report_id", STRING, _key),
+        ("media_id", STRING, "media_id"),
+        ("user_id", STRING, "user_id"),
+        ("reason", STRING, "reason"),
+        ("status", STRING, "status"),
+        ("timestamp", TIMESTAMP, "timestamp"),
+    ],
+}
+COLLECTIONS = tuple(COLUMNS)
+# Field whose date picks each record's partition
+PARTITION_BY = {
+    "users": "joined_date",
+    "circles": "created_at",
+    "events": "date",
+    "media": "timestamp",
+    "promotions": "start_date",
+    "notifications": "timestamp",
+    "reports": "timestamp",
+}
+# Never copied out of the live store
+PRIVATE_FIELDS = {"users": {"password", "email"}}
+# Hive-style partition directory name, <collection>/dt=YYYY-MM-DD/
+PARTITION_KEY = "dt"
+UNKNOWN_PARTITION = "unknown"
+DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def _get(record, path):
+    value = record
+    for part in path.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def _timestamp(value):
+    value = datetime.fromisoformat(str(value))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+def _text(value):
+    return value if isinstance(value, str) else json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+
+
+CONVERTERS = {
+    STRING: _text,
+    INT: int,
+    FLOAT: float,
+    BOOL: _flag,
+    TIMESTAMP: _timestamp,
+    DATE: lambda value: date.fromisoformat(str(value)[:10]),
+    STRINGS: lambda value: [_text(v) for v in value] if isinstance(value, (list, tuple)) else [_text(value)],
+}
+
+
+def _convert(value, kind):
+    # Values that don't fit the column's type become nulls rather than failing the export
+    if value is None or value == "":
+        return None
+    try:
+        return CONVERTERS[kind](value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def schema(collection):
+    """Arrow schema of a collection's export files"""
+    fields = [pa.field(name, kind) for name, kind, _ in COLUMNS[collection]]
+    return pa.schema(fields + [pa.field("_extra", STRING), pa.field("_key", STRING), pa.field("_snapshot", INT)])
+
+
+def _mapped_fields(collection):
+    # Top-level fields a column already carries, by source path or by name (such as the key field)
+    fields = {name for name, _, _ in COLUMNS[collection]}
+    return fields | {source.split(".")[0] for _, _, source in COLUMNS[collection] if isinstance(source, str)}
+
+
+def _table(collection, rows, snapshot):
+    columns = {name: [] for name in schema(collection).names}
+    mapped = _mapped_fields(collection) | PRIVATE_FIELDS.get(collection, set())
+    for key, record in rows:
+        for name, kind, source in COLUMNS[collection]:
+            value = source(key, record) if callable(source) else _get(record, source)
+            columns[name].append(_convert(value, kind))
+        extra = {field: value for field, value in record.items() if field not in mapped}
+        columns["_extra"].append(json.dumps(extra, sort_keys=True, default=str) if extra else None)
+        columns["_key"].append(key)
+        columns["_snapshot"].append(snapshot)
+    return pa.Table.from_pydict(columns, schema=schema(collection))
+
+
+def partition(collection, record):
+    """Partition (YYYY-MM-DD, or UNKNOWN_PARTITION) a record is written to"""
+    value = str(_get(record, PARTITION_BY[collection]) or "")
+    return value[:10] if DATE_RE.match(value) else UNKNOWN_PARTITION
+
+
+def _stamps(collection):
+    return notifications.stamps() if collection == "notifications" else storage.stamps(collection)
+
+
+def _items(collection, keys):
+    return notifications.items(keys) if collection == "notifications" else storage.items(collection, keys)
+
+
+class PartitionWriter:
+    """Parquet files for one collection and snapshot, one per date partition.
+
+    Records are buffered per partition and written ROW_GROUP_ROWS at a
+    time. Files are written under a dot-prefixed name, which dataset
+    readers skip, and renamed into place when closed, so readers never see
+    a partial file.
+    """
+
+    def __init__(self, directory, collection, snapshot):
+        self.directory = directory
+        self.collection = collection
+        self.snapshot = snapshot
+        self.buffers = {}  # partition -> [(key, record)]
+        self.buffered = 0
+        self.open = OrderedDict()  # partition -> (writer, temporary path, final path)
+        self.parts = {}
+        self.rows = 0
+
+    def add(self, partition, key, record):
+        rows = self.buffers.setdefault(partition, [])
+        rows.append((key, record))
+        self.buffered += 1
+        if len(rows) >= ROW_GROUP_ROWS:
+            self._flush(partition)
+        elif self.buffered >= MAX_BUFFERED_ROWS:
+            self._flush(max(self.buffers, key=lambda p: len(self.buffers[p])))
+
+    def _flush(self, partition):
+        rows = self.buffers.pop(partition)
+        self.buffered -= len(rows)
+        entry = self.open.get(partition)
+        if entry is None:
+            if len(self.open) >= MAX_OPEN_FILES:
+                self._close(next(iter(self.open)))
+            part = self.parts.get(partition, 0)
+            self.parts[partition] = part + 1
+            folder = os.path.join(self.directory, f"{PARTITION_KEY}={partition}")
+            os.makedirs(folder, exist_ok=True)
+            name = f"part-{self.snapshot:06d}-{part:03d}.parquet"
+            tmp_path = os.path.join(folder, f".{name}")
+            entry = (pq.ParquetWriter(tmp_path, schema(self.collection)), tmp_path, os.path.join(folder, name))
+            self.open[partition] = entry
+        self.open.move_to_end(partition)
+        entry[0].write_table(_table(self.collection, rows, self.snapshot))
+        self.rows += len(rows)
+
+    def _close(self, partition):
+        writer, tmp_path, path = self.open.pop(partition)
+        writer.close()
+        os.replace(tmp_path, path)
+
+    def close(self):
+        for partition in list(self.buffers):
+            self._flush(partition)
+        while self.open:
+            self._close(next(iter(self.open)))
+
+
+def _read_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _remove_partial_files(directory):
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.startswith(".part-"):
+                os.remove(os.path.join(root, name))
+
+
+def export_collection(collection, snapshot, out=EXPORT_DIR, full=False):
+    """Write the records changed since the collection's last export; returns (written, deleted).
+
+    Changes are found by comparing storage stamps, so on SQLite only the
+    changed records' bodies are read. Records deleted since are listed in
+    _deleted/ with the snapshot that removed them.
+    """
+    directory = os.path.join(out, collection)
+    state_path = os.path.join(directory, "_state.json")
+    state = _read_json(state_path, {})
+    if full or state.get("format") != EXPORT_FORMAT:
+        shutil.rmtree(directory, ignore_errors=True)
+        state = {}
+    _remove_partial_files(directory)
+    previous = state.get("stamps", {})
+    current = _stamps(collection)
+    changed = [key for key, stamp in current.items() if previous.get(key) != stamp]
+    deleted = [key for key in previous if key not in current]
+
+    writer = PartitionWriter(directory, collection, snapshot)
+    try:
+        for start in range(0, len(changed), EXPORT_BATCH):
+            for key, record in _items(collection, changed[start:start + EXPORT_BATCH]):
+                writer.add(partition(collection, record), key, record)
+    finally:
+        writer.close()
+    if deleted:
+        os.makedirs(os.path.join(directory, "_deleted"), exist_ok=True)
+        pq.write_table(
+            pa.table({"_key": deleted, "_snapshot": [snapshot] * len(deleted)},
+                     schema=pa.schema([("_key", STRING), ("_snapshot", INT)])),
+            os.path.join(directory, "_deleted", f"part-{snapshot:06d}.parquet")
+        )
+    # A record written between reading its stamp and its body is exported with the newer
+    # body under the older stamp, so the next export simply writes it again
+    storage.write_json_atomic(
+        state_path, {"format": EXPORT_FORMAT, "snapshot": snapshot, "stamps": current}, indent=None
+    )
+    return writer.rows, len(deleted)
+
+
+def run(collections=None, out=EXPORT_DIR, full=False):
+    """Export every collection (or the ones given) as one snapshot; returns (snapshot, {collection: (written, deleted)})"""
+    log_path = os.path.join(out, "_snapshots.json")
+    log = _read_json(log_path, [])
+    snapshot = log[-1]["snapshot"] + 1 if log else 1
+    results = {}
+    for collection in collections or COLLECTIONS:
+        results[collection] = export_collection(collection, snapshot, out, full)
+    log.append({
+        "snapshot": snapshot,
+        "finished_at": datetime.now().isoformat(),
+        "full": full,
+        "collections": {c: {"written": w, "deleted": d} for c, (w, d) in results.items()},
+    })
+    storage.write_json_atomic(log_path, log)
+    return snapshot, results
+
+
+def read(collection, out=EXPORT_DIR):
+    """Current records of an exported collection as a DataFrame, newest export of each key winning"""
+    directory = os.path.join(out, collection)
+    if not os.path.isdir(directory):
+        return schema(collection).empty_table().to_pandas()
+    dataset = ds.dataset(
+        directory, format="parquet", schema=schema(collection).append(pa.field(PARTITION_KEY, STRING)),
+        partitioning=ds.partitioning(pa.schema([(PARTITION_KEY, STRING)]), flavor="hive")
+    )
+    frame = dataset.to_table().to_pandas()
+    frame = frame.sort_values("_snapshot", kind="stable").drop_duplicates("_key", keep="last")
+    deleted_dir = os.path.join(directory, "_deleted")
+    if os.path.isdir(deleted_dir):
+        tombstones = ds.dataset(deleted_dir, format="parquet").to_table().to_pandas()
+        last_deleted = tombstones.groupby("_key")["_snapshot"].max()
+        removed = frame["_snapshot"] <= frame["_key"].map(last_deleted).fillna(-1)
+        frame = frame[~removed]
+    return frame.reset_index(drop=True)
@@ -0,0 +1,303 @@
+import math
+import threading
+import numpy as np
+import storage
+
+EARTH_RADIUS_KM = 6371.0088
+# Grid cell edges in degrees, finest first (about 5.5 km, 111 km and 1100 km of latitude).
+# A query uses the finest grid that covers its radius in at most MAX_QUERY_CELLS cells.
+CELL_SIZES = (0.05, 1.0, 10.0)
+MAX_QUERY_CELLS = 1024
+# Pending points are folded into the sorted arrays once there are this many
+MAX_PENDING = 1024
+# Date field kept next to each point, so queries can skip past records before the limit applies
+DATE_FIELDS = {"events": "date"}
+
+_indexes = {}  # collection -> (storage version, GeoIndex)
+# Kept alongside each index: (normalized city -> {key: (lat, lng)}, key -> its city), for locate()
+_cities = {}
+_lock = threading.Lock()
+
+
+def location_of(record):
+    """(lat, lng) of a record's location, or None if it has no coordinates"""
+    location = (record or {}).get("location") or {}
+    try:
+        return float(location["lat"]), float(location["lng"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _date_of(collection, record):
+    field = DATE_FIELDS.get(collection)
+    return str(record.get(field) or "")[:10] if field else ""
+
+
+def haversine(lat, lng, lats, lngs):
+    """Great-circle distance in km from one point to arrays of points (all in degrees)"""
+    lat, lng = math.radians(lat), math.radians(lng)
+    lats, lngs = np.radians(lats), np.radians(lngs)
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class Grid:
+    """Points sorted by the cell they fall in, so each cell is one contiguous slice"""
+
+    def __init__(self, cell_deg, keys, lats, lngs, dates):
+        self.cell_deg = cell_deg
+        self.rows = int(math.ceil(180 / cell_deg))
+        self.cols = int(math.ceil(360 / cell_deg))
+        cells = self.cell_ids(lats, lngs)
+        order = np.argsort(cells, kind="stable")
+        self.keys, self.lats, self.lngs, self.cells = keys[order], lats[order], lngs[order], cells[order]
+        self.dates = dates[order]
+
+    def cell_ids(self, lats, lngs):
+        rows = np.clip(np.floor((lats + 90) / self.cell_deg), 0, self.rows - 1).astype(np.int64)
+        cols = np.floor((lngs + 180) / self.cell_deg).astype(np.int64) % self.cols
+        return rows * self.cols + cols
+
+    def cells_near(self, lat, lng, km):
+        """Cells overlapping the bounding box of a circle, or None if there are too many"""
+        dlat = math.degrees(km / EARTH_RADIUS_KM)
+        cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 90.0)))
+        dlng = 180.0 if cos_lat < 1e-9 else min(dlat / cos_lat, 180.0)
+        row0 = max(int((lat - dlat + 90) // self.cell_deg), 0)
+        row1 = min(int((lat + dlat + 90) // self.cell_deg), self.rows - 1)
+        if dlng >= 180.0:
+            cols = np.arange(self.cols)
+        else:
+            cols = np.arange(int((lng - dlng + 180) // self.cell_deg), int((lng + dlng + 180) // self.cell_deg) + 1) % self.cols
+        if (row1 - row0 + 1) * len(cols) > MAX_QUERY_CELLS:
+            return None
+        return (np.arange(row0, row1 + 1)[:, None] * self.cols + cols[None, :]).ravel()
+
+    def rows_in(self, cells):
+        # Concatenate the cells' slices without a Python loop
+        starts = np.searchsorted(self.cells, cells, side="left")
+        lengths = np.searchsorted(self.cells, cells, side="right") - starts
+        return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+
+class GeoIndex:
+    """Multi-resolution grid index with radius and k-nearest queries.
+
+    Points added after the build go to a small pending buffer that every
+    query also scans; a rebuild folds them back into the sorted grids.
+    Each point carries a YYYY-MM-DD date ("" if none) for the since filter.
+    """
+
+    def __init__(self, points=()):
+        keys, lats, lngs, dates = [], [], [], []
+        for key, lat, lng, day in points:
+            keys.append(key)
+            lats.append(lat)
+            lngs.append(lng)
+            dates.append(day)
+        keys = np.array(keys, dtype=object)
+        lats, lngs = np.array(lats, dtype=np.float64), np.array(lngs, dtype=np.float64)
+        dates = np.array(dates, dtype="U10")
+        self.grids = [Grid(cell_deg, keys, lats, lngs, dates) for cell_deg in CELL_SIZES]
+        # Built once and shared by copies, like the grids
+        self.rows = {key: row for row, key in enumerate(self.grids[0].keys)}
+        self.pending = {}  # key -> (lat, lng, date), added since the last build
+        self.removed = set()
+
+    def __len__(self):
+        return len(self.grids[0].keys) - len(self.removed) + len(self.pending)
+
+    def get(self, key):
+        """(lat, lng, date) currently indexed for key, or None"""
+        if key in self.pending:
+            return self.pending[key]
+        row = self.rows.get(key)
+        if row is None or key in self.removed:
+            return None
+        grid = self.grids[0]
+        return float(grid.lats[row]), float(grid.lngs[row]), str(grid.dates[row])
+
+    def add(self, key, lat, lng, day=""):
+        self.removed.add(key)  # hides an older position of the same key, if any
+        self.pending[key] = (lat, lng, day)
+
+    def remove(self, key):
+        self.removed.add(key)
+        self.pending.pop(key, None)
+
+    def copy(self):
+        """A copy that shares the built grids, for changing without disturbing concurrent readers"""
+        clone = object.__new__(GeoIndex)
+        clone.grids, clone.rows = self.grids, self.rows
+        clone.pending, clone.removed = dict(self.pending), set(self.removed)
+        return clone
+
+    def points(self):
+        """Live (key, lat, lng, date) tuples, including pending ones"""
+        grid = self.grids[0]
+        for key, lat, lng, day in zip(grid.keys, grid.lats, grid.lngs, grid.dates):
+            if key not in self.removed:
+                yield key, float(lat), float(lng), str(day)
+        for key, (lat, lng, day) in self.pending.items():
+            yield key, lat, lng, day
+
+    def _candidates(self, lat, lng, km):
+        for grid in self.grids:
+            cells = grid.cells_near(lat, lng, km)
+            if cells is not None:
+                rows = grid.rows_in(cells)
+                return grid.keys[rows], grid.lats[rows], grid.lngs[rows], grid.dates[rows]
+        grid = self.grids[-1]
+        return grid.keys, grid.lats, grid.lngs, grid.dates
+
+    def radius(self, lat, lng, km, limit=None, since=None):
+        """[(key, distance km)] for points within km of (lat, lng), nearest first.
+
+        With since (YYYY-MM-DD), only points dated that day or later count,
+        so older ones never take up places within the limit.
+        """
+        keys, lats, lngs, dates = self._candidates(lat, lng, km)
+        if since is not None:
+            current = dates >= since
+            keys, lats, lngs = keys[current], lats[current], lngs[current]
+        distances = haversine(lat, lng, lats, lngs)
+        inside = distances <= km
+        keys, distances = keys[inside], distances[inside]
+        if self.removed:
+            live = np.array([k not in self.removed for k in keys], dtype=bool)
+            keys, distances = keys[live], distances[live]
+        pending = [(k, p) for k, p in self.pending.items() if since is None or p[2] >= since]
+        if pending:
+            extra = np.array([p[:2] for _, p in pending], dtype=np.float64)
+            extra_distances = haversine(lat, lng, extra[:, 0], extra[:, 1])
+            near = extra_distances <= km
+            keys = np.concatenate([keys, np.array([k for k, _ in pending], dtype=object)[near]])
+            distances = np.concatenate([distances, extra_distances[near]])
+        if limit is not None and len(distances) > limit:
+            top = np.argpartition(distances, limit - 1)[:limit]
+            keys, distances = keys[top], distances[top]
+        order = np.argsort(distances, kind="stable")
+        return [(keys[i], float(distances[i])) for i in order]
+
+    def nearest(self, lat, lng, k, since=None):
+        """[(key, distance km)] for the k points closest to (lat, lng), nearest first"""
+        if k <= 0 or not len(self):
+            return []
+        # Widen the search until it holds k points; everything closer is then inside it
+        km = CELL_SIZES[0] * 111.0
+        while True:
+            found = self.radius(lat, lng, km, limit=k, since=since)
+            if len(found) >= k or km >= math.pi * EARTH_RADIUS_KM:
+                return found
+            km *= 4
+
+
+def _point(collection, record):
+    point = location_of(record)
+    return None if point is None else (*point, _date_of(collection, record))
+
+
+def _city_of(record):
+    return storage.normalize_city(((record or {}).get("location") or {}).get("city"))
+
+
+def _add_city(cities, key, record):
+    by_city, city_of = cities
+    city, point = _city_of(record), location_of(record)
+    if city and point is not None:
+        by_city.setdefault(city, {})[key] = point
+        city_of[key] = city
+
+
+def _remove_city(cities, key):
+    by_city, city_of = cities
+    city = city_of.pop(key, None)
+    if city is not None:
+        by_city[city].pop(key, None)
+        if not by_city[city]:
+            del by_city[city]
+
+
+def _build(collection):
+    points = []
+    cities = ({}, {})
+    for key, record in storage.load(collection).items():
+        point = _point(collection, record)
+        if point is not None:
+            points.append((key, *point))
+            _add_city(cities, key, record)
+    return GeoIndex(points), cities
+
+
+def get_index(collection):
+    """The spatial index for a collection, rebuilt only when it was written by another process"""
+    version = storage.get_backend().version(collection)
+    with _lock:
+        cached = _indexes.get(collection)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+    # The version is read before loading, so a write racing the build is caught next time
+    index, cities = _build(collection)
+    with _lock:
+        _indexes[collection] = (version, index)
+        _cities[collection] = cities
+    return index
+
+
+@storage.on_write
+def _on_write(collection, key, record):
+    with _lock:
+        cached = _indexes.get(collection)
+        if cached is None:
+            return
+        if key is None:
+            del _indexes[collection]  # whole collection replaced; rebuild on the next query
+            return
+        _remove_city(_cities[collection], key)
+        _add_city(_cities[collection], key, record)
+        index = cached[1]
+        point = None if record is None else _point(collection, record)
+        if point != index.get(key):
+            # Copy-on-write, so queries running concurrently keep a consistent index
+            index = index.copy()
+            if point is not None:
+                index.add(key, *point)
+            else:
+                index.remove(key)
+            if len(index.pending) > MAX_PENDING:
+                index = GeoIndex(index.points())
+        # Writes that leave the location and date alone (RSVPs, joins) only move the version on
+        _indexes[collection] = (storage.get_backend().version(collection), index)
+
+
+def _records(collection, found):
+    records = []
+    for key, distance in found:
+        record = storage.get(collection, key)
+        if record is not None:
+            records.append((record, distance))
+    return records
+
+
+def nearby(collection, lat, lng, km, limit=None, since=None):
+    """[(record, distance km)] within km of (lat, lng), nearest first; since skips records dated earlier"""
+    return _records(collection, get_index(collection).radius(lat, lng, km, limit, since))
+
+
+def nearest(collection, lat, lng, k, since=None):
+    """[(record, distance km)] for the k records closest to (lat, lng)"""
+    return _records(collection, get_index(collection).nearest(lat, lng, k, since))
+
+
+def locate(location):
+    """Coordinates for a location dict: its own lat/lng, else those of a circle in the same city"""
+    point = location_of({"location": location})
+    if point is not None:
+        return point
+    city = storage.normalize_city((location or {}).get("city") or (location or {}).get("name"))
+    if not city:
+        return None
+    get_index("circles")  # brings the city map up to date with it
+    with _lock:
+        points = _cities["circles"][0].get(city)
+        return next(iter(points.values())) if points else None
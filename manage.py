@@ -0,0 +1,163 @@
+import argparse
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import blobs
+import exports
+import notifications
+import search
+import seed
+import storage
+
+
+def cmd_migrate(args):
+    """Import legacy data/*.json files into the SQLite store"""
+    storage.get_backend().init()
+    migrated = storage.migrate_json_to_sqlite(force=args.force)
+    print(f"Migrated: {', '.join(migrated) if migrated else 'nothing to do'}")
+
+
+def cmd_seed(args):
+    """Create the schema and load the sample data"""
+    if seed.bootstrap(force=args.force):
+        print(f"Seeded sample data (version {seed.SEED_VERSION})")
+    else:
+        print(f"Already seeded (version {storage.get_meta('seed_version')})")
+
+
+def cmd_reindex(args):
+    """Rebuild the secondary indexes from the stored records"""
+    storage.init_storage()
+    storage.rebuild_indexes()
+    print(f"Rebuilt indexes: {', '.join(storage.INDEXES)}")
+
+
+def cmd_reindex_search(args):
+    """Rebuild the full-text search index and its snapshot"""
+    storage.init_storage()
+    print(f"Indexed {search.rebuild()} documents into {search.SEARCH_INDEX_PATH}")
+
+
+def cmd_export(args):
+    """Write records changed since the last export to date-partitioned Parquet files"""
+    unknown = set(args.collections) - set(exports.COLLECTIONS)
+    if unknown:
+        sys.exit(f"Unknown collections: {', '.join(sorted(unknown))} (choose from {', '.join(exports.COLLECTIONS)})")
+    storage.init_storage()
+    notifications.init()
+    snapshot, results = exports.run(args.collections or None, args.out, full=args.full)
+    for collection, (written, deleted) in results.items():
+        print(f"{collection}: {written} written, {deleted} deleted")
+    print(f"Snapshot {snapshot} in {args.out}")
+
+
+def cmd_compact_notifications(args):
+    """Apply the notification retention cap and TTL to every user"""
+    storage.init_storage()
+    notifications.init()
+    print(f"Removed {notifications.compact()} notifications")
+
+
+def _make_backend(kind, directory):
+    if kind == "json":
+        return storage.JSONBackend({c: os.path.join(directory, os.path.basename(p)) for c, p in storage.DB_FILES.items()})
+    return storage.SQLiteBackend(os.path.join(directory, "stress.db"))
+
+
+def _join(circle_id, user_id):
+    storage.update(
+        "circles", circle_id,
+        lambda c: c["members"].append(user_id) if user_id not in c["members"] else None
+    )
+
+
+def _join_worker(kind, directory, circle_id, user_ids, threads):
+    storage.set_backend(_make_backend(kind, directory))
+    workers = [threading.Thread(target=_join, args=(circle_id, user_id)) for user_id in user_ids]
+    for start in range(0, len(workers), threads):
+        batch = workers[start:start + threads]
+        for worker in batch:
+            worker.start()
+        for worker in batch:
+            worker.join()
+    return len(user_ids)
+
+
+def cmd_stress_joins(args):
+    """Run concurrent circle joins against a scratch store and check none are lost"""
+    with tempfile.TemporaryDirectory() as directory:
+        backend = _make_backend(args.backend, directory)
+        backend.init()
+        storage.set_backend(backend)
+        storage.put("circles", "cir_stress", {"circle_id": "cir_stress", "members": []})
+
+        user_ids = [f"usr_{i:05d}" for i in range(args.joins)]
+        shards = [user_ids[i::args.processes] for i in range(args.processes)]
+        with ProcessPoolExecutor(max_workers=args.processes) as pool:
+            futures = [
+                pool.submit(_join_worker, args.backend, directory, "cir_stress", shard, args.threads)
+                for shard in shards
+            ]
+            for future in futures:
+                future.result()
+
+        members = storage.get("circles", "cir_stress")["members"]
+        lost = set(user_ids) - set(members)
+        print(f"{args.joins} joins, {len(members)} members, {len(lost)} lost, "
+              f"{len(members) - len(set(members))} duplicated")
+        if lost or len(members) != len(set(members)):
+            sys.exit(1)
+
+
+def cmd_gc_blobs(args):
+    """Delete media blobs that no media record references any more"""
+    storage.init_storage()
+    removed, freed = blobs.collect_garbage()
+    print(f"Removed {removed} blobs, freed {freed} bytes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Atmosphere maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = commands.add_parser("migrate", help=cmd_migrate.__doc__)
+    migrate_parser.add_argument("--force", action="store_true", help="Re-import even if already migrated")
+    migrate_parser.set_defaults(func=cmd_migrate)
+
+    seed_parser = commands.add_parser("seed", help=cmd_seed.__doc__)
+    seed_parser.add_argument("--force", action="store_true", help="Seed even if the seed version is current")
+    seed_parser.set_defaults(func=cmd_seed)
+
+    reindex_parser = commands.add_parser("reindex", help=cmd_reindex.__doc__)
+    reindex_parser.set_defaults(func=cmd_reindex)
+
+    search_parser = commands.add_parser("reindex-search", help=cmd_reindex_search.__doc__)
+    search_parser.set_defaults(func=cmd_reindex_search)
+
+    export_parser = commands.add_parser("export", help=cmd_export.__doc__)
+    export_parser.add_argument("collections", nargs="*", metavar="collection", help="default: all")
+    export_parser.add_argument("--out", default=exports.EXPORT_DIR, help="export directory")
+    export_parser.add_argument("--full", action="store_true", help="rewrite everything instead of only changes")
+    export_parser.set_defaults(func=cmd_export)
+
+    compact_parser = commands.add_parser("compact-notifications", help=cmd_compact_notifications.__doc__)
+    compact_parser.set_defaults(func=cmd_compact_notifications)
+
+    stress_parser = commands.add_parser("stress-joins", help=cmd_stress_joins.__doc__)
+    stress_parser.add_argument("--joins", type=int, default=500)
+    stress_parser.add_argument("--processes", type=int, default=4)
+    stress_parser.add_argument("--threads", type=int, default=32, help="Concurrent threads per process")
+    stress_parser.add_argument("--backend", choices=list(storage.BACKENDS), default="sqlite")
+    stress_parser.set_defaults(func=cmd_stress_joins)
+
+    gc_parser = commands.add_parser("gc-blobs", help=cmd_gc_blobs.__doc__)
+    gc_parser.set_defaults(func=cmd_gc_blobs)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
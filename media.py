@@ -0,0 +1,194 @@
+import io
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from PIL import Image, ImageOps
+import blobs
+import storage
+
+MEDIA_DIR = "media_gallery"
+RAW_DIR = os.path.join(MEDIA_DIR, "incoming")
+
+# Longest edge in pixels for each generated rendition
+RENDITIONS = {
+    "thumb": 320,
+    "medium": 1024,
+    "full": 2048
+}
+RENDITION_FORMAT = "WEBP"
+RENDITION_QUALITY = 80
+
+GALLERY_PAGE_SIZE = 12
+# How long a file-existence check is trusted before hitting the filesystem again
+EXISTS_TTL = 60
+EXISTS_CACHE_SIZE = 10000
+
+# Pillow releases the GIL while decoding and resizing, so threads scale well here
+MEDIA_WORKERS = int(os.environ.get("ATMOSPHERE_MEDIA_WORKERS", min(4, os.cpu_count() or 1)))
+
+_executor = None
+_executor_lock = threading.Lock()
+_exists_cache = {}  # path -> (checked_at, exists)
+_exists_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the shared background pool that processes uploads"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MEDIA_WORKERS, thread_name_prefix="media")
+        return _executor
+
+
+def _write_bytes(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def render(image, max_edge):
+    """Return WebP bytes of image scaled down to max_edge, without any metadata"""
+    copy = image.copy()
+    copy.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    out = io.BytesIO()
+    # Saving without exif=/icc_profile= drops EXIF, GPS and other metadata
+    copy.save(out, RENDITION_FORMAT, quality=RENDITION_QUALITY, method=4)
+    return out.getvalue()
+
+
+def process(media_id):
+    """Decode the raw upload once and write every rendition (runs on the worker pool)"""
+    record = storage.get("media", media_id)
+    if record is None:
+        return None
+    raw_path = record["raw_path"]
+    try:
+        with Image.open(raw_path) as source:
+            image = ImageOps.exif_transpose(source)
+            image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        digests = {
+            name: blobs.put(render(image, max_edge), RENDITION_FORMAT.lower())
+            for name, max_edge in RENDITIONS.items()
+        }
+    except Exception as e:
+        error = str(e)
+
+        def fail(m):
+            m.update({"status": "failed", "error": error})
+            m.pop("raw_path", None)
+        storage.update("media", media_id, fail)
+        # Nothing will retry a failed upload, so its raw bytes would only leak
+        try:
+            os.remove(raw_path)
+        except FileNotFoundError:
+            pass
+        return None
+
+    record = _finish(media_id, digests, image.width, image.height)
+    os.remove(raw_path)
+    return record
+
+
+def _finish(media_id, digests, width, height):
+    def finish(m):
+        renditions = {name: blobs.blob_path(d, RENDITION_FORMAT.lower()) for name, d in digests.items()}
+        m.update({
+            "status": "ready",
+            "blobs": digests,
+            "renditions": renditions,
+            "file_path": renditions["full"],
+            "width": width,
+            "height": height
+        })
+        m.pop("raw_path", None)
+    record = storage.update("media", media_id, finish)
+    blobs.incref(digests.values())
+    return record
+
+
+def delete(media_id):
+    """Remove a media record and release its blobs (files go at the next GC)"""
+    record = storage.get("media", media_id)
+    if record is None:
+        return False
+    storage.delete("media", media_id)
+    blobs.decref(record.get("blobs", {}).values())
+    return True
+
+
+def file_exists(path):
+    """os.path.exists with a short-lived, bounded cache"""
+    now = time.monotonic()
+    with _exists_lock:
+        cached = _exists_cache.get(path)
+        if cached is not None and now - cached[0] < EXISTS_TTL:
+            return cached[1]
+    exists = os.path.exists(path)
+    with _exists_lock:
+        if len(_exists_cache) >= EXISTS_CACHE_SIZE:
+            _exists_cache.clear()
+        _exists_cache[path] = (now, exists)
+    return exists
+
+
+def display_path(item, rendition="thumb"):
+    """Path of the requested rendition, falling back to the original file for legacy uploads"""
+    return item.get("renditions", {}).get(rendition) or item.get("file_path")
+
+
+def gallery_page(user_id, cursor=None, limit=GALLERY_PAGE_SIZE):
+    """Return (a page of the user's media, newest first; cursor for the next page or None)"""
+    return storage.page("user_media", user_id, limit, cursor)
+
+
+def ingest(user_id, data, location, circle_id=None, tags=None):
+    """Persist the raw upload, create the media record and queue processing.
+
+    Returns the new record (status "processing") as soon as the bytes are
+    on disk; renditions are produced in the background. Bytes that were
+    uploaded before reuse the existing renditions and come back "ready".
+    """
+    media_id = f"med_{uuid.uuid4().hex[:8]}"
+    source_digest = blobs.digest(data)
+    record = {
+        "media_id": media_id,
+        "user_id": user_id,
+        "source_digest": source_digest,
+        "status": "processing",
+        "location": {"name": location},
+        "timestamp": datetime.now().isoformat(),
+        "circle_id": circle_id,
+        "tags": tags or [],
+        "reports": []
+    }
+    # Same bytes seen before: share the existing renditions, no decoding or new files
+    existing = next(
+        (m for m in storage.find("source_media", source_digest) if m.get("status") == "ready" and m.get("blobs")),
+        None
+    )
+    if existing is not None:
+        storage.put("media", media_id, record)
+        return _finish(media_id, existing["blobs"], existing.get("width"), existing.get("height"))
+
+    raw_path = os.path.join(RAW_DIR, f"{media_id}.upload")
+    _write_bytes(raw_path, data)
+    record["raw_path"] = raw_path
+    storage.put("media", media_id, record)
+    get_executor().submit(process, media_id)
+    return record
+
+
+def resume_pending():
+    """Requeue uploads left in "processing" by a restart"""
+    pending = [m["media_id"] for m in storage.load("media") if m.get("status") == "processing"]
+    for media_id in pending:
+        get_executor().submit(process, media_id)
+    return len(pending)
@@ -0,0 +1,383 @@
+import json
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import storage
+
+# Retention: keep at most RETENTION_COUNT notifications per user, none older than RETENTION_DAYS
+RETENTION_COUNT = int(os.environ.get("ATMOSPHERE_NOTIFICATION_RETENTION", 200))
+RETENTION_DAYS = int(os.environ.get("ATMOSPHERE_NOTIFICATION_TTL_DAYS", 90))
+# Compact a user's feed once it grows this far past RETENTION_COUNT (keeps appends amortized O(1))
+COMPACT_SLACK = max(1, RETENTION_COUNT // 10)
+PAGE_SIZE = 20
+# Large fan-outs are committed in chunks so one transaction never holds the write lock for long
+FANOUT_BATCH_SIZE = 500
+
+log = logging.getLogger(__name__)
+
+_fanout_executor = None
+_fanout_lock = threading.Lock()
+
+
+def new_notification(notification_type, content, related_id=None):
+    """Build a notification dict ready for add_many()"""
+    return {
+        "notification_id": f"notif_{uuid.uuid4().hex[:8]}",
+        "type": notification_type,
+        "content": content,
+        "timestamp": datetime.now().isoformat(),
+        "read": False,
+        "related_id": related_id
+    }
+
+
+def _cutoff(now=None):
+    return ((now or datetime.now()) - timedelta(days=RETENTION_DAYS)).isoformat()
+
+
+class SQLiteNotificationStore:
+    """Append-only per-user notification log with an unread counter row per user"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def init(self):
+        with self.backend.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS notification_log (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    notification_id TEXT UNIQUE NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    read INTEGER NOT NULL DEFAULT 0,
+                    data TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS notification_log_user ON notification_log (user_id, seq)")
+            conn.execute("CREATE INDEX IF NOT EXISTS notification_log_time ON notification_log (timestamp)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS notification_counts (
+                    user_id TEXT PRIMARY KEY,
+                    total INTEGER NOT NULL,
+                    unread INTEGER NOT NULL
+                )
+            """)
+        if not self.backend.get_meta("notifications_migrated"):
+            self._import_legacy()
+
+    def _import_legacy(self):
+        # One-shot copy of the old user_id -> [notifications] collection into the log
+        legacy = self.backend.load("notifications")
+        with self.backend.transaction() as conn:
+            for user_id, feed in legacy.items():
+                for notification in feed:
+                    self._insert(conn, user_id, notification)
+            self.backend.bump(conn, "notifications")
+        self.backend.set_meta("notifications_migrated", datetime.now().isoformat())
+
+    def _insert(self, conn, user_id, notification):
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO notification_log (user_id, notification_id, timestamp, read, data) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (user_id, notification["notification_id"], notification["timestamp"],
+             int(bool(notification.get("read"))), json.dumps(notification))
+        )
+        if cursor.rowcount:
+            conn.execute(
+                "INSERT INTO notification_counts (user_id, total, unread) VALUES (?, 1, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET total = total + 1, unread = unread + excluded.unread",
+                (user_id, int(not notification.get("read")))
+            )
+
+    def _recount(self, conn, user_id):
+        conn.execute("""
+            UPDATE notification_counts SET
+                total = (SELECT COUNT(*) FROM notification_log WHERE user_id = ?1),
+                unread = (SELECT COUNT(*) FROM notification_log WHERE user_id = ?1 AND read = 0)
+            WHERE user_id = ?1
+        """, (user_id,))
+
+    def _trim(self, conn, user_id):
+        removed = conn.execute("""
+            DELETE FROM notification_log WHERE user_id = ?1 AND seq <= (
+                SELECT seq FROM notification_log WHERE user_id = ?1 ORDER BY seq DESC LIMIT 1 OFFSET ?2
+            )
+        """, (user_id, RETENTION_COUNT)).rowcount
+        self._recount(conn, user_id)
+        return removed
+
+    def add_many(self, entries):
+        users = list({user_id for user_id, _ in entries})
+        with self.backend.transaction() as conn:
+            for user_id, notification in entries:
+                self._insert(conn, user_id, notification)
+            overfull = conn.execute(
+                f"SELECT user_id FROM notification_counts WHERE total > ? "
+                f"AND user_id IN ({','.join('?' * len(users))})",
+                [RETENTION_COUNT + COMPACT_SLACK] + users
+            ).fetchall()
+            for (user_id,) in overfull:
+                self._trim(conn, user_id)
+            self.backend.bump(conn, "notifications")
+
+    def page(self, user_id, limit, cursor=None):
+        rows = self.backend.connect().execute(
+            "SELECT seq, read, data FROM notification_log WHERE user_id = ? AND seq < ? "
+            "ORDER BY seq DESC LIMIT ?",
+            (user_id, int(cursor) if cursor else 2 ** 62, limit + 1)
+        ).fetchall()
+        items = []
+        for seq, read, data in rows[:limit]:
+            notification = json.loads(data)
+            notification["read"] = bool(read)
+            items.append(notification)
+        next_cursor = str(rows[limit - 1][0]) if len(rows) > limit else None
+        return items, next_cursor
+
+    def unread_count(self, user_id):
+        row = self.backend.connect().execute(
+            "SELECT unread FROM notification_counts WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def mark_read(self, user_id, notification_ids=None):
+        with self.backend.transaction() as conn:
+            if notification_ids is None:
+                changed = conn.execute(
+                    "UPDATE notification_log SET read = 1 WHERE user_id = ? AND read = 0", (user_id,)
+                ).rowcount
+            else:
+                ids = list(notification_ids)
+                changed = conn.execute(
+                    f"UPDATE notification_log SET read = 1 WHERE user_id = ? AND read = 0 "
+                    f"AND notification_id IN ({','.join('?' * len(ids))})",
+                    [user_id] + ids
+                ).rowcount if ids else 0
+            conn.execute(
+                "UPDATE notification_counts SET unread = MAX(unread - ?, 0) WHERE user_id = ?",
+                (changed, user_id)
+            )
+            self.backend.bump(conn, "notifications")
+        return changed
+
+    def compact(self, now=None):
+        with self.backend.transaction() as conn:
+            expired = [row[0] for row in conn.execute(
+                "SELECT DISTINCT user_id FROM notification_log WHERE timestamp < ?", (_cutoff(now),)
+            ).fetchall()]
+            removed = conn.execute(
+                "DELETE FROM notification_log WHERE timestamp < ?", (_cutoff(now),)
+            ).rowcount
+            for user_id in expired:
+                self._recount(conn, user_id)
+            overfull = conn.execute(
+                "SELECT user_id FROM notification_counts WHERE total > ?", (RETENTION_COUNT,)
+            ).fetchall()
+            for (user_id,) in overfull:
+                removed += self._trim(conn, user_id)
+            self.backend.bump(conn, "notifications")
+        return removed
+
+    def stamps(self):
+        rows = self.backend.connect().execute("SELECT notification_id, seq, read FROM notification_log").fetchall()
+        return {notification_id: f"{seq}.{read}" for notification_id, seq, read in rows}
+
+    def items(self, notification_ids):
+        ids = list(notification_ids)
+        rows = []
+        conn = self.backend.connect()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows.extend(conn.execute(
+                f"SELECT seq, notification_id, user_id, read, data FROM notification_log "
+                f"WHERE notification_id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall())
+        items = []
+        for _, notification_id, user_id, read, data in sorted(rows):
+            notification = json.loads(data)
+            notification.update(user_id=user_id, read=bool(read))
+            items.append((notification_id, notification))
+        return items
+
+
+class CollectionNotificationStore:
+    """Fallback for backends without a notification log: one list per user in the notifications collection"""
+
+    def init(self):
+        pass
+
+    def add_many(self, entries):
+        by_user = {}
+        for user_id, notification in entries:
+            by_user.setdefault(user_id, []).append(notification)
+
+        for user_id, new in by_user.items():
+            def append(feed):
+                feed.extend(new)
+                if len(feed) > RETENTION_COUNT + COMPACT_SLACK:
+                    del feed[:-RETENTION_COUNT]
+            storage.update("notifications", user_id, append, default=[])
+
+    def page(self, user_id, limit, cursor=None):
+        feed = storage.get("notifications", user_id, [])
+        end = int(cursor) if cursor else len(feed)
+        start = max(end - limit, 0)
+        return feed[start:end][::-1], (str(start) if start > 0 else None)
+
+    def unread_count(self, user_id):
+        return sum(1 for n in storage.get("notifications", user_id, []) if not n.get("read"))
+
+    def mark_read(self, user_id, notification_ids=None):
+        ids = None if notification_ids is None else set(notification_ids)
+        changed = []
+
+        def mark(feed):
+            for notification in feed:
+                if not notification.get("read") and (ids is None or notification["notification_id"] in ids):
+                    notification["read"] = True
+                    changed.append(notification)
+        storage.update("notifications", user_id, mark, default=[])
+        return len(changed)
+
+    def compact(self, now=None):
+        cutoff = _cutoff(now)
+        feeds = storage.load("notifications", writable=True)
+        removed = 0
+        for user_id, feed in feeds.items():
+            kept = [n for n in feed if n["timestamp"] >= cutoff][-RETENTION_COUNT:]
+            removed += len(feed) - len(kept)
+            feeds[user_id] = kept
+        if removed:
+            storage.save("notifications", feeds)
+        return removed
+
+    def _entries(self):
+        for user_id, feed in storage.load("notifications").items():
+            for notification in feed:
+                yield notification["notification_id"], dict(notification, user_id=user_id)
+
+    def stamps(self):
+        return {notification_id: storage.record_stamp(n) for notification_id, n in self._entries()}
+
+    def items(self, notification_ids):
+        wanted = set(notification_ids)
+        return [(notification_id, n) for notification_id, n in self._entries() if notification_id in wanted]
+
+
+_stores = {}
+
+
+def get_store():
+    """Return the notification store for the active storage backend"""
+    backend = storage.get_backend()
+    store = _stores.get(id(backend))
+    if store is None:
+        if isinstance(backend, storage.SQLiteBackend):
+            store = SQLiteNotificationStore(backend)
+        else:
+            store = CollectionNotificationStore()
+        _stores[id(backend)] = store
+    return store
+
+
+def init():
+    """Create the notification tables and import legacy per-user lists once"""
+    get_store().init()
+
+
+def add(user_id, notification_type, content, related_id=None):
+    """Append one notification to a user's feed"""
+    notification = new_notification(notification_type, content, related_id)
+    add_many([(user_id, notification)])
+    return notification
+
+
+def add_many(entries):
+    """Append many (user_id, notification) pairs; each batch is a single write"""
+    entries = list(entries)
+    for start in range(0, len(entries), FANOUT_BATCH_SIZE):
+        get_store().add_many(entries[start:start + FANOUT_BATCH_SIZE])
+    if entries:
+        storage.cache.invalidate("notifications")
+    return len(entries)
+
+
+def notify_users(user_ids, notification_type, content, related_id=None):
+    """Send the same notification to several users in one write"""
+    return add_many(
+        (user_id, new_notification(notification_type, content, related_id))
+        for user_id in dict.fromkeys(user_ids)
+    )
+
+
+def stamps():
+    """{notification_id: stamp} for every stored notification, like storage.stamps()"""
+    return get_store().stamps()
+
+
+def items(notification_ids):
+    """(notification_id, notification) pairs, each with the user_id it was sent to"""
+    return get_store().items(notification_ids)
+
+
+def get_fanout_executor():
+    """Single background worker that delivers circle-wide notifications in order"""
+    global _fanout_executor
+    with _fanout_lock:
+        if _fanout_executor is None:
+            _fanout_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fanout")
+        return _fanout_executor
+
+
+def _notify_circle(circle_id, notification_type, content, related_id, exclude):
+    circle = storage.get("circles", circle_id)
+    if circle is None:
+        return 0
+    excluded = set(exclude or ())
+    members = [m for m in circle.get("members", []) if m not in excluded]
+    return notify_users(members, notification_type, content, related_id)
+
+
+def notify_circle(circle_id, notification_type, content, related_id=None, exclude=None):
+    """Queue a notification to every member of a circle; returns a Future with the count sent"""
+    future = get_fanout_executor().submit(
+        _notify_circle, circle_id, notification_type, content, related_id, exclude
+    )
+
+    def report(done):
+        # Callers don't wait on the Future, so a failure would otherwise vanish
+        error = done.exception()
+        if error is not None:
+            log.error("Fan-out of %s notification to circle %s failed", notification_type, circle_id, exc_info=error)
+    future.add_done_callback(report)
+    return future
+
+
+def page(user_id, limit=PAGE_SIZE, cursor=None):
+    """Return (notifications newest first, cursor for the next page or None)"""
+    return get_store().page(user_id, limit, cursor)
+
+
+def latest(user_id, limit=3):
+    return page(user_id, limit)[0]
+
+
+def unread_count(user_id):
+    return get_store().unread_count(user_id)
+
+
+def mark_read(user_id, notification_ids=None):
+    """Mark the given notifications (or all of them) as read; returns how many changed"""
+    changed = get_store().mark_read(user_id, notification_ids)
+    storage.cache.invalidate("notifications")
+    return changed
+
+
+def compact(now=None):
+    """Drop notifications past RETENTION_DAYS or beyond RETENTION_COUNT per user"""
+    removed = get_store().compact(now)
+    storage.cache.invalidate("notifications")
+    return removed
@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+
+# bcrypt cost factor for new hashes; existing hashes are upgraded on the next successful login
+BCRYPT_ROUNDS = int(os.environ.get("ATMOSPHERE_BCRYPT_ROUNDS", 12))
+
+
+def _usable_cpus():
+    # Respects the CPU set a container or taskset limits us to; not available on macOS/Windows
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+HASH_WORKERS = int(os.environ.get("ATMOSPHERE_HASH_WORKERS", _usable_cpus()))
+# Jobs allowed in flight before callers wait, so a login burst can't queue without bound
+MAX_PENDING = HASH_WORKERS * 4
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(MAX_PENDING)
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def _verify(password, hashed):
+    return bcrypt.checkpw(password.encode(), hashed.encode())
+
+
+def get_pool():
+    """Return the shared process pool for bcrypt work, one worker per core"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Forking the threaded server can copy a lock mid-use into the child; start workers clean
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def _run(fn, *args):
+    global _pool
+    with _pending:
+        try:
+            return get_pool().submit(fn, *args).result()
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool next time and finish this job inline
+            with _pool_lock:
+                _pool = None
+            return fn(*args)
+
+
+def hash_password(password, rounds=None):
+    return _run(_hash, password, rounds or BCRYPT_ROUNDS)
+
+
+def verify_password(password, hashed):
+    return _run(_verify, password, hashed)
+
+
+def cost(hashed):
+    """Cost factor encoded in a bcrypt hash ($2b$<cost>$...)"""
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def needs_rehash(hashed):
+    return cost(hashed) != BCRYPT_ROUNDS
+
+
+def verify_and_upgrade(password, hashed):
+    """Check a password; returns (ok, new_hash) where new_hash is set when the cost factor changed"""
+    if not verify_password(password, hashed):
+        return False, None
+    if needs_rehash(hashed):
+        return True, hash_password(password)
+    return True, None
@@ -0,0 +1,145 @@
+import threading
+from datetime import datetime
+import analytics
+import storage
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def is_active(promo, day):
+    """True if the promotion runs on day (YYYY-MM-DD); missing dates are open-ended"""
+    return (promo.get("start_date") or "") <= day <= (promo.get("end_date") or "9999-12-31")
+
+
+def _tags(promo):
+    return {storage.normalize_tag(t) for t in promo.get("tags", [])} - {""}
+
+
+class PromotionMatcher:
+    """Inverted index from normalized tag to the promotions active on one day"""
+
+    def __init__(self, promotions, day):
+        self.day = day
+        self.promotions = {}
+        self.tags = {}    # promo_id -> its normalized tags
+        self.by_tag = {}  # tag -> tuple of promo ids
+        for promo_id, promo in promotions.items():
+            if is_active(promo, day):
+                self.promotions[promo_id] = promo
+                self.tags[promo_id] = _tags(promo)
+                for tag in self.tags[promo_id]:
+                    self.by_tag.setdefault(tag, []).append(promo_id)
+        self.by_tag = {tag: tuple(ids) for tag, ids in self.by_tag.items()}
+
+    def copy(self):
+        """A copy to change while concurrent readers keep using this one"""
+        clone = object.__new__(PromotionMatcher)
+        clone.day = self.day
+        clone.promotions, clone.tags, clone.by_tag = dict(self.promotions), dict(self.tags), dict(self.by_tag)
+        return clone
+
+    def add(self, promo_id, promo):
+        """Index a promotion, replacing any earlier version of it"""
+        if not is_active(promo, self.day):
+            self.remove(promo_id)
+            return
+        tags = _tags(promo)
+        # A claim leaves the tags alone, so only the stored record is replaced
+        if tags != self.tags.get(promo_id):
+            self.remove(promo_id)
+            for tag in tags:
+                self.by_tag[tag] = self.by_tag.get(tag, ()) + (promo_id,)
+            self.tags[promo_id] = tags
+        self.promotions[promo_id] = promo
+
+    def remove(self, promo_id):
+        for tag in self.tags.pop(promo_id, ()):
+            remaining = tuple(p for p in self.by_tag.get(tag, ()) if p != promo_id)
+            if remaining:
+                self.by_tag[tag] = remaining
+            else:
+                self.by_tag.pop(tag, None)
+        self.promotions.pop(promo_id, None)
+
+    def match_ids(self, tags):
+        matched = {}
+        for tag in {storage.normalize_tag(t) for t in tags}:
+            for promo_id in self.by_tag.get(tag, ()):
+                matched[promo_id] = True
+        return list(matched)
+
+    def match(self, tags):
+        return [self.promotions[promo_id] for promo_id in self.match_ids(tags)]
+
+
+def get_matcher(day=None):
+    """Return the compiled matcher for day, rebuilt when the day rolls over or another process wrote promotions"""
+    global _matcher
+    day = day or datetime.now().strftime("%Y-%m-%d")
+    version = storage.get_backend().version("promotions")
+    with _matcher_lock:
+        if _matcher is not None and _matcher[0] == (version, day):
+            return _matcher[1]
+    # The version is read before loading, so a write racing the build is caught next time
+    matcher = PromotionMatcher(storage.load("promotions"), day)
+    with _matcher_lock:
+        _matcher = ((version, day), matcher)
+    return matcher
+
+
+@storage.on_write
+def _on_write(collection, key, record):
+    global _matcher
+    if collection != "promotions":
+        return
+    with _matcher_lock:
+        if _matcher is None:
+            return
+        if key is None:
+            _matcher = None  # whole collection replaced; rebuild on the next match
+            return
+        # Copy-on-write, so a match running concurrently never sees a half-applied change
+        matcher = _matcher[1].copy()
+        if record is None:
+            matcher.remove(key)
+        else:
+            matcher.add(key, record)
+        _matcher = ((storage.get_backend().version("promotions"), matcher.day), matcher)
+
+
+def match(tags, day=None):
+    """Active promotions whose tags overlap tags"""
+    return get_matcher(day).match(tags)
+
+
+def match_many(media_items, day=None):
+    """Match a batch of media records at once; returns {media_id: [promotions]} for those that matched"""
+    matcher = get_matcher(day)
+    results = {}
+    for item in media_items:
+        matched = matcher.match(item.get("tags", []))
+        if matched:
+            results[item["media_id"]] = matched
+    return results
+
+
+def claim(promo_id, user_id):
+    """Add user_id to a promotion's claimed_by in one atomic update.
+
+    Returns False if they had already claimed it and raises KeyError if the
+    promotion is gone. New claims are counted in the business's analytics.
+    """
+    added = []
+
+    def add(promo):
+        added.clear()
+        claimed = promo.setdefault("claimed_by", [])
+        if user_id not in claimed:
+            claimed.append(user_id)
+            added.append(True)
+
+    promo = storage.update("promotions", promo_id, add)
+    if added:
+        analytics.record_claim(promo)
+    return bool(added)
@@ -0,0 +1,133 @@
+import heapq
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import analytics
+import notifications
+import storage
+
+# Collections whose writes can change a user's dashboard
+DASHBOARD_COLLECTIONS = ("circles", "events", "media", "notifications")
+DASHBOARD_MEMO_SIZE = 1024
+EVENTS_PAGE_SIZE = 10
+POPULAR_CIRCLES_SIZE = 4
+
+_dashboard_memo = OrderedDict()  # (user_id, limit) -> (generation, result)
+_dashboard_lock = threading.Lock()
+
+
+class EventFull(Exception):
+    """The event has no seats left"""
+
+
+def upcoming(events, limit, today=None):
+    """Return the next `limit` events on or after today, soonest first"""
+    today = today or datetime.now().strftime("%Y-%m-%d")
+    future = (e for e in events if e.get("date", "") >= today)
+    return heapq.nsmallest(limit, future, key=lambda e: (e.get("date", ""), e.get("time", "")))
+
+
+def dashboard(user_id, limit=3):
+    """Everything the home page needs for one user, in one pass.
+
+    Returns circles, the total number of events in those circles, the next
+    `limit` upcoming events, the media count and the latest notifications.
+    Results are memoized per user until one of DASHBOARD_COLLECTIONS changes.
+    """
+    generation = storage.generation(*DASHBOARD_COLLECTIONS)
+    memo_key = (user_id, limit)
+    with _dashboard_lock:
+        cached = _dashboard_memo.get(memo_key)
+        if cached is not None and cached[0] == generation:
+            _dashboard_memo.move_to_end(memo_key)
+            return cached[1]
+
+    circles = storage.find("user_circles", user_id)
+    event_ids = storage.lookup_many("circle_events", [c["circle_id"] for c in circles])
+    events = storage.get_many("events", event_ids)
+    result = {
+        "circles": circles,
+        "event_count": len(events),
+        "upcoming_events": upcoming(events, limit),
+        "media_count": len(storage.lookup("user_media", user_id)),
+        "notifications": notifications.latest(user_id, limit),
+        "unread_count": notifications.unread_count(user_id)
+    }
+
+    with _dashboard_lock:
+        _dashboard_memo[memo_key] = (generation, result)
+        _dashboard_memo.move_to_end(memo_key)
+        while len(_dashboard_memo) > DASHBOARD_MEMO_SIZE:
+            _dashboard_memo.popitem(last=False)
+    return result
+
+
+def events(city=None, tag=None, circle_id=None, attendee=None, limit=EVENTS_PAGE_SIZE, cursor=None, today=None):
+    """Return (events on or after today, soonest first; cursor for the next page or None).
+
+    The most selective filter picks the event_schedule scope to scan; any
+    other filters are checked on the records as the scan goes, so a page
+    never reads past events or more index entries than it needs.
+    """
+    today = today or datetime.now().strftime("%Y-%m-%d")
+    filters = [
+        f"circle:{circle_id}" if circle_id else None,
+        f"attendee:{attendee}" if attendee else None,
+        f"tag:{storage.normalize_tag(tag)}" if storage.normalize_tag(tag) else None,
+        f"city:{storage.normalize_city(city)}" if storage.normalize_city(city) else None
+    ]
+    filters = [f for f in filters if f] or ["all"]
+    scope, rest = filters[0], set(filters[1:])
+    results = []
+    while len(results) < limit:
+        batch, cursor = storage.scan("event_schedule", f"{scope}|{today}", f"{scope}|~", limit - len(results), cursor)
+        results.extend(e for e in batch if rest <= storage.schedule_scopes(e))
+        if cursor is None:
+            break
+    return results, cursor
+
+
+def cities():
+    """Cities circles are based in, for filter menus (events take their circle's city)"""
+    return sorted({
+        (c.get("location") or {}).get("city") for c in storage.load("circles").values()
+    } - {None, ""})
+
+
+def popular_circles(limit=POPULAR_CIRCLES_SIZE, public_only=True):
+    """The largest circles by member count"""
+    circles = storage.load("circles").values()
+    if public_only:
+        circles = (c for c in circles if c.get("type", "public") == "public")
+    return heapq.nlargest(limit, circles, key=lambda c: len(c.get("members") or []))
+
+
+def rsvp(event_id, user_id):
+    """Add user_id to an event's attendees in one atomic update.
+
+    Returns False if they were already attending. Raises EventFull when the
+    event is at capacity (0 means unlimited) and KeyError if it is gone.
+    """
+    added = []
+
+    def add(event):
+        added.clear()
+        attendees = event.setdefault("attendees", [])
+        if user_id in attendees:
+            return
+        if event.get("capacity") and len(attendees) >= event["capacity"]:
+            raise EventFull(event_id)
+        attendees.append(user_id)
+        added.append(True)
+
+    event = storage.update("events", event_id, add)
+    if added:
+        analytics.record_rsvp(event)
+    return bool(added)
+
+
+def cancel_rsvp(event_id, user_id):
+    storage.update(
+        "events", event_id,
+        lambda e: e.update({"attendees": [a for a in e.get("attendees", []) if a != user_id]})
+    )
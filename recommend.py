@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from scipy import sparse
+import geo
+import storage
+
+# How much each signal counts towards a circle's score; every signal is scaled to 0..1
+WEIGHT_INTERESTS = 0.4
+WEIGHT_CO_MEMBERS = 0.3
+WEIGHT_POPULARITY = 0.15
+WEIGHT_DISTANCE = 0.15
+# Distance at which the proximity signal has dropped to about a third
+DISTANCE_SCALE_KM = 50.0
+# Tags of a user's circles count this much next to the interests they picked themselves
+JOINED_TAG_WEIGHT = 0.5
+
+# A model this young is reused even if circles changed since; the user's own memberships
+# are always read fresh, so only other users' joins and new circles show up late
+MODEL_MAX_AGE = 60
+TOP_N = 50
+TOP_CACHE_SIZE = 10000
+
+_model = None
+_top = OrderedDict()  # user_id -> (fingerprint, [(circle key, distance)])
+_lock = threading.Lock()
+
+
+class Model:
+    """Sparse circle x tag and circle x member matrices plus per-circle arrays"""
+
+    def __init__(self, circles, generation):
+        self.generation = generation
+        self.built_at = time.monotonic()
+        self.keys = list(circles)
+        self.positions = {key: i for i, key in enumerate(self.keys)}
+        self.tags = {}
+        self.users = {}
+        tag_rows, tag_cols, member_rows, member_cols = [], [], [], []
+        lats = np.full(len(self.keys), np.nan)
+        lngs = np.full(len(self.keys), np.nan)
+        for row, circle in enumerate(circles.values()):
+            for tag in {storage.normalize_tag(t) for t in circle.get("tags") or []} - {""}:
+                tag_rows.append(row)
+                tag_cols.append(self.tags.setdefault(tag, len(self.tags)))
+            for user_id in set(circle.get("members") or []):
+                member_rows.append(row)
+                member_cols.append(self.users.setdefault(user_id, len(self.users)))
+            point = geo.location_of(circle)
+            if point is not None:
+                lats[row], lngs[row] = point
+
+        shape = (len(self.keys), max(len(self.tags), 1))
+        tag_matrix = sparse.csr_matrix((np.ones(len(tag_rows)), (tag_rows, tag_cols)), shape=shape)
+        # Rows scaled to unit length, so a dot product with a unit user vector is a cosine
+        norms = np.sqrt(np.asarray(tag_matrix.multiply(tag_matrix).sum(axis=1)).ravel())
+        self.circle_tags = sparse.diags(1 / np.maximum(norms, 1)) @ tag_matrix
+        self.members = sparse.csr_matrix(
+            (np.ones(len(member_rows)), (member_rows, member_cols)),
+            shape=(len(self.keys), max(len(self.users), 1))
+        )
+        self.members_t = self.members.T.tocsr()
+        sizes = np.asarray(self.members.sum(axis=1)).ravel()
+        self.popularity = np.log1p(sizes) / max(np.log1p(sizes.max(initial=0)), 1)
+        self.lats, self.lngs = lats, lngs
+        self.located = ~np.isnan(lats)
+
+    def user_vector(self, interests, joined):
+        """Unit tag vector for a user from their interests and the tags of the circles they joined"""
+        vector = np.zeros(self.circle_tags.shape[1])
+        for tag in {storage.normalize_tag(t) for t in interests or []}:
+            if tag in self.tags:
+                vector[self.tags[tag]] = 1.0
+        if len(joined):
+            vector += JOINED_TAG_WEIGHT * np.asarray(self.circle_tags[joined].sum(axis=0)).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def scores(self, user_id, interests, joined, here=None):
+        """Score of every circle for a user; circles they belong to get -inf"""
+        interest = self.circle_tags @ self.user_vector(interests, joined)
+
+        # People sharing a circle with the user, weighted by how many they share,
+        # then the circles those people are in
+        mine = np.zeros(len(self.keys))
+        mine[joined] = 1.0
+        neighbours = self.members_t @ mine
+        if user_id in self.users:
+            neighbours[self.users[user_id]] = 0.0
+        co_members = self.members @ neighbours
+        co_members /= max(co_members.max(initial=0), 1.0)
+
+        scores = (
+            WEIGHT_INTERESTS * interest
+            + WEIGHT_CO_MEMBERS * co_members
+            + WEIGHT_POPULARITY * self.popularity
+        )
+        distances = np.full(len(self.keys), np.nan)
+        if here is not None and self.located.any():
+            distances[self.located] = geo.haversine(*here, self.lats[self.located], self.lngs[self.located])
+            scores[self.located] += WEIGHT_DISTANCE * np.exp(-distances[self.located] / DISTANCE_SCALE_KM)
+        scores[joined] = -np.inf
+        return scores, distances
+
+    def top(self, user_id, interests, joined, here=None, limit=TOP_N):
+        """[(circle key, distance km or None)] best first"""
+        scores, distances = self.scores(user_id, interests, joined, here)
+        limit = min(limit, len(self.keys) - len(joined))
+        if limit <= 0:
+            return []
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [
+            (self.keys[i], None if np.isnan(distances[i]) else float(distances[i]))
+            for i in best
+        ]
+
+
+def get_model():
+    """The shared model, rebuilt when circles changed and it is older than MODEL_MAX_AGE"""
+    global _model
+    generation = storage.generation("circles")
+    with _lock:
+        model = _model
+        if model is not None and (
+            model.generation == generation or time.monotonic() - model.built_at < MODEL_MAX_AGE
+        ):
+            return model
+        model = Model(storage.load("circles"), generation)
+        _model = model
+        _top.clear()
+        return model
+
+
+def recommend(user, here=None, limit=5):
+    """[(circle, distance km or None)] a user has not joined, best match first.
+
+    Results are cached per user and recomputed when the model is rebuilt or
+    the user's memberships, interests or location change.
+    """
+    model = get_model()
+    user_id = user["user_id"]
+    joined_keys = sorted(storage.lookup("user_circles", user_id))
+    joined = np.array([model.positions[k] for k in joined_keys if k in model.positions], dtype=np.int64)
+    fingerprint = (model.built_at, tuple(joined_keys), tuple(sorted(user.get("interests") or [])), here)
+    with _lock:
+        cached = _top.get(user_id)
+        if cached is not None and cached[0] == fingerprint:
+            _top.move_to_end(user_id)
+            ranked = cached[1]
+        else:
+            ranked = None
+    if ranked is None:
+        ranked = model.top(user_id, user.get("interests"), joined, here, max(limit, TOP_N))
+        with _lock:
+            _top[user_id] = (fingerprint, ranked)
+            while len(_top) > TOP_CACHE_SIZE:
+                _top.popitem(last=False)
+
+    results = []
+    for key, distance in ranked:
+        circle = storage.get("circles", key)
+        if circle is not None and user_id not in (circle.get("members") or []):
+            results.append((circle, distance))
+            if len(results) == limit:
+                break
+    return results
+
@@ -0,0 +1,439 @@
+import atexit
+import bisect
+import math
+import os
+import pickle
+import re
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+import numpy as np
+import storage
+
+SEARCH_INDEX_PATH = os.environ.get("ATMOSPHERE_SEARCH_INDEX", os.path.join("data", "search.idx"))
+# Bumped whenever the tokenizer, FIELDS or the snapshot layout change
+SNAPSHOT_FORMAT = 2
+# Records read per query when catching up with writes made since the snapshot
+RELOAD_BATCH = 5000
+
+# Searchable fields per collection; a token found in a field counts `weight` times
+FIELDS = {
+    "circles": {"name": 3, "tags": 2, "description": 1, "location.city": 1},
+    "events": {"name": 3, "tags": 2, "description": 1, "location.name": 1},
+    "businesses": {"business_name": 3, "category": 2, "description": 1},
+    "promotions": {"offer": 3, "tags": 2, "description": 1, "requirements": 1},
+}
+COLLECTIONS = tuple(FIELDS)
+STOPWORDS = frozenset("a an and are as at be by for from in is it of on or the to with".split())
+TOKEN_RE = re.compile(r"\w+")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# The word being typed matches at most this many indexed words, the most common first,
+# once it is MIN_PREFIX characters long
+MAX_EXPANSIONS = 16
+MIN_PREFIX = 2
+# Documents indexed since the last merge are kept in plain lists until there are this many
+MAX_PENDING = 5000
+# Terms in more documents than this also keep their CHAMPIONS best documents, which
+# single-word and typeahead queries rank first instead of scoring the whole list
+CHAMPIONS = 1000
+CHAMPION_MIN_DF = 2 * CHAMPIONS
+
+_EMPTY = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+
+
+def words(text):
+    """Lowercased words of text, compatibility forms folded"""
+    return TOKEN_RE.findall(unicodedata.normalize("NFKC", text or "").casefold())
+
+
+def tokenize(text):
+    """words() without stopwords, as they are indexed"""
+    return [word for word in words(text) if word not in STOPWORDS]
+
+
+def _field(record, path):
+    value = record
+    for part in path.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    if isinstance(value, (list, tuple)):
+        return " ".join(str(v) for v in value)
+    return "" if value is None else str(value)
+
+
+def term_counts(collection, record):
+    """Weighted term frequencies of a record's searchable fields"""
+    counts = Counter()
+    for path, weight in FIELDS[collection].items():
+        for token in tokenize(_field(record, path)):
+            counts[token] += weight
+    return counts
+
+
+class SearchIndex:
+    """Inverted index with BM25 ranking and prefix matching.
+
+    Postings are packed into NumPy arrays per term, with a sorted vocabulary
+    for prefix lookups. Documents added later go to small pending postings
+    that queries read as well; deleted or replaced documents are only
+    marked dead until pack() rewrites the arrays.
+    """
+
+    def __init__(self):
+        self.doc_keys = []  # doc id -> (collection, key)
+        self.doc_ids = {}   # (collection, key) -> live doc id
+        self.lengths = np.zeros(0, dtype=np.float32)
+        self.live = np.zeros(0, dtype=bool)
+        self.kinds = np.zeros(0, dtype=np.int8)  # doc id -> position in COLLECTIONS
+        self.total_length = 0.0
+        self.postings = {}  # term -> (doc ids, term frequencies)
+        self.vocab = []     # sorted terms of postings
+        self.df = np.zeros(0, dtype=np.int64)  # document frequency per vocab entry
+        self.pending = {}   # term -> (array of doc ids, array of frequencies) since the last merge
+        self.pending_docs = 0
+        self.champions = {}  # term -> sorted doc ids of its best documents
+        self.versions = {}  # collection -> storage version the index reflects
+        self.stamps = {}    # collection -> {key: storage stamp indexed, None if written since}
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def _grow(self, size):
+        if size <= len(self.lengths):
+            return
+        capacity = max(size, 2 * len(self.lengths), 1024)
+        for name in ("lengths", "live", "kinds"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def add(self, collection, key, record):
+        """Index a record, replacing any earlier version of it"""
+        self.remove(collection, key)
+        counts = term_counts(collection, record)
+        doc = len(self.doc_keys)
+        self._grow(doc + 1)
+        self.doc_keys.append((collection, key))
+        self.doc_ids[(collection, key)] = doc
+        length = sum(counts.values())
+        self.lengths[doc] = length
+        self.live[doc] = True
+        self.kinds[doc] = COLLECTIONS.index(collection)
+        self.total_length += length
+        for term, tf in counts.items():
+            entry = self.pending.get(term)
+            if entry is None:
+                entry = self.pending[term] = (array("i"), array("f"))
+            entry[0].append(doc)
+            entry[1].append(tf)
+        self.pending_docs += 1
+
+    def remove(self, collection, key):
+        doc = self.doc_ids.pop((collection, key), None)
+        if doc is not None:
+            self.live[doc] = False
+            self.total_length -= float(self.lengths[doc])
+
+    def remove_collection(self, collection):
+        for doc_key in [k for k in self.doc_ids if k[0] == collection]:
+            self.remove(*doc_key)
+
+    def merge(self):
+        """Move pending postings into the packed arrays"""
+        added = False
+        for term, (docs, tfs) in self.pending.items():
+            packed = self.postings.get(term)
+            docs, tfs = np.array(docs, dtype=np.int32), np.array(tfs, dtype=np.float32)
+            if packed is None:
+                added = True
+            else:
+                docs, tfs = np.concatenate([packed[0], docs]), np.concatenate([packed[1], tfs])
+            self.postings[term] = (docs, tfs)
+            self._rank(term)
+        if added:
+            self.vocab = sorted(self.postings)
+        self.df = np.array([len(self.postings[term][0]) for term in self.vocab], dtype=np.int64)
+        self.pending = {}
+        self.pending_docs = 0
+
+    def pack(self):
+        """merge() and also drop dead documents, renumbering the live ones"""
+        self.merge()
+        size = len(self.doc_keys)
+        live = self.live[:size]
+        renumber = (np.cumsum(live) - 1).astype(np.int32)
+        postings = {}
+        for term, (docs, tfs) in self.postings.items():
+            keep = live[docs]
+            if keep.any():
+                postings[term] = (renumber[docs[keep]], tfs[keep])
+        self.doc_keys = [doc_key for doc_key, alive in zip(self.doc_keys, live) if alive]
+        self.doc_ids = {doc_key: doc for doc, doc_key in enumerate(self.doc_keys)}
+        self.lengths = self.lengths[:size][live]
+        self.kinds = self.kinds[:size][live]
+        self.live = np.ones(len(self.doc_keys), dtype=bool)
+        self.total_length = float(self.lengths.sum(dtype=np.float64))
+        self.postings = postings
+        self.champions = {}
+        for term in self.postings:
+            self._rank(term)
+        self.vocab = sorted(postings)
+        self.df = np.array([len(postings[term][0]) for term in self.vocab], dtype=np.int64)
+
+    def tidy(self):
+        """Fold pending postings in once there are many, compacting if a quarter of the documents died"""
+        if self.pending_docs <= MAX_PENDING:
+            return
+        if 4 * (len(self.doc_keys) - len(self.doc_ids)) > len(self.doc_keys):
+            self.pack()
+        else:
+            self.merge()
+
+    def _parts(self, term):
+        # Packed and pending postings of a term; doc ids ascend within each
+        parts = []
+        if term in self.postings:
+            parts.append(self.postings[term])
+        entry = self.pending.get(term)
+        if entry is not None:
+            parts.append((np.array(entry[0], dtype=np.int32), np.array(entry[1], dtype=np.float32)))
+        return parts
+
+    def _df(self, term):
+        packed = self.postings.get(term)
+        entry = self.pending.get(term)
+        return (len(packed[0]) if packed else 0) + (len(entry[0]) if entry else 0)
+
+    def _rank(self, term):
+        # Keep the CHAMPIONS best-scoring docs of very common terms as a shortcut for candidates
+        docs, tfs = self.postings[term]
+        if len(docs) <= CHAMPION_MIN_DF:
+            self.champions.pop(term, None)
+            return
+        average = max(self.total_length / max(len(self.doc_ids), 1), 1.0)
+        impact = tfs / (tfs + BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[docs] / average))
+        self.champions[term] = np.sort(docs[np.argpartition(-impact, CHAMPIONS - 1)[:CHAMPIONS]])
+
+    def expand(self, prefix, limit=MAX_EXPANSIONS):
+        """Indexed terms starting with prefix, most common first"""
+        start = bisect.bisect_left(self.vocab, prefix)
+        end = bisect.bisect_left(self.vocab, prefix + "\U0010ffff", start)
+        df = self.df[start:end]
+        if len(df) > limit:
+            top = start + np.argpartition(-df, limit - 1)[:limit]
+        else:
+            top = np.arange(start, end)
+        ranked = {self.vocab[i]: int(self.df[i]) for i in top}
+        for term, (docs, _) in self.pending.items():
+            if term.startswith(prefix):
+                ranked[term] = ranked.get(term, 0) + len(docs)
+        return sorted(ranked, key=lambda term: (-ranked[term], term))[:limit]
+
+    def _candidates(self, terms, champions):
+        parts = []
+        for term in terms:
+            for docs, _ in self._parts(term):
+                parts.append(self.champions.get(term, docs) if champions and len(docs) > CHAMPION_MIN_DF else docs)
+        return np.unique(np.concatenate(parts)) if parts else _EMPTY[0]
+
+    def _score(self, candidates, terms, count, average):
+        # BM25 of each candidate summed over terms, and whether it has any of them
+        scores = np.zeros(len(candidates))
+        found = np.zeros(len(candidates), dtype=bool)
+        for term in terms:
+            df = self._df(term)
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            for docs, tfs in self._parts(term):
+                at = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+                hit = docs[at] == candidates
+                tf = tfs[at[hit]]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[candidates[hit]] / average)
+                scores[hit] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+                found |= hit
+        return scores, found
+
+    def search(self, text, collections=None, limit=10, prefix=True):
+        """[(collection, key, score)] for documents holding every word of text, best first.
+
+        With prefix=True the last word also matches longer words starting
+        with it, unless text ends in a space (the word is finished).
+        """
+        typed = words(text)
+        if not typed or not self.doc_ids or limit <= 0:
+            return []
+        groups = [[word] for word in dict.fromkeys(typed[:-1]) if word not in STOPWORDS]
+        last = typed[-1]
+        if prefix and not text[-1].isspace():
+            # A word still being typed counts once it is long enough to narrow the results
+            if len(last) >= MIN_PREFIX:
+                expansions = self.expand(last)
+                groups.append(expansions if last in expansions else expansions + [last])
+        elif last not in STOPWORDS:
+            groups.append([last])
+        if not groups:
+            return []
+        sizes = [sum(self._df(term) for term in group) for group in groups]
+        if not all(sizes):
+            return []
+        # Candidates come from the rarest word; the others are looked up in them
+        groups = [groups[i] for i in np.argsort(sizes, kind="stable")]
+        wanted = [COLLECTIONS.index(c) for c in collections or () if c in FIELDS]
+        count = len(self.doc_ids)
+        average = max(self.total_length / count, 1.0)
+
+        shortcut = any(self._df(term) > CHAMPION_MIN_DF for term in groups[0])
+        for champions in (True, False) if shortcut else (False,):
+            docs = self._candidates(groups[0], champions)
+            docs = docs[self.live[docs]]
+            if collections:
+                docs = docs[np.isin(self.kinds[docs], wanted)]
+            totals = np.zeros(len(docs))
+            for group in groups:
+                scores, found = self._score(docs, group, count, average)
+                docs, totals = docs[found], (totals + scores)[found]
+            # Champion lists can miss matches when the other words or the filter are selective
+            if len(docs) >= limit:
+                break
+        if len(totals) > limit:
+            top = np.argpartition(-totals, limit - 1)[:limit]
+        else:
+            top = np.arange(len(totals))
+        top = top[np.lexsort((docs[top], -totals[top]))]
+        return [(*self.doc_keys[docs[i]], float(totals[i])) for i in top]
+
+
+_index = None
+_dirty = False
+_lock = threading.RLock()
+
+
+def _versions():
+    backend = storage.get_backend()
+    return {collection: backend.version(collection) for collection in COLLECTIONS}
+
+
+def _reload(index, collection, version):
+    """Re-index the records whose storage stamp differs from the one indexed"""
+    current = storage.stamps(collection)
+    known = index.stamps.get(collection)
+    if known is None:
+        index.remove_collection(collection)
+        known = {}
+    for key in known.keys() - current.keys():
+        index.remove(collection, key)
+    changed = [key for key, stamp in current.items() if known.get(key) != stamp]
+    for start in range(0, len(changed), RELOAD_BATCH):
+        for key, record in storage.items(collection, changed[start:start + RELOAD_BATCH]):
+            index.add(collection, key, record)
+    index.stamps[collection] = current
+    index.versions[collection] = version
+
+
+def _load_snapshot(path=SEARCH_INDEX_PATH):
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get("format") != SNAPSHOT_FORMAT:
+        return None
+    return snapshot["index"]
+
+
+def save_snapshot(path=SEARCH_INDEX_PATH):
+    """Write the index to disk so the next start only re-reads records changed since"""
+    global _dirty
+    with _lock:
+        if _index is None:
+            return False
+        _index.pack()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"format": SNAPSHOT_FORMAT, "index": _index}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        _dirty = False
+        return True
+
+
+def get_index():
+    """The shared index, brought up to date with collections written outside this process"""
+    global _index, _dirty
+    with _lock:
+        if _index is None:
+            _index = _load_snapshot() or SearchIndex()
+        # Versions are read before loading, so a write racing the reload is caught next time
+        stale = {c: v for c, v in _versions().items() if _index.versions.get(c, ()) != v}
+        for collection, version in stale.items():
+            _reload(_index, collection, version)
+        _index.tidy()
+        if stale:
+            _dirty = True
+        return _index
+
+
+def rebuild():
+    """Index every searchable collection from scratch and save the snapshot"""
+    global _index
+    with _lock:
+        _index = SearchIndex()
+        get_index()
+        save_snapshot()
+        return len(_index)
+
+
+@storage.on_write
+def _on_write(collection, key, record):
+    global _dirty
+    if collection not in FIELDS:
+        return
+    with _lock:
+        if _index is None:
+            return
+        if key is None:
+            # Whole collection replaced; reload it all on the next query
+            _index.versions.pop(collection, None)
+            _index.stamps.pop(collection, None)
+            return
+        stamps = _index.stamps.get(collection, {})
+        if record is None:
+            _index.remove(collection, key)
+            stamps.pop(key, None)
+        else:
+            _index.add(collection, key, record)
+            stamps[key] = None  # the new stamp isn't known here; re-read at the next reload
+        _index.versions[collection] = storage.get_backend().version(collection)
+        _dirty = True
+
+
+def search(text, collections=None, limit=10):
+    """[(collection, record, score)] matching text, best first; the last word also matches as a prefix"""
+    with _lock:
+        hits = get_index().search(text, collections, limit)
+    results = []
+    for collection, key, score in hits:
+        record = storage.get(collection, key)
+        if record is not None:
+            results.append((collection, record, score))
+    return results
+
+
+def complete(prefix, limit=8):
+    """Indexed words starting with the last word of prefix, most common first"""
+    tokens = tokenize(prefix)
+    if not tokens:
+        return []
+    with _lock:
+        return get_index().expand(tokens[-1], limit)
+
+
+@atexit.register
+def _save_on_exit():
+    if _dirty:
+        try:
+            save_snapshot()
+        except OSError:
+            pass
@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta
+import accounts
+import notifications
+import passwords
+import storage
+
+# Bump when the sample data below changes so existing installs get reseeded
+SEED_VERSION = 1
+
+
+def generate_sample_data():
+    """Generate sample data if databases are empty"""
+    # Seeded by key rather than only into an empty collection: legacy users imported
+    # first must not keep out the sample users the circles and events below refer to
+    users = {}
+    users["sample_user"] = {
+        "user_id": "usr_123",
+        "full_name": "John Doe",
+        "email": "john@example.com",
+        "account_type": "general",
+        "verified": True,
+        "joined_date": datetime.now().strftime("%Y-%m-%d"),
+        "interests": ["music", "tech"],
+        "location": {"city": "New York", "lat": 40.7128, "lng": -74.0060},
+        "profile_pic": "https://randomuser.me/api/portraits/men/1.jpg"
+    }
+    
+    # Add UAE sample user
+    users["uae_user"] = {
+        "user_id": "usr_124",
+        "full_name": "Ahmed Al Maktoum",
+        "email": "ahmed@example.com",
+        "account_type": "general",
+        "verified": True,
+        "joined_date": datetime.now().strftime("%Y-%m-%d"),
+        "interests": ["photography", "food"],
+        "location": {"city": "Dubai", "lat": 25.2048, "lng": 55.2708},
+        "profile_pic": "https://randomuser.me/api/portraits/men/30.jpg"
+    }
+    for username, user in users.items():
+        if storage.get("users", username) is None:
+            accounts.create(username, dict(user, password=passwords.hash_password("password123")))
+    
+    circles = storage.load("circles", writable=True)
+    if not circles:
+        # Original circle
+        circles["cir_123"] = {
+            "circle_id": "cir_123",
+            "name": "NYC Photographers",
+            "description": "For photography enthusiasts in NYC",
+            "type": "public",
+            "location": {"city": "New York", "lat": 40.7128, "lng": -74.0060},
+            "image": "Images/nycphotography.jpg",
+            "members": ["usr_123"],
+            "events": ["evt_123"],
+            "business_owned": False,
+            "created_at": datetime.now().isoformat()
+        }
+        
+        # UAE circles
+        circles["cir_124"] = {
+            "circle_id": "cir_124",
+            "name": "Dubai Photography Enthusiasts",
+            "description": "For photography lovers in Dubai to share and learn",
+            "type": "public",
+            "location": {"city": "Dubai", "lat": 25.2048, "lng": 55.2708},
+            "image": "Images/photographygroup.jpg",
+            "members": ["usr_124"],
+            "events": ["evt_124"],
+            "business_owned": False,
+            "created_at": datetime.now().isoformat(),
+            "tags": ["photography", "dubai"]
+        }
+        
+        circles["cir_125"] = {
+            "circle_id": "cir_125",
+            "name": "Sharjah Foodies",
+            "description": "Discover and share the best food spots in Sharjah",
+            "type": "public",
+            "location": {"city": "Sharjah", "lat": 25.3463, "lng": 55.4209},
+            "image": "Images/foodies.jpg",
+            "members": [],
+            "events": ["evt_125"],
+            "business_owned": False,
+            "created_at": datetime.now().isoformat(),
+            "tags": ["food", "sharjah"]
+        }
+        
+        circles["cir_126"] = {
+            "circle_id": "cir_126",
+            "name": "Sheikh Zayed Road Business Network",
+            "description": "Professional networking for businesses along SZ Road",
+            "type": "private",
+            "location": {"city": "Dubai", "lat": 25.2048, "lng": 55.2708},
+            "image": "Images/businessnetworks.webp",
+            "members": [],
+            "events": [],
+            "business_owned": True,
+            "created_at": datetime.now().isoformat(),
+            "tags": ["business", "networking"]
+        }
+        storage.save("circles", circles)
+    
+    events = storage.load("events", writable=True)
+    if not events:
+        # Original event
+        events["evt_123"] = {
+            "event_id": "evt_123",
+            "circle_id": "cir_123",
+            "name": "Sunset Photography Meetup",
+            "description": "Let's capture the sunset together!",
+            "location": {"name": "Brooklyn Bridge", "city": "New York", "lat": 40.7061, "lng": -73.9969},
+            "date": datetime.now().strftime("%Y-%m-%d"),
+            "time": "18:00",
+            "organizer": "usr_123",
+            "attendees": ["usr_123"],
+            "capacity": 20,
+            "tags": ["photography", "outdoors"],
+            "created_at": datetime.now().isoformat()
+        }
+        
+        # UAE events
+        events["evt_124"] = {
+            "event_id": "evt_124",
+            "circle_id": "cir_124",
+            "name": "Burj Khalifa Night Photography",
+            "description": "Night photography session at Burj Khalifa",
+            "location": {"name": "Burj Khalifa, Dubai", "city": "Dubai", "lat": 25.1972, "lng": 55.2744},
+            "date": (datetime.now() + timedelta(days=7)).strftime("%Y-%m-%d"),
+            "time": "19:00",
+            "organizer": "usr_124",
+            "attendees": ["usr_124"],
+            "capacity": 15,
+            "tags": ["photography", "dubai", "landmarks"],
+            "image": "Images/burjkhalifasunset.jpg",
+            "created_at": datetime.now().isoformat()
+        }
+        
+        events["evt_125"] = {
+            "event_id": "evt_125",
+            "circle_id": "cir_125",
+            "name": "Sharjah Street Food Tour",
+            "description": "Explore hidden street food gems in Sharjah",
+            "location": {"name": "Al Qasba, Sharjah", "city": "Sharjah", "lat": 25.3471, "lng": 55.3913},
+            "date": (datetime.now() + timedelta(days=14)).strftime("%Y-%m-%d"),
+            "time": "18:00",
+            "organizer": "usr_124",
+            "attendees": [],
+            "capacity": 10,
+            "tags": ["food", "sharjah", "tour"],
+            "created_at": datetime.now().isoformat()
+        }
+        storage.save("events", events)
+    
+    # Ensure sample users have notifications
+    if not notifications.latest("usr_123", 1):
+        notifications.add("usr_123", "welcome", "Welcome to Atmosphere! Get started by joining a circle.")
+    
+    if not notifications.latest("usr_124", 1):
+        notifications.add("usr_124", "welcome", "Welcome to Atmosphere! Discover events in Dubai.")
+
+
+def bootstrap(force=False):
+    """Create the schema and seed sample data once; safe to call repeatedly"""
+    storage.init_storage()
+    notifications.init()
+    accounts.import_legacy()
+    if not force and int(storage.get_meta("seed_version", 0)) >= SEED_VERSION:
+        return False
+    generate_sample_data()
+    storage.set_meta("seed_version", SEED_VERSION)
+    return True
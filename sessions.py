@@ -0,0 +1,94 @@
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+import storage
+
+# Idle time after which a login session is forgotten
+SESSION_TTL = int(os.environ.get("ATMOSPHERE_SESSION_TTL", 7 * 24 * 3600))
+MAX_SESSIONS = 100000
+PROFILE_CACHE_SIZE = 10000
+
+_sessions = OrderedDict()  # session_id -> [user_id, username, last_seen], least recently seen first
+_profiles = OrderedDict()  # user_id -> (generation, profile)
+_lock = threading.Lock()
+
+
+def start(username, user):
+    """Open a session for a freshly authenticated user; returns the session id"""
+    session_id = secrets.token_urlsafe(24)
+    with _lock:
+        _sessions[session_id] = [user["user_id"], username, time.monotonic()]
+        while len(_sessions) > MAX_SESSIONS:
+            _sessions.popitem(last=False)
+    _remember(user["user_id"], storage.generation("users"), user)
+    return session_id
+
+
+def _touch(session_id):
+    # Returns (user_id, username) for a live session, expiring it if idle too long
+    now = time.monotonic()
+    with _lock:
+        entry = _sessions.get(session_id)
+        if entry is None:
+            return None
+        if now - entry[2] > SESSION_TTL:
+            del _sessions[session_id]
+            return None
+        entry[2] = now
+        _sessions.move_to_end(session_id)
+        return entry[0], entry[1]
+
+
+def user_id(session_id):
+    """The user a session belongs to, or None if it ended or expired"""
+    identity = _touch(session_id)
+    return identity[0] if identity else None
+
+
+def profile(session_id):
+    """Current profile for a session, or None if logged out.
+
+    Profiles are shared by every session of a user and reused until the
+    users collection is written, so a change made anywhere is seen on the
+    next rerun without reading the whole collection.
+    """
+    identity = _touch(session_id)
+    if identity is None:
+        return None
+    uid, username = identity
+    generation = storage.generation("users")
+    with _lock:
+        cached = _profiles.get(uid)
+        if cached is not None and cached[0] == generation:
+            _profiles.move_to_end(uid)
+            return cached[1]
+    user = storage.get("users", username)
+    if user is None or user.get("user_id") != uid:
+        end(session_id)  # account removed or renamed
+        return None
+    _remember(uid, generation, user)
+    return user
+
+
+def _remember(uid, generation, user):
+    with _lock:
+        _profiles[uid] = (generation, user)
+        _profiles.move_to_end(uid)
+        while len(_profiles) > PROFILE_CACHE_SIZE:
+            _profiles.popitem(last=False)
+
+
+def invalidate(uid):
+    """Drop a user's cached profile so the next read goes to storage"""
+    with _lock:
+        _profiles.pop(uid, None)
+
+
+def end(session_id):
+    """Log a session out and forget the user's cached profile"""
+    with _lock:
+        entry = _sessions.pop(session_id, None)
+    if entry is not None:
+        invalidate(entry[0])
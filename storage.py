@@ -0,0 +1,1074 @@
+import bisect
+import copy
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locks only
+    fcntl = None
+
+# ===== STORAGE CONFIGURATION =====
+DB_FILES = {
+    "users": "data/users.json",
+    "businesses": "data/businesses.json",
+    "media": "data/media.json",
+    "circles": "data/circles.json",
+    "events": "data/events.json",
+    "promotions": "data/promotions.json",
+    "notifications": "data/notifications.json",
+    "reports": "data/reports.json",
+    "blobs": "data/blobs.json",
+    "metrics": "data/metrics.json"
+}
+
+DICT_COLLECTIONS = ["users", "businesses", "circles", "events", "promotions", "notifications", "blobs", "metrics"]
+LIST_COLLECTIONS = ["media", "reports"]
+
+# Field used as the record key for collections stored as JSON lists
+RECORD_KEYS = {
+    "media": "media_id",
+    "reports": "report_id"
+}
+
+# Secondary indexes: name -> (collection, function of (key, record) returning the terms it is filed under)
+INDEXES = {
+    "user_circles": ("circles", lambda key, r: r.get("members") or []),
+    "circle_events": ("events", lambda key, r: [r.get("circle_id")]),
+    "user_media": ("media", lambda key, r: [r.get("user_id")]),
+    "source_media": ("media", lambda key, r: [r.get("source_digest")]),
+    "owner_business": ("businesses", lambda key, r: [r.get("owner_id")]),
+    "business_promotions": ("promotions", lambda key, r: [r.get("business_id")]),
+    "email_user": ("users", lambda key, r: [normalize_email(r.get("email"))]),
+    "username_user": ("users", lambda key, r: [normalize_username(key)]),
+    "id_user": ("users", lambda key, r: [r.get("user_id")]),
+    # Terms are "<scope>|<date>T<time>", so a range scan over one scope walks its events in date order
+    "event_schedule": ("events", lambda key, r: schedule_terms(r))
+}
+# Indexes where a term may belong to at most one record; a write that breaks this raises DuplicateError
+UNIQUE_INDEXES = ("email_user", "username_user")
+
+SQLITE_PATH = os.environ.get("ATMOSPHERE_DB", "data/atmosphere.db")
+SCHEMA_VERSION = 2
+# Bump when INDEXES changes so existing databases rebuild them on startup
+INDEX_VERSION = 6
+
+# Optional write-ahead journal for the JSON backend (replayed on startup after a crash)
+JOURNAL_ENABLED = os.environ.get("ATMOSPHERE_JOURNAL", "0") == "1"
+
+# Optimistic update attempts before falling back to a locked read-modify-write
+UPDATE_RETRIES = 8
+
+# Memory budget for the shared read cache (bytes of serialized JSON)
+CACHE_MAX_BYTES = int(os.environ.get("ATMOSPHERE_CACHE_BYTES", 64 * 1024 * 1024))
+
+
+class ConflictError(Exception):
+    """A versioned write lost the race against a concurrent writer"""
+
+
+class DuplicateError(ConflictError):
+    """A write would file two records under the same term of a unique index"""
+
+    def __init__(self, index, term):
+        super().__init__(f"{index} already has an entry for {term!r}")
+        self.index = index
+        self.term = term
+
+
+def _backoff(attempt):
+    time.sleep(random.uniform(0, 0.002 * 2 ** min(attempt, 6)))
+
+
+def normalize_email(email):
+    """Case-fold and trim an email address for index lookups"""
+    return unicodedata.normalize("NFKC", email or "").strip().casefold() or None
+
+
+def normalize_username(username):
+    """Case-fold and trim a username so 'Bob' and ' bob' claim the same name"""
+    return unicodedata.normalize("NFKC", username or "").strip().casefold() or None
+
+
+def normalize_tag(tag):
+    """Case-fold a tag and drop a leading '#' so 'Food', '#food' and ' food ' match"""
+    return (tag or "").strip().lstrip("#").strip().lower()
+
+
+def normalize_city(city):
+    return unicodedata.normalize("NFKC", city or "").strip().casefold() or None
+
+
+def schedule_scopes(event):
+    """Scopes an event is listed under in the event_schedule index"""
+    scopes = {"all", f"circle:{event.get('circle_id')}"}
+    city = normalize_city((event.get("location") or {}).get("city"))
+    if city:
+        scopes.add(f"city:{city}")
+    scopes.update(f"tag:{normalize_tag(t)}" for t in event.get("tags") or [] if normalize_tag(t))
+    scopes.update(f"attendee:{user_id}" for user_id in event.get("attendees") or [])
+    return scopes
+
+
+def schedule_terms(event):
+    if not event.get("date"):
+        return []
+    when = f"{event['date']}T{event.get('time') or '00:00'}"
+    return [f"{scope}|{when}" for scope in schedule_scopes(event)]
+
+
+def index_terms(collection, key, record):
+    """Return {index name: set of terms} for every index over a collection"""
+    terms = {}
+    for name, (source, extract) in INDEXES.items():
+        if source == collection:
+            terms[name] = {str(t) for t in extract(key, record) if t} if record else set()
+    return terms
+
+
+def write_json_atomic(path, data, indent=2):
+    """Write JSON via temp file + fsync + os.replace so readers never see a partial file"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    # Persist the rename itself
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def empty_collection(collection):
+    """Return the empty value for a collection"""
+    return {} if collection in DICT_COLLECTIONS else []
+
+
+def record_key(collection, record, position=None):
+    """Return the key a list-collection record is stored under"""
+    key = record.get(RECORD_KEYS.get(collection, ""))
+    if key is None:
+        key = f"_{position}"
+    return str(key)
+
+
+def record_stamp(record):
+    """Short digest of a record's content, for spotting changed records between two reads"""
+    return hashlib.sha1(json.dumps(record, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _items(collection, data):
+    """Yield (key, record) pairs for a whole collection"""
+    if collection in DICT_COLLECTIONS:
+        yield from data.items()
+    else:
+        for position, record in enumerate(data):
+            yield record_key(collection, record, position), record
+
+
+class JSONBackend:
+    """Legacy backend that keeps each collection in its own JSON file"""
+
+    name = "json"
+
+    def __init__(self, files=None, journal=None):
+        self.files = files or DB_FILES
+        data_dir = os.path.dirname(next(iter(self.files.values())))
+        self.meta_path = os.path.join(data_dir, "meta.json")
+        self.journal_path = os.path.join(data_dir, "journal.log")
+        self.journal = JOURNAL_ENABLED if journal is None else journal
+        self._journal_lock = threading.Lock()
+        self._unapplied = 0  # journal entries this process logged but hasn't written yet
+        self._local = threading.local()
+        self._thread_locks = {collection: threading.RLock() for collection in self.files}
+        self._indexes = {}
+        self._sorted = {}
+
+    @contextmanager
+    def _locked(self, collection):
+        # Thread lock for this process plus an advisory flock for other processes
+        with self._thread_locks[collection]:
+            if fcntl is None:
+                yield
+                return
+            with open(self.files[collection] + ".lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _writing(self, collection):
+        """Collection lock for one write; the journal is truncated once every logged write is applied.
+
+        An entry left in the journal after its write landed would be replayed
+        on the next start over whatever was written since, rolling it back.
+        """
+        self._local.logged = False
+        try:
+            with self._locked(collection):
+                yield
+        finally:
+            if self._local.logged:
+                with self._journal_lock:
+                    self._unapplied -= 1
+                    if not self._unapplied:
+                        self._truncate()
+
+    def get_meta(self, name, default=None):
+        try:
+            with open(self.meta_path, "r") as f:
+                return json.load(f).get(name, default)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return default
+
+    def set_meta(self, name, value):
+        try:
+            with open(self.meta_path, "r") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            meta = {}
+        meta[name] = str(value)
+        write_json_atomic(self.meta_path, meta)
+
+    def init(self):
+        for collection, file_path in self.files.items():
+            if not os.path.exists(file_path):
+                write_json_atomic(file_path, empty_collection(collection), indent=None)
+        self.replay_journal()
+
+    def _log(self, op, collection, key=None, record=None):
+        # Write-ahead: the entry is durable before the collection file is replaced
+        if not self.journal:
+            return
+        entry = {"op": op, "collection": collection, "key": key, "record": record, "ts": time.time()}
+        with self._journal_lock:
+            with open(self.journal_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._unapplied += 1
+            self._local.logged = True
+
+    def replay_journal(self):
+        """Re-apply journaled mutations (idempotent) and truncate the journal.
+
+        Runs whether or not journaling is on, so a journal left by an earlier
+        run is never replayed later over newer writes. Every collection stays
+        locked throughout, so writes another process is making are neither
+        overwritten nor lost with the truncation.
+        """
+        with ExitStack() as stack:
+            for collection in sorted(self.files):
+                stack.enter_context(self._locked(collection))
+            try:
+                with open(self.journal_path, "r") as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                return 0
+            replayed = 0
+            for line in lines:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # torn final entry: its write never started
+                collection, key, record = entry["collection"], entry["key"], entry["record"]
+                if entry["op"] == "save":
+                    self._write(collection, record)
+                elif entry["op"] == "put":
+                    self._write(collection, self._with_record(self.load(collection), collection, key, record))
+                elif entry["op"] == "delete":
+                    self._write(collection, self._without_record(self.load(collection), collection, key))
+                replayed += 1
+            with self._journal_lock:
+                self._truncate()
+            return replayed
+
+    def _truncate(self):
+        # Caller holds _journal_lock
+        try:
+            if os.path.getsize(self.journal_path):
+                with open(self.journal_path, "w") as f:
+                    os.fsync(f.fileno())
+        except FileNotFoundError:
+            pass
+
+    def version(self, collection):
+        try:
+            stat = os.stat(self.files[collection])
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def load_sized(self, collection):
+        data = self.load(collection)
+        try:
+            return data, os.path.getsize(self.files[collection])
+        except OSError:
+            return data, 0
+
+    def load(self, collection):
+        # Writes are atomic, so a decode error means real corruption and is raised
+        try:
+            with open(self.files[collection], "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return empty_collection(collection)
+        if not isinstance(data, type(empty_collection(collection))):
+            return empty_collection(collection)
+        return data
+
+    def _write(self, collection, data):
+        write_json_atomic(self.files[collection], data)
+
+    def _with_record(self, data, collection, key, record):
+        if collection in DICT_COLLECTIONS:
+            data[key] = record
+            return data
+        for position, existing in enumerate(data):
+            if record_key(collection, existing, position) == key:
+                data[position] = record
+                return data
+        data.append(record)
+        return data
+
+    def _without_record(self, data, collection, key):
+        if collection in DICT_COLLECTIONS:
+            data.pop(key, None)
+            return data
+        return [r for p, r in enumerate(data) if record_key(collection, r, p) != key]
+
+    def save(self, collection, data):
+        with self._writing(collection):
+            self._log("save", collection, record=data)
+            self._write(collection, data)
+
+    def get(self, collection, key, default=None):
+        for item_key, record in _items(collection, self.load(collection)):
+            if item_key == key:
+                return record
+        return default
+
+    def get_versioned(self, collection, key):
+        # JSON records carry no version column; a content fingerprint plays that role
+        record = self.get(collection, key)
+        if record is None:
+            return None, None
+        return record, hashlib.sha1(json.dumps(record, sort_keys=True).encode()).hexdigest()
+
+    def _check_unique(self, collection, key, record):
+        # Caller holds the collection lock, so the lookup reflects every committed write
+        for name, terms in index_terms(collection, key, record).items():
+            if name not in UNIQUE_INDEXES:
+                continue
+            for term in terms:
+                if any(other != key for other in self.lookup(name, term)):
+                    raise DuplicateError(name, term)
+
+    def put_if_version(self, collection, key, record, version):
+        with self._writing(collection):
+            if self.get_versioned(collection, key)[1] != version:
+                return False
+            self._check_unique(collection, key, record)
+            self._log("put", collection, key, record)
+            self._write(collection, self._with_record(self.load(collection), collection, key, record))
+        return True
+
+    def put(self, collection, key, record):
+        with self._writing(collection):
+            self._check_unique(collection, key, record)
+            self._log("put", collection, key, record)
+            self._write(collection, self._with_record(self.load(collection), collection, key, record))
+
+    def update(self, collection, key, fn, default=None):
+        # The file lock already serializes writers, so no optimistic retry is needed here
+        with self._writing(collection):
+            data = self.load(collection)
+            record = next((r for k, r in _items(collection, data) if k == key), None)
+            if record is None:
+                if default is None:
+                    raise KeyError(key)
+                record = copy.deepcopy(default)
+            result = fn(record)
+            record = record if result is None else result
+            self._check_unique(collection, key, record)
+            self._log("put", collection, key, record)
+            self._write(collection, self._with_record(data, collection, key, record))
+        return record
+
+    def delete(self, collection, key):
+        with self._writing(collection):
+            self._log("delete", collection, key)
+            self._write(collection, self._without_record(self.load(collection), collection, key))
+
+    def get_many(self, collection, keys):
+        wanted = set(keys)
+        return [r for k, r in _items(collection, self.load(collection)) if k in wanted]
+
+    def stamps(self, collection):
+        # No per-record versions in the files, so the stamp is a digest of the content
+        return {k: record_stamp(r) for k, r in _items(collection, self.load(collection))}
+
+    def items(self, collection, keys):
+        wanted = set(keys)
+        return [(k, r) for k, r in _items(collection, self.load(collection)) if k in wanted]
+
+    def lookup(self, index, term):
+        # No persistent index files; rebuild in memory whenever the file changes
+        collection = INDEXES[index][0]
+        version = self.version(collection)
+        cached = self._indexes.get(index)
+        if cached is None or cached[0] != version:
+            mapping = {}
+            for key, record in _items(collection, self.load(collection)):
+                for t in index_terms(collection, key, record)[index]:
+                    mapping.setdefault(t, []).append(key)
+            cached = self._indexes[index] = (version, mapping)
+        return list(cached[1].get(str(term), []))
+
+    def page(self, index, term, limit, cursor=None):
+        collection = INDEXES[index][0]
+        keys = set(self.lookup(index, term))
+        matches = [r for k, r in _items(collection, self.load(collection)) if k in keys][::-1]
+        start = int(cursor) if cursor else 0
+        end = start + limit
+        return matches[start:end], (str(end) if end < len(matches) else None)
+
+    def scan(self, index, low, high, limit, cursor=None):
+        self.lookup(index, low)  # refresh the in-memory index if the file changed
+        version, mapping = self._indexes[index]
+        cached = self._sorted.get(index)
+        if cached is None or cached[0] != version:
+            pairs = sorted((term, key) for term, keys in mapping.items() for key in keys)
+            cached = self._sorted[index] = (version, pairs)
+        pairs = cached[1]
+        start = bisect.bisect_right(pairs, tuple(cursor.split("\n", 1))) if cursor else bisect.bisect_left(pairs, (low, ""))
+        window = [pair for pair in pairs[start:start + limit + 1] if pair[0] < high]
+        records = dict(_items(INDEXES[index][0], self.load(INDEXES[index][0])))
+        next_cursor = "\n".join(window[limit - 1]) if len(window) > limit else None
+        return [records[key] for _, key in window[:limit]], next_cursor
+
+    def lookup_many(self, index, terms):
+        keys = []
+        for term in terms:
+            keys.extend(self.lookup(index, term))
+        return list(dict.fromkeys(keys))
+
+    def rebuild_indexes(self):
+        self._indexes.clear()
+        self._sorted.clear()
+
+
+class SQLiteBackend:
+    """Default backend: one row per record in a WAL-mode SQLite database"""
+
+    name = "sqlite"
+
+    def __init__(self, path=None):
+        self.path = path or SQLITE_PATH
+        self._local = threading.local()
+
+    def connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Autocommit mode; transactions are opened explicitly in transaction()
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def init(self):
+        with self.transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS generations (collection TEXT PRIMARY KEY, gen INTEGER NOT NULL)")
+            for collection in DB_FILES:
+                conn.execute("INSERT OR IGNORE INTO generations (collection, gen) VALUES (?, 0)", (collection,))
+                conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS "{collection}" (
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        key TEXT UNIQUE NOT NULL,
+                        data TEXT NOT NULL,
+                        version INTEGER NOT NULL DEFAULT 0
+                    )
+                """)
+                columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{collection}")')]
+                if "version" not in columns:
+                    conn.execute(f'ALTER TABLE "{collection}" ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS idx (
+                    name TEXT NOT NULL,
+                    term TEXT NOT NULL,
+                    record_key TEXT NOT NULL,
+                    seq INTEGER,
+                    PRIMARY KEY (name, term, record_key)
+                ) WITHOUT ROWID
+            """)
+            if "seq" not in [row[1] for row in conn.execute("PRAGMA table_info(idx)")]:
+                conn.execute("ALTER TABLE idx ADD COLUMN seq INTEGER")
+            # Lets page() walk one term's records in storage order without sorting
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_order ON idx (name, term, seq)")
+            conn.execute(
+                "INSERT INTO meta (name, value) VALUES ('schema_version', ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                (str(SCHEMA_VERSION),)
+            )
+        if self.get_meta("index_version") != str(INDEX_VERSION):
+            self.rebuild_indexes()
+
+    def _reindex(self, conn, collection, key, old_terms, new_terms, strict=True):
+        # strict: a term already claimed in a unique index aborts the write with DuplicateError;
+        # otherwise (bulk rebuilds of legacy data) the first record keeps the claim
+        for name, terms in new_terms.items():
+            old = old_terms.get(name, set())
+            conn.executemany(
+                "DELETE FROM idx WHERE name = ? AND term = ? AND record_key = ?",
+                [(name, t, key) for t in old - terms]
+            )
+            insert = (
+                f'INSERT {"" if strict and name in UNIQUE_INDEXES else "OR IGNORE "}'
+                f'INTO idx (name, term, record_key, seq) SELECT ?, ?, key, seq FROM "{collection}" WHERE key = ?'
+            )
+            for term in terms - old:
+                try:
+                    conn.execute(insert, (name, term, key))
+                except sqlite3.IntegrityError:
+                    raise DuplicateError(name, term) from None
+
+    def _rebuild_collection_indexes(self, conn, collection, items):
+        names = [name for name, (source, _) in INDEXES.items() if source == collection]
+        if not names:
+            return
+        conn.executemany("DELETE FROM idx WHERE name = ?", [(name,) for name in names])
+        for key, record in items:
+            self._reindex(conn, collection, key, {}, index_terms(collection, key, record), strict=False)
+
+    def rebuild_indexes(self):
+        """Recompute every secondary index from the stored records"""
+        with self.transaction() as conn:
+            # One record per term in UNIQUE_INDEXES, enforced by SQLite at insert time.
+            # Created before the rebuild so legacy duplicates are dropped, oldest record first.
+            conn.execute("DROP INDEX IF EXISTS idx_unique")
+            conn.executemany("DELETE FROM idx WHERE name = ?", [(name,) for name in UNIQUE_INDEXES])
+            names = ", ".join(f"'{name}'" for name in UNIQUE_INDEXES)
+            conn.execute(f"CREATE UNIQUE INDEX idx_unique ON idx (name, term) WHERE name IN ({names})")
+        for collection in {source for source, _ in INDEXES.values()}:
+            with self.transaction() as conn:
+                rows = conn.execute(f'SELECT key, data FROM "{collection}" ORDER BY seq').fetchall()
+                self._rebuild_collection_indexes(conn, collection, ((k, json.loads(d)) for k, d in rows))
+        self.set_meta("index_version", INDEX_VERSION)
+
+    def _old_terms(self, conn, collection, key):
+        if not any(source == collection for source, _ in INDEXES.values()):
+            return {}
+        row = conn.execute(f'SELECT data FROM "{collection}" WHERE key = ?', (key,)).fetchone()
+        return index_terms(collection, key, json.loads(row[0]) if row else None)
+
+    def lookup(self, index, term):
+        rows = self.connect().execute(
+            "SELECT record_key FROM idx WHERE name = ? AND term = ?", (index, str(term))
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def page(self, index, term, limit, cursor=None):
+        rows = self.connect().execute(
+            f'SELECT r.seq, r.data FROM idx JOIN "{INDEXES[index][0]}" r ON r.key = idx.record_key '
+            f'WHERE idx.name = ? AND idx.term = ? AND idx.seq < ? ORDER BY idx.seq DESC LIMIT ?',
+            (index, str(term), int(cursor) if cursor else 2 ** 62, limit + 1)
+        ).fetchall()
+        next_cursor = str(rows[limit - 1][0]) if len(rows) > limit else None
+        return [json.loads(data) for _, data in rows[:limit]], next_cursor
+
+    def scan(self, index, low, high, limit, cursor=None):
+        # Walks the (name, term, record_key) primary key, so the cost is one seek plus the page
+        after = cursor.split("\n", 1) if cursor else (low, "")
+        rows = self.connect().execute(
+            f'SELECT idx.term, idx.record_key, r.data FROM idx JOIN "{INDEXES[index][0]}" r ON r.key = idx.record_key '
+            f'WHERE idx.name = ? AND (idx.term, idx.record_key) > (?, ?) AND idx.term < ? '
+            f'ORDER BY idx.term, idx.record_key LIMIT ?',
+            (index, after[0], after[1], high, limit + 1)
+        ).fetchall()
+        next_cursor = "\n".join(rows[limit - 1][:2]) if len(rows) > limit else None
+        return [json.loads(data) for _, _, data in rows[:limit]], next_cursor
+
+    def lookup_many(self, index, terms):
+        terms = [str(t) for t in terms]
+        rows = []
+        conn = self.connect()
+        for start in range(0, len(terms), 500):
+            chunk = terms[start:start + 500]
+            rows.extend(conn.execute(
+                f'SELECT record_key FROM idx WHERE name = ? AND term IN ({",".join("?" * len(chunk))})',
+                [index] + chunk
+            ).fetchall())
+        return list(dict.fromkeys(row[0] for row in rows))
+
+    def get_many(self, collection, keys):
+        keys = list(keys)
+        rows = []
+        conn = self.connect()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows.extend(conn.execute(
+                f'SELECT seq, data FROM "{collection}" WHERE key IN ({",".join("?" * len(chunk))})', chunk
+            ).fetchall())
+        return [json.loads(data) for _, data in sorted(rows)]
+
+    def stamps(self, collection):
+        # seq changes when a key is deleted and re-inserted, version on every update
+        rows = self.connect().execute(f'SELECT key, seq, version FROM "{collection}"').fetchall()
+        return {key: f"{seq}.{version}" for key, seq, version in rows}
+
+    def items(self, collection, keys):
+        keys = list(keys)
+        rows = []
+        conn = self.connect()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows.extend(conn.execute(
+                f'SELECT seq, key, data FROM "{collection}" WHERE key IN ({",".join("?" * len(chunk))})', chunk
+            ).fetchall())
+        return [(key, json.loads(data)) for _, key, data in sorted(rows)]
+
+    def get_meta(self, name, default=None):
+        row = self.connect().execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, name, value):
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO meta (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                (name, str(value))
+            )
+
+    def bump(self, conn, collection):
+        conn.execute("UPDATE generations SET gen = gen + 1 WHERE collection = ?", (collection,))
+
+    def version(self, collection):
+        row = self.connect().execute("SELECT gen FROM generations WHERE collection = ?", (collection,)).fetchone()
+        return row[0] if row else None
+
+    def load_sized(self, collection):
+        rows = self.connect().execute(f'SELECT key, data FROM "{collection}" ORDER BY seq').fetchall()
+        size = sum(len(data) for _, data in rows)
+        if collection in DICT_COLLECTIONS:
+            return {key: json.loads(data) for key, data in rows}, size
+        return [json.loads(data) for _, data in rows], size
+
+    def load(self, collection):
+        return self.load_sized(collection)[0]
+
+    def save(self, collection, data):
+        rows = [(key, json.dumps(record)) for key, record in _items(collection, data)]
+        with self.transaction() as conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS _keep (key TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM _keep")
+            conn.executemany("INSERT OR IGNORE INTO _keep (key) VALUES (?)", [(key,) for key, _ in rows])
+            conn.execute(f'DELETE FROM "{collection}" WHERE key NOT IN (SELECT key FROM _keep)')
+            conn.executemany(
+                f'INSERT INTO "{collection}" (key, data) VALUES (?, ?) '
+                f'ON CONFLICT(key) DO UPDATE SET data = excluded.data, version = version + 1 '
+                f'WHERE data != excluded.data',
+                rows
+            )
+            self._rebuild_collection_indexes(conn, collection, _items(collection, data))
+            self.bump(conn, collection)
+
+    def get(self, collection, key, default=None):
+        row = self.connect().execute(f'SELECT data FROM "{collection}" WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def put(self, collection, key, record):
+        with self.transaction() as conn:
+            old_terms = self._old_terms(conn, collection, key)
+            conn.execute(
+                f'INSERT INTO "{collection}" (key, data) VALUES (?, ?) '
+                f'ON CONFLICT(key) DO UPDATE SET data = excluded.data, version = version + 1',
+                (key, json.dumps(record))
+            )
+            self._reindex(conn, collection, key, old_terms, index_terms(collection, key, record))
+            self.bump(conn, collection)
+
+    def get_versioned(self, collection, key):
+        row = self.connect().execute(
+            f'SELECT data, version FROM "{collection}" WHERE key = ?', (key,)
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else (None, None)
+
+    def put_if_version(self, collection, key, record, version):
+        """Write record only if the stored version still matches (None: only if absent)"""
+        with self.transaction() as conn:
+            old_terms = self._old_terms(conn, collection, key)
+            if version is None:
+                changed = conn.execute(
+                    f'INSERT INTO "{collection}" (key, data) VALUES (?, ?) ON CONFLICT(key) DO NOTHING',
+                    (key, json.dumps(record))
+                ).rowcount
+            else:
+                changed = conn.execute(
+                    f'UPDATE "{collection}" SET data = ?, version = version + 1 WHERE key = ? AND version = ?',
+                    (json.dumps(record), key, version)
+                ).rowcount
+            if changed:
+                self._reindex(conn, collection, key, old_terms, index_terms(collection, key, record))
+                self.bump(conn, collection)
+        return bool(changed)
+
+    def update(self, collection, key, fn, default=None):
+        # Optimistic: compute outside the write lock and commit only if nobody else wrote meanwhile
+        for attempt in range(UPDATE_RETRIES):
+            record, version = self.get_versioned(collection, key)
+            if record is None:
+                if default is None:
+                    raise KeyError(key)
+                record = copy.deepcopy(default)
+            result = fn(record)
+            record = record if result is None else result
+            if self.put_if_version(collection, key, record, version):
+                return record
+            _backoff(attempt)
+        # Heavy contention: take the write lock so this attempt cannot lose
+        with self.transaction() as conn:
+            row = conn.execute(f'SELECT data FROM "{collection}" WHERE key = ?', (key,)).fetchone()
+            if row is None and default is None:
+                raise KeyError(key)
+            record = json.loads(row[0]) if row else copy.deepcopy(default)
+            old_terms = index_terms(collection, key, record if row else None)
+            result = fn(record)
+            record = record if result is None else result
+            conn.execute(
+                f'INSERT INTO "{collection}" (key, data) VALUES (?, ?) '
+                f'ON CONFLICT(key) DO UPDATE SET data = excluded.data, version = version + 1',
+                (key, json.dumps(record))
+            )
+            self._reindex(conn, collection, key, old_terms, index_terms(collection, key, record))
+            self.bump(conn, collection)
+        return record
+
+    def delete(self, collection, key):
+        with self.transaction() as conn:
+            old_terms = self._old_terms(conn, collection, key)
+            conn.execute(f'DELETE FROM "{collection}" WHERE key = ?', (key,))
+            self._reindex(conn, collection, key, old_terms, {name: set() for name in old_terms})
+            self.bump(conn, collection)
+
+
+class CollectionCache:
+    """Process-wide LRU of parsed collections, revalidated against a version token"""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # collection -> (token, data, size)
+        self._generations = {}  # in-process write generation per collection
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def token(self, backend, collection):
+        return (backend.name, self._generations.get(collection, 0), backend.version(collection))
+
+    def get(self, collection, token):
+        with self._lock:
+            entry = self._entries.get(collection)
+            if entry is not None and entry[0] == token:
+                self._entries.move_to_end(collection)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, collection, token, data, size):
+        with self._lock:
+            self._drop(collection)
+            if size > self.max_bytes:
+                return
+            self._entries[collection] = (token, data, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate(self, collection=None):
+        with self._lock:
+            if collection is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            self._generations[collection] = self._generations.get(collection, 0) + 1
+            self._drop(collection)
+
+    def _drop(self, collection):
+        entry = self._entries.pop(collection, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes
+            }
+
+
+cache = CollectionCache()
+
+
+BACKENDS = {
+    "json": JSONBackend,
+    "sqlite": SQLiteBackend
+}
+
+_backend = None
+
+
+def get_backend():
+    """Return the active storage backend (ATMOSPHERE_STORAGE, default sqlite)"""
+    global _backend
+    if _backend is None:
+        _backend = BACKENDS[os.environ.get("ATMOSPHERE_STORAGE", "sqlite")]()
+    return _backend
+
+
+def set_backend(backend):
+    """Swap the active storage backend"""
+    global _backend
+    _backend = backend
+    cache.invalidate()
+
+
+def migrate_json_to_sqlite(backend=None, files=None, force=False):
+    """Copy the legacy data/*.json collections into SQLite once"""
+    backend = backend or get_backend()
+    source = JSONBackend(files)
+    if not force and backend.get_meta("migrated_from_json"):
+        return []
+    migrated = []
+    for collection, file_path in source.files.items():
+        if not os.path.exists(file_path):
+            continue
+        try:
+            data = source.load(collection)
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+        if data:
+            backend.save(collection, data)
+            migrated.append(collection)
+    backend.set_meta("migrated_from_json", time.strftime("%Y-%m-%dT%H:%M:%S"))
+    return migrated
+
+
+def init_storage():
+    """Create the storage schema and import legacy JSON data on first run"""
+    backend = get_backend()
+    backend.init()
+    if isinstance(backend, SQLiteBackend):
+        migrate_json_to_sqlite(backend)
+
+
+def get_meta(name, default=None):
+    return get_backend().get_meta(name, default)
+
+
+def set_meta(name, value):
+    get_backend().set_meta(name, value)
+
+
+def load(collection, writable=False):
+    """Load a whole collection through the shared cache.
+
+    The cached object is shared by every session, so it must be treated as
+    read-only. Callers that intend to mutate it pass writable=True and get
+    their own copy.
+    """
+    backend = get_backend()
+    token = cache.token(backend, collection)
+    data = cache.get(collection, token)
+    if data is None:
+        data, size = backend.load_sized(collection)
+        cache.put(collection, token, data, size)
+    return copy.deepcopy(data) if writable else data
+
+
+def generation(*collections):
+    """Version token that changes whenever any of the collections is written"""
+    backend = get_backend()
+    return tuple(cache.token(backend, collection) for collection in collections)
+
+
+def cache_stats():
+    """Hit/miss counters of the shared collection cache"""
+    return cache.stats()
+
+
+_listeners = []
+
+
+def on_write(fn):
+    """Register fn(collection, key, record) to run after each write made through this module.
+
+    record is None for a delete; key and record are both None after a
+    whole-collection save. Listeners see this process's writes only.
+    """
+    _listeners.append(fn)
+    return fn
+
+
+def _notify(collection, key, record):
+    for fn in _listeners:
+        try:
+            fn(collection, key, record)
+        except Exception:
+            # The write itself succeeded; a failing listener must not report it as failed
+            pass
+
+
+def save(collection, data):
+    get_backend().save(collection, data)
+    cache.invalidate(collection)
+    _notify(collection, None, None)
+
+
+def get(collection, key, default=None):
+    return get_backend().get(collection, key, default)
+
+
+def put(collection, key, record):
+    get_backend().put(collection, key, record)
+    cache.invalidate(collection)
+    _notify(collection, key, record)
+
+
+def update(collection, key, fn, default=None):
+    """Read-modify-write a single record without losing concurrent updates.
+
+    fn may mutate the record in place or return a replacement. It can be
+    called more than once if another writer gets in first, so it must not
+    have side effects beyond the record.
+    """
+    try:
+        record = get_backend().update(collection, key, fn, default)
+    finally:
+        cache.invalidate(collection)
+    _notify(collection, key, record)
+    return record
+
+
+def get_versioned(collection, key):
+    """Return (record, version) for optimistic writes; (None, None) if absent"""
+    return get_backend().get_versioned(collection, key)
+
+
+def put_if_version(collection, key, record, version):
+    """Compare-and-set: write only if the record's version is unchanged, else raise ConflictError"""
+    try:
+        if not get_backend().put_if_version(collection, key, record, version):
+            raise ConflictError(f"{collection}/{key} was modified concurrently")
+    finally:
+        cache.invalidate(collection)
+    _notify(collection, key, record)
+
+
+def delete(collection, key):
+    get_backend().delete(collection, key)
+    cache.invalidate(collection)
+    _notify(collection, key, None)
+
+
+def get_many(collection, keys):
+    """Load the records stored under keys, in storage order"""
+    return get_backend().get_many(collection, keys)
+
+
+def stamps(collection):
+    """{key: stamp} for every record, where a record's stamp changes whenever it is written.
+
+    Reads no record bodies on SQLite, so comparing two calls is a cheap way
+    to find what changed in between.
+    """
+    return get_backend().stamps(collection)
+
+
+def items(collection, keys):
+    """Return (key, record) pairs for keys, in storage order"""
+    return get_backend().items(collection, keys)
+
+
+def lookup(index, term):
+    """Return the record keys filed under term in a secondary index"""
+    return get_backend().lookup(index, term)
+
+
+def page(index, term, limit, cursor=None):
+    """Return (records filed under term, newest first; cursor for the next page or None)"""
+    return get_backend().page(index, term, limit, cursor)
+
+
+def scan(index, low, high, limit, cursor=None):
+    """Return (records whose term is in [low, high) in term order; cursor for the next page or None)"""
+    return get_backend().scan(index, low, high, limit, cursor)
+
+
+def lookup_many(index, terms):
+    """Return the record keys filed under any of terms, without duplicates"""
+    return get_backend().lookup_many(index, terms)
+
+
+def find(index, term):
+    """Return the records filed under term in a secondary index"""
+    return get_many(INDEXES[index][0], lookup(index, term))
+
+
+def rebuild_indexes():
+    get_backend().rebuild_indexes()